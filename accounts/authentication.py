@@ -0,0 +1,45 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import USER_CLAIMS, is_revoked
+
+
+class ClaimsUser(TokenUser):
+    """A request user built from token claims; exposes role and fullname without a query."""
+
+    def __str__(self):
+        return f"ClaimsUser {self.id}"
+
+    @property
+    def role(self):
+        return self.token.get('role')
+
+    @property
+    def fullname(self):
+        return self.token.get('fullname')
+
+    def is_student(self):
+        return self.role == 'student'
+
+    def is_teacher(self):
+        return self.role == 'teacher'
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the User lookup. Tokens carrying the user
+    claims become a ClaimsUser after a revocation check; older tokens fall
+    back to loading the user from the database.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        return ClaimsUser(validated_token)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_revocation_cache(app_configs, **kwargs):
+    alias = settings.JWT_REVOCATION_CACHE_ALIAS
+    if settings.CACHES.get(alias, {}).get('BACKEND') not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        f"JWT_REVOCATION_CACHE_ALIAS '{alias}' is not shared between processes.",
+        hint="Revoked tokens stay valid in every other process; point the alias at a shared cache such as Redis.",
+        id='accounts.W001',
+    )]
@@ -0,0 +1,60 @@
+"""
+Password hashing on a bounded thread pool.
+
+PBKDF2 is pure CPU, and hashlib releases the GIL while deriving keys, so
+running derivations on a fixed pool caps how many run at once (enrolment
+bursts no longer saturate every worker) while a bulk registration hashes
+a whole roster in parallel.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker = threading.local()
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1,
+                thread_name_prefix='password-hash',
+                initializer=_mark_worker,
+            )
+    return _executor
+
+
+def run(func, *args):
+    """Run func on the hashing pool and wait for it; inline when already on the pool."""
+    if getattr(_worker, 'active', False):
+        return func(*args)
+    return get_executor().submit(func, *args).result()
+
+
+def make_passwords(raw_passwords):
+    """Hash many passwords concurrently, in order."""
+    return list(get_executor().map(make_password, raw_passwords))
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's default PBKDF2-SHA256 hasher, with the same algorithm name and
+    stored format, whose key derivation (hashing and checking) runs on the pool.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return run(super().encode, password, salt, iterations)
+
+    def verify(self, password, encoded):
+        # The whole check runs on the pool; the encode() it calls there runs inline
+        return run(super().verify, password, encoded)
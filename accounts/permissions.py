@@ -1,5 +1,28 @@
 from rest_framework import permissions
 
+PAYLOAD_ROLES = ('student', 'teacher', 'admin')
+ANSWER_ROLES = ('teacher', 'admin')
+
+
+def payload_role(user):
+    """The role whose payload variant a caller gets; anonymous callers are treated as students."""
+    role = getattr(user, 'role', None) if user is not None and user.is_authenticated else None
+    return role if role in PAYLOAD_ROLES else 'student'
+
+
+def can_see_answers(user):
+    return payload_role(user) in ANSWER_ROLES
+
+
+def is_admin(user):
+    return bool(user and user.is_authenticated and (getattr(user, 'role', None) == 'admin' or user.is_staff))
+
+
 class IsTeacher(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.role == 'teacher'
+
+
+class IsAdmin(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return is_admin(request.user)
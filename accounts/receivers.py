@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import User
+from .tokens import USER_CLAIMS, revoke_tokens
+
+# Fields whose change makes outstanding tokens stale; the password is tracked separately
+REVOKING_FIELDS = USER_CLAIMS + ('is_active',)
+
+
+def _revoking_state(user):
+    # Read from __dict__ so that deferred fields are not loaded just to be remembered
+    return {field: user.__dict__[field] for field in REVOKING_FIELDS if field in user.__dict__}
+
+
+def _revoking_change(user):
+    """Whether the save being signalled changed the password, a claim or the active flag."""
+    # set_password() keeps the raw password until save() finishes; the rehash check_password() does
+    # when the hasher changes clears it first, as do saves that only touch last_login
+    if getattr(user, '_password', None) is not None:
+        return True
+    loaded = getattr(user, '_revoking_state', {})
+    current = _revoking_state(user)
+    # A field deferred at load time and set since is treated as changed
+    return any(field not in loaded or loaded[field] != value for field, value in current.items())
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    instance._revoking_state = _revoking_state(instance)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, **kwargs):
+    if not created and _revoking_change(instance):
+        revoke_tokens(instance.pk)
+    instance._revoking_state = _revoking_state(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    revoke_tokens(instance.pk)
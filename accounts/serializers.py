@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import User
+from .tokens import add_user_claims
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -17,3 +19,27 @@ class UserSerializer(serializers.ModelSerializer):
             role=validated_data['role']
         )
         return user
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+class RosterStudentSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    fullname = serializers.CharField(max_length=255)
+    password = serializers.CharField(write_only=True)
+
+class BulkRegisterSerializer(serializers.Serializer):
+    students = serializers.ListField(child=RosterStudentSerializer(), allow_empty=False, max_length=500)
+
+    def validate_students(self, value):
+        seen, duplicates = set(), set()
+        for student in value:
+            student['email'] = User.objects.normalize_email(student['email'])
+            if student['email'] in seen:
+                duplicates.add(student['email'])
+            seen.add(student['email'])
+        if duplicates:
+            raise serializers.ValidationError(f"Duplicate emails: {', '.join(sorted(duplicates))}")
+        return value
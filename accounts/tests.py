@@ -1,3 +1,209 @@
-from django.test import TestCase
+import math
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import hashers as django_hashers
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from course.models import Course
+from . import hashers
+from .authentication import ClaimsUser
+from .models import User
+from .tokens import clear_local_cache, revoke_tokens, tokens_for_user
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        caches[settings.JWT_REVOCATION_CACHE_ALIAS].clear()
+        clear_local_cache()
+        self.teacher = User.objects.create_user(
+            email='teacher@example.com', fullname='Teacher', password='pass12345', role='teacher'
+        )
+        self.course = Course.objects.create(title='Course', description='Description', author=self.teacher)
+        self.client = APIClient()
+
+    def obtain(self, email='teacher@example.com', password='pass12345'):
+        response = self.client.post(reverse('token_obtain_pair'), {'email': email, 'password': password}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_course(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return self.client.get(reverse('course-detail', args=[self.course.pk]))
+
+    def test_tokens_carry_role_and_fullname(self):
+        access = AccessToken(self.obtain()['access'])
+        self.assertEqual((access['role'], access['fullname']), ('teacher', 'Teacher'))
+
+        response = self.client.post(reverse('register'), {
+            'email': 'student@example.com', 'fullname': 'Student', 'password': 'pass12345', 'role': 'student',
+        }, format='json')
+        access = AccessToken(response.data['tokens']['access'])
+        self.assertEqual((access['role'], access['fullname']), ('student', 'Student'))
+
+    def test_refreshed_access_token_keeps_claims(self):
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.obtain()['refresh']}, format='json')
+        self.assertEqual(AccessToken(response.data['access'])['role'], 'teacher')
+
+    def test_cached_course_read_needs_no_queries(self):
+        access = self.obtain()['access']
+        self.get_course(access)
+        with self.assertNumQueries(0):
+            response = self.get_course(access)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.wsgi_request.user, ClaimsUser)
+
+    def later(self):
+        """Revocations made within the block fall in the second after any token issued so far."""
+        return mock.patch('accounts.tokens.time.time', return_value=time.time() + 1)
+
+    def test_user_changes_revoke_outstanding_tokens(self):
+        access = self.obtain()['access']
+        self.teacher.role = 'student'
+        with self.later():
+            self.teacher.save()
+        self.assertEqual(self.get_course(access).status_code, 401)
+        # Tokens issued after the change carry the new role
+        self.assertEqual(AccessToken(self.obtain()['access'])['role'], 'student')
+
+    def test_password_and_active_changes_revoke_outstanding_tokens(self):
+        for change in (lambda user: user.set_password('changed-123'), lambda user: setattr(user, 'is_active', False)):
+            caches[settings.JWT_REVOCATION_CACHE_ALIAS].clear()
+            access = tokens_for_user(self.teacher)['access']
+            user = User.objects.get(pk=self.teacher.pk)
+            change(user)
+            with self.later():
+                user.save()
+            self.assertEqual(self.get_course(access).status_code, 401)
+
+    def test_revocation_survives_churn_in_other_caches(self):
+        access = tokens_for_user(self.teacher)['access']
+        with self.later():
+            revoke_tokens(self.teacher.pk)
+            for alias in ('default', settings.COURSE_TREE_CACHE_ALIAS):
+                caches[alias].set_many({f'churn:{i}': i for i in range(6000)})
+            self.assertEqual(self.get_course(access).status_code, 401)
+
+    def test_token_issued_in_the_revoking_second_is_accepted(self):
+        revoke_tokens(self.teacher.pk)
+        self.assertEqual(self.get_course(self.obtain()['access']).status_code, 200)
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher', 'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    ])
+    def test_saves_that_keep_claims_and_password_do_not_revoke(self):
+        self.teacher.password = make_password('pass12345', hasher='pbkdf2_sha1')
+        self.teacher.save()
+        access = self.obtain()['access']
+        with self.later():
+            # Login records last_login and upgrades the hash to the preferred hasher
+            self.obtain()
+            self.teacher.refresh_from_db()
+            self.assertTrue(self.teacher.password.startswith('md5$'))
+            user = User.objects.get(pk=self.teacher.pk)
+            user.email = 'renamed@example.com'
+            user.save()
+        self.assertEqual(self.get_course(access).status_code, 200)
+
+    def test_tokens_without_claims_fall_back_to_database(self):
+        access = RefreshToken.for_user(self.teacher).access_token
+        self.get_course(str(access))
+        with self.assertNumQueries(1):
+            response = self.get_course(str(access))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.wsgi_request.user, User)
+
+    @override_settings(JWT_REVOCATION_LOCAL_TTL=60)
+    def test_local_cache_reuses_revocation_lookups(self):
+        access = self.obtain()['access']
+        self.get_course(access)
+        # A marker written behind the local cache's back is not seen until it expires
+        caches[settings.JWT_REVOCATION_CACHE_ALIAS].set(f'jwt-revoked:{self.teacher.pk}', 2 ** 40)
+        self.assertEqual(self.get_course(access).status_code, 200)
+        # Revoking through the API drops the local entry at once
+        revoke_tokens(self.teacher.pk)
+        caches[settings.JWT_REVOCATION_CACHE_ALIAS].set(f'jwt-revoked:{self.teacher.pk}', 2 ** 40)
+        self.assertEqual(self.get_course(access).status_code, 401)
+
+
+class BulkRegisterTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(
+            email='teacher@example.com', fullname='Teacher', password='pass12345', role='teacher'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def roster(self, count, start=0):
+        return {'students': [
+            {'email': f'student{i}@example.com', 'fullname': f'Student {i}', 'password': f'secret-{i}'}
+            for i in range(start, start + count)
+        ]}
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_creates_a_class_in_a_constant_number_of_queries(self):
+        fields = [f for f in User._meta.concrete_fields if not f.primary_key]
+        batches = math.ceil(300 / connection.ops.bulk_batch_size(fields, [None] * 300))
+        # Duplicate check, then the batched inserts inside a savepoint
+        with self.assertNumQueries(3 + batches):
+            response = self.client.post(reverse('register-bulk'), self.roster(300), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['users']), 300)
+        student = User.objects.get(email='student299@example.com')
+        self.assertEqual(student.role, 'student')
+        self.assertTrue(student.check_password('secret-299'))
+
+    def test_pooled_hashes_are_standard_pbkdf2(self):
+        response = self.client.post(reverse('register-bulk'), self.roster(2), format='json')
+        self.assertEqual(response.status_code, 201)
+        student = User.objects.get(email='student1@example.com')
+        self.assertTrue(student.password.startswith('pbkdf2_sha256$'))
+        login = APIClient().post(
+            reverse('token_obtain_pair'), {'email': 'student1@example.com', 'password': 'secret-1'}, format='json'
+        )
+        self.assertEqual(login.status_code, 200)
+
+    def test_password_checks_run_on_the_pool(self):
+        encoded = make_password('secret')
+        self.assertIsInstance(identify_hasher(encoded), hashers.PooledPBKDF2PasswordHasher)
+        threads = []
+
+        def pbkdf2(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return derive(*args, **kwargs)
+
+        derive = django_hashers.pbkdf2
+        with mock.patch('django.contrib.auth.hashers.pbkdf2', pbkdf2):
+            self.assertTrue(check_password('secret', encoded))
+            self.assertFalse(check_password('wrong', encoded))
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('password-hash') for name in threads))
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_rejects_duplicates_without_creating_anyone(self):
+        self.client.post(reverse('register-bulk'), self.roster(1), format='json')
+        response = self.client.post(reverse('register-bulk'), self.roster(3), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['emails'], ['student0@example.com'])
+
+        roster = self.roster(2)
+        roster['students'][1]['email'] = 'Student5@EXAMPLE.com'
+        roster['students'].append({'email': 'Student5@example.com', 'fullname': 'Again', 'password': 'x'})
+        self.assertEqual(self.client.post(reverse('register-bulk'), roster, format='json').status_code, 400)
+        self.assertEqual(User.objects.filter(role='student').count(), 1)
+
+    def test_only_teachers_can_register_a_roster(self):
+        self.client.force_authenticate(User.objects.create_user(
+            email='student@example.com', fullname='Student', password='pass12345', role='student'
+        ))
+        self.assertEqual(self.client.post(reverse('register-bulk'), self.roster(1), format='json').status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(reverse('register-bulk'), self.roster(1), format='json').status_code, 401)
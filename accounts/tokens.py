@@ -0,0 +1,86 @@
+"""
+JWT claims and revocation.
+
+Access tokens carry the user's role and fullname so requests can be
+authenticated without loading the User row (see authentication.py). Claims
+can go stale, so a change to a user's claims, password or active flag stores
+a revocation marker: tokens issued before it are rejected. A marker only has
+to outlive the tokens it revokes, so it is kept in the cache for the longest
+token lifetime, in a cache alias of its own that is never culled. Every
+process must see it, so that cache has to be a shared backend wherever more
+than one process serves requests.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+USER_CLAIMS = ('role', 'fullname')
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def refresh_token_for_user(user):
+    # Claims on the refresh token are copied into every access token minted from it
+    return add_user_claims(RefreshToken.for_user(user), user)
+
+
+def tokens_for_user(user):
+    refresh = refresh_token_for_user(user)
+    return {
+        "refresh": str(refresh),
+        "access": str(refresh.access_token),
+    }
+
+
+def _cache():
+    return caches[settings.JWT_REVOCATION_CACHE_ALIAS]
+
+
+def _revocation_key(user_id):
+    return f"jwt-revoked:{user_id}"
+
+
+def _marker_ttl():
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    return int(lifetime.total_seconds()) + 60
+
+
+# user_id -> (expires at, marker); only used when JWT_REVOCATION_LOCAL_TTL is set
+_local = {}
+
+
+def revoke_tokens(user_id):
+    """Reject every token issued to the user before the current second."""
+    # "iat" has whole-second precision: a token issued within the revoking second, such as the one a
+    # login right after a password change returns, stays valid, and so would a stale one of that second
+    _cache().set(_revocation_key(user_id), int(time.time()), _marker_ttl())
+    _local.pop(user_id, None)
+
+
+def revoked_before(user_id):
+    """Issue time before which the user's tokens are rejected, or None."""
+    ttl = settings.JWT_REVOCATION_LOCAL_TTL
+    if ttl:
+        cached = _local.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+    marker = _cache().get(_revocation_key(user_id))
+    if ttl:
+        _local[user_id] = (time.monotonic() + ttl, marker)
+    return marker
+
+
+def is_revoked(token):
+    marker = revoked_before(token[api_settings.USER_ID_CLAIM])
+    return marker is not None and token.get('iat', 0) < marker
+
+
+def clear_local_cache():
+    _local.clear()
@@ -1,8 +1,12 @@
+from django.db import IntegrityError, transaction
 from django.shortcuts import render
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import UserSerializer
+from .hashers import make_passwords
+from .models import User
+from .permissions import IsTeacher
+from .serializers import BulkRegisterSerializer, UserSerializer
+from .tokens import tokens_for_user
 
 class RegisterView(generics.CreateAPIView):
     permission_classes = (permissions.AllowAny,)
@@ -13,13 +17,43 @@ class RegisterView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         
-        refresh = RefreshToken.for_user(user)
-        
         return Response({
             "user": UserSerializer(user, context=self.get_serializer_context()).data,
             "message": "User created successfully",
-            "tokens": {
-                "refresh": str(refresh),
-                "access": str(refresh.access_token),
-            }
+            "tokens": tokens_for_user(user),
+        }, status=status.HTTP_201_CREATED)
+
+class BulkRegisterView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated, IsTeacher)
+    serializer_class = BulkRegisterSerializer
+
+    def post(self, request, *args, **kwargs):
+        """
+        Create a roster of student accounts in one transaction. Nothing is
+        created if any email is invalid, repeated or already registered.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        students = serializer.validated_data['students']
+
+        emails = [student['email'] for student in students]
+        existing = sorted(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        if existing:
+            return Response({"error": "Users already exist", "emails": existing}, status=status.HTTP_400_BAD_REQUEST)
+
+        passwords = make_passwords([student['password'] for student in students])
+        users = [
+            User(email=student['email'], fullname=student['fullname'], role='student', password=password)
+            for student, password in zip(students, passwords)
+        ]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+        except IntegrityError:
+            # Someone registered one of the emails since the check above
+            return Response({"error": "Users already exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "users": UserSerializer(users, many=True).data,
+            "message": f"{len(users)} students created successfully",
         }, status=status.HTTP_201_CREATED)
@@ -0,0 +1,36 @@
+"""
+Standalone benchmarks. Run from the project root, e.g.
+
+    python -m benchmarks.generation_concurrency
+
+Each benchmark builds a throwaway database so it never touches db.sqlite3.
+"""
+import contextlib
+import os
+import tempfile
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ongo.settings')
+    import django
+    from django.test.utils import setup_test_environment
+    django.setup()
+    # Allows the 'testserver' host used by Django's test clients
+    setup_test_environment()
+
+
+@contextlib.contextmanager
+def benchmark_database(alias='default'):
+    """Create a migrated scratch database for the duration of the block."""
+    from django.db import connections
+
+    connection = connections[alias]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if connection.vendor == 'sqlite':
+            # A file database lets worker threads share data, unlike :memory:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield connection
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,106 @@
+"""
+Measure write throughput of parallel add_question-style writes for each
+database mode configured through the DB_* / SQLITE_* environment variables.
+
+    python -m benchmarks.db_write_concurrency --threads 16 --writes 100
+    python -m benchmarks.db_write_concurrency --modes sqlite-tuned postgresql
+
+Every mode runs in a fresh process so the settings module picks up its
+environment. The postgresql mode uses the DB_NAME/DB_USER/... variables of
+the calling shell and creates a throwaway test database.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from . import benchmark_database, setup_django
+
+MODES = {
+    'sqlite-default': {'DB_ENGINE': 'sqlite', 'SQLITE_TUNED': 'False'},
+    'sqlite-tuned': {'DB_ENGINE': 'sqlite', 'SQLITE_TUNED': 'True'},
+    'postgresql': {'DB_ENGINE': 'postgresql'},
+}
+
+
+def run_mode(mode, threads, writes):
+    setup_django()
+    from django.db import OperationalError, connections, transaction
+    from accounts.models import User
+    from course.models import Course, Lesson, TrueFalseQuestion
+
+    with benchmark_database():
+        teacher = User.objects.create_user(email='bench@example.com', fullname='Bench', password='bench', role='teacher')
+        course = Course.objects.create(title='Bench', description='', author=teacher)
+        lesson = Lesson.objects.create(course=course, title='Practice', type='practice')
+
+        ok, errors = [], []
+        barrier = threading.Barrier(threads)
+
+        def writer(worker):
+            done = failed = 0
+            barrier.wait()
+            try:
+                for i in range(writes):
+                    try:
+                        # Same shape as LessonViewSet.add_question: lesson lookup, then a two-table insert
+                        with transaction.atomic():
+                            target = Lesson.objects.get(pk=lesson.pk)
+                            TrueFalseQuestion.objects.create(lesson=target, text=f'{worker}-{i}', correct_answer=True)
+                        done += 1
+                    except OperationalError:
+                        failed += 1
+            finally:
+                connections.close_all()
+            ok.append(done)
+            errors.append(failed)
+
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+    return {
+        'mode': mode,
+        'threads': threads,
+        'writes': sum(ok),
+        'errors': sum(errors),
+        'elapsed': round(elapsed, 3),
+        'writes_per_sec': round(sum(ok) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['sqlite-default', 'sqlite-tuned'])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=100, help='writes per thread')
+    parser.add_argument('--run-mode', choices=sorted(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.threads, args.writes)))
+        return
+
+    print(f"{'mode':<16}{'threads':>8}{'writes':>8}{'errors':>8}{'seconds':>10}{'writes/s':>10}")
+    for mode in args.modes:
+        env = {**os.environ, **MODES[mode]}
+        command = [sys.executable, '-m', 'benchmarks.db_write_concurrency', '--run-mode', mode,
+                   '--threads', str(args.threads), '--writes', str(args.writes)]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            print(f"{mode:<16} failed:\n{completed.stderr}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"{mode:<16}{result['threads']:>8}{result['writes']:>8}{result['errors']:>8}"
+              f"{result['elapsed']:>10}{result['writes_per_sec']:>10}")
+
+
+if __name__ == '__main__':
+    main()
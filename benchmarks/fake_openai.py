@@ -0,0 +1,142 @@
+"""
+A local stand-in for the OpenAI chat completions API with configurable latency.
+
+    with FakeOpenAIServer(latency=0.5) as server:
+        settings.OPENAI_API_BASE = server.base_url
+
+Question prompts get as many distinct questions as they ask for, per lesson
+key for packed prompts (see course/planner.py). token_latency adds a delay
+per completion token, as real models generate replies token by token.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+
+from aiohttp import web
+
+QUESTIONS = [
+    {'question': 'Which force keeps a ball on the ground?', 'options': ['Gravity', 'Friction', 'Magnetism', 'Tension'], 'correct_answer_index': 0},
+    {'question': 'What is the unit of force?', 'options': ['Joule', 'Newton', 'Watt', 'Pascal'], 'correct_answer_index': 1},
+]
+
+READING = "# Forces\n\n## Introduction\n\nForces change how objects move.\n"
+
+
+SECTION_RE = re.compile(r'^(L\d+): (.*) - (\d+) questions$', re.MULTILINE)
+COUNT_RE = re.compile(r'Create (\d+) one-choice questions about (.*?) for a')
+
+
+def distinct_questions(topic, count, lesson=None):
+    """count questions whose text differs enough between each other to pass deduplication."""
+    questions = []
+    for i in range(count):
+        digest = hashlib.sha1(f'{topic}:{i}'.encode()).hexdigest()
+        question = {**QUESTIONS[i % len(QUESTIONS)], 'question': f'{topic} {digest}?'}
+        if lesson is not None:
+            question['lesson'] = lesson
+        questions.append(question)
+    return questions
+
+
+def reply_for(messages):
+    prompt = messages[-1]['content'] if messages else ''
+    sections = SECTION_RE.findall(prompt)
+    if sections:
+        return json.dumps([
+            question for key, topic, count in sections for question in distinct_questions(topic, int(count), key)
+        ])
+    match = COUNT_RE.search(prompt)
+    if match:
+        return json.dumps(distinct_questions(match.group(2), int(match.group(1))))
+    if 'one-choice questions' in prompt:
+        return json.dumps(QUESTIONS)
+    return READING
+
+
+class FakeOpenAIServer:
+    def __init__(self, latency=0.5, token_latency=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/v1'
+
+    async def chat_completions(self, request):
+        self.requests += 1
+        body = await request.json()
+        content = reply_for(body.get('messages', []))
+        # About four characters a token
+        usage = {
+            'prompt_tokens': sum(len(message['content']) for message in body.get('messages', [])) // 4,
+            'completion_tokens': len(content) // 4,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        self.prompt_tokens += usage['prompt_tokens']
+        self.completion_tokens += usage['completion_tokens']
+        await asyncio.sleep(self.latency + self.token_latency * len(content) / 4)
+        if body.get('stream'):
+            return await self.stream_completion(request, body, content, usage)
+        return web.json_response({
+            'id': f'chatcmpl-{self.requests}',
+            'object': 'chat.completion',
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        })
+
+    async def stream_completion(self, request, body, content, usage):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for word in content.split(' '):
+            chunk = {
+                'id': f'chatcmpl-{self.requests}',
+                'object': 'chat.completion.chunk',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        if (body.get('stream_options') or {}).get('include_usage'):
+            chunk = {'id': f'chatcmpl-{self.requests}', 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage}
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,90 @@
+"""
+Compare concurrent reading-content generation throughput of the blocking
+sync path (a fixed pool of sync workers) and the async view on one event loop.
+
+    python -m benchmarks.generation_concurrency --requests 200 --latency 0.5 --sync-workers 4
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import benchmark_database, setup_django
+from .fake_openai import FakeOpenAIServer
+
+
+def run_sync(lessons, workers):
+    from django.db import connections
+    from course import generation
+
+    def handle(lesson):
+        try:
+            content = generation.generate_reading_markdown(lesson.course.title, f'sync topic {lesson.pk}', ['music'])
+            generation.save_reading_content(lesson, content)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(handle, lessons))
+    return time.perf_counter() - started
+
+
+async def run_async(lessons):
+    from django.test import AsyncClient
+    from django.urls import reverse
+
+    client = AsyncClient()
+    url = reverse('generate-reading-async')
+
+    async def handle(lesson):
+        response = await client.post(url, {
+            'course_id': lesson.course_id,
+            'lesson_id': lesson.pk,
+            'student_interests': ['music'],
+            'lesson_topic': f'async topic {lesson.pk}',
+        }, content_type='application/json')
+        assert response.status_code == 201, response.content
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(lesson) for lesson in lessons))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='fake OpenAI latency in seconds')
+    parser.add_argument('--sync-workers', type=int, default=4, help='sync workers serving the blocking path')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from course import llm
+    from accounts.models import User
+    from course.models import Course, Lesson
+
+    with benchmark_database(), FakeOpenAIServer(latency=args.latency) as server:
+        settings.OPENAI_API_BASE = server.base_url
+        settings.OPENAI_API_KEY = 'sk-bench'
+        # Let both paths keep every request in flight
+        settings.OPENAI_MAX_CONCURRENCY = settings.OPENAI_MAX_CONNECTIONS = args.requests
+        llm.reset_clients()
+        teacher = User.objects.create_user(email='bench@example.com', fullname='Bench', password='bench', role='teacher')
+        course = Course.objects.create(title='Physics', description='', author=teacher)
+        lessons = Lesson.objects.bulk_create(
+            Lesson(course=course, title=f'Lesson {i}', type='reading') for i in range(args.requests)
+        )
+        lessons = list(Lesson.objects.select_related('course').filter(course=course))
+
+        sync_elapsed = run_sync(lessons, args.sync_workers)
+        async_elapsed = asyncio.run(run_async(lessons))
+
+    print(f"requests={args.requests} latency={args.latency}s sync_workers={args.sync_workers}")
+    print(f"sync : {sync_elapsed:8.2f}s  {args.requests / sync_elapsed:8.1f} req/s")
+    print(f"async: {async_elapsed:8.2f}s  {args.requests / async_elapsed:8.1f} req/s")
+    print(f"speedup: {sync_elapsed / async_elapsed:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
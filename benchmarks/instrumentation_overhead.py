@@ -0,0 +1,69 @@
+"""
+Latency added by ongo.middleware.InstrumentationMiddleware, measured through
+the test client on a cached course read (no queries) and on the lesson list
+(one query per request plus the question prefetch). Batches alternate
+between the two configurations and the fastest batch of each is kept, so
+machine noise does not land on one side.
+
+    python -m benchmarks.instrumentation_overhead --requests 200 --batches 20
+"""
+import argparse
+import time
+
+from . import benchmark_database, setup_django
+
+
+def per_request(client, url, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get(url)
+    return (time.perf_counter() - started) / requests
+
+
+def make_client(user, url, enabled):
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(user)
+    # The middleware chain is built on the first request and reads METRICS_ENABLED then
+    with override_settings(METRICS_ENABLED=enabled):
+        client.get(url)
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per batch')
+    parser.add_argument('--batches', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.urls import reverse
+    from accounts.models import User
+    from course.models import Course, Lesson, TrueFalseQuestion
+
+    with benchmark_database():
+        teacher = User.objects.create_user(email='bench@example.com', fullname='Bench', password='bench', role='teacher')
+        course = Course.objects.create(title='Bench', description='', author=teacher)
+        for i in range(5):
+            lesson = Lesson.objects.create(course=course, title=f'Lesson {i}', type='practice')
+            for j in range(5):
+                TrueFalseQuestion.objects.create(lesson=lesson, text=f'TF {j}', correct_answer=True)
+
+        urls = {
+            'course detail (cached)': reverse('course-detail', args=[course.pk]),
+            'lesson list': reverse('lesson-list'),
+        }
+        for label, url in urls.items():
+            clients = {enabled: make_client(teacher, url, enabled) for enabled in (False, True)}
+            results = {False: float('inf'), True: float('inf')}
+            for _ in range(args.batches):
+                for enabled, client in clients.items():
+                    results[enabled] = min(results[enabled], per_request(client, url, args.requests))
+            overhead = results[True] / results[False] - 1
+            print(f"{label:24} off {results[False] * 1e6:7.1f} us  on {results[True] * 1e6:7.1f} us  overhead {overhead:+.1%}")
+
+
+if __name__ == '__main__':
+    main()
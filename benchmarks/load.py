@@ -0,0 +1,299 @@
+"""
+Load scenarios for the course API, run in-process against a seeded scratch
+database through the full middleware stack.
+
+Each scenario replays one kind of real traffic from several client threads
+and reports p50/p95/p99 latency, throughput and database queries per request
+(read from the Server-Timing header that InstrumentationMiddleware adds).
+With --thresholds the run fails, CI-style, when any figure regresses past
+the limits in the file (see benchmarks/thresholds.json).
+
+    python -m benchmarks.load
+    python -m benchmarks.load --scenarios course_detail,add_question --requests 500 --concurrency 8
+    python -m benchmarks.load --thresholds benchmarks/thresholds.json --json report.json
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+from . import benchmark_database, setup_django
+from .fake_openai import FakeOpenAIServer
+from .seed import PASSWORD, add_arguments as add_seed_arguments, seed_from_args
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Scenario:
+    """One kind of request. request() returns (response, expected statuses)."""
+    name = None
+    role = 'student'
+    default_requests = None
+
+    def __init__(self, dataset, tokens):
+        self.dataset = dataset
+        self.tokens = tokens
+
+    def setup(self, args):
+        return contextlib.nullcontext()
+
+    def request(self, client, rng, i):
+        raise NotImplementedError
+
+
+class CatalogueList(Scenario):
+    name = 'catalogue_list'
+
+    def request(self, client, rng, i):
+        return client.get('/api/courses/', {'page_size': 20}), (200,)
+
+
+class CourseDetail(Scenario):
+    """Steady-state course reads: every tree is cached before the clock starts."""
+    name = 'course_detail'
+
+    def setup(self, args):
+        from course import tree_cache
+
+        for course_id in self.dataset.course_ids:
+            tree_cache.get_payload(tree_cache.COURSE, course_id, 'student')
+        return contextlib.nullcontext()
+
+    def request(self, client, rng, i):
+        return client.get(f'/api/courses/{rng.choice(self.dataset.course_ids)}/'), (200,)
+
+
+class AddQuestion(Scenario):
+    name = 'add_question'
+    role = 'teacher'
+
+    def request(self, client, rng, i):
+        lesson_id = rng.choice(self.dataset.practice_lesson_ids)
+        if i % 2:
+            data = {'type': 'true_false', 'text': f'Load statement {i}', 'correct_answer': True}
+        else:
+            data = {
+                'type': 'multiple_choice', 'text': f'Load question {i}',
+                'options': ['a', 'b', 'c', 'd'], 'correct_answer': 'b',
+            }
+        return client.post(f'/api/lessons/{lesson_id}/add_question/', data, format='json'), (201,)
+
+
+class TokenObtain(Scenario):
+    name = 'token_obtain'
+    role = None
+    # Every request derives a full-strength PBKDF2 key
+    default_requests = 20
+
+    def request(self, client, rng, i):
+        email = f'student{rng.randrange(len(self.dataset.student_ids))}@bench.local'
+        return client.post('/api/auth/token/', {'email': email, 'password': PASSWORD}, format='json'), (200,)
+
+
+class TokenRefresh(Scenario):
+    name = 'token_refresh'
+    role = None
+
+    def request(self, client, rng, i):
+        refresh = self.tokens['refresh'][i % len(self.tokens['refresh'])]
+        return client.post('/api/auth/token/refresh/', {'refresh': refresh}, format='json'), (200,)
+
+
+class GenerateQuestions(Scenario):
+    name = 'generate_questions'
+    role = 'teacher'
+    default_requests = 50
+
+    @contextlib.contextmanager
+    def setup(self, args):
+        from django.test import override_settings
+        from course import llm
+
+        with FakeOpenAIServer(latency=args.llm_latency) as server, override_settings(
+            OPENAI_API_BASE=server.base_url, OPENAI_API_KEY='sk-bench', GENERATION_JOBS_EAGER=True,
+            # One teacher sends every request; measure the generation path, not the per-user limit
+            LLM_RATE_LIMIT_ENABLED=False,
+        ):
+            llm.reset_clients()
+            try:
+                yield
+            finally:
+                llm.reset_clients()
+
+    def __init__(self, dataset, tokens):
+        super().__init__(dataset, tokens)
+        # Only a course's author may generate its content, and the token is the first teacher's
+        self.lesson_ids = [
+            lesson_id for lesson_id in dataset.practice_lesson_ids
+            if dataset.course_authors[dataset.lesson_courses[lesson_id]] == dataset.teacher_ids[0]
+        ]
+
+    def request(self, client, rng, i):
+        lesson_id = rng.choice(self.lesson_ids)
+        data = {
+            'course_id': self.dataset.lesson_courses[lesson_id],
+            'lesson_id': lesson_id,
+            'student_interests': ['music', 'sport'],
+            # A fresh topic per request, so the generation cache never answers
+            'lesson_topic': f'Load topic {i}',
+            'num_questions': 2,
+        }
+        return client.post('/api/generate-questions/generate/', data, format='json'), (202,)
+
+
+SCENARIOS = {cls.name: cls for cls in (CatalogueList, CourseDetail, AddQuestion, TokenObtain, TokenRefresh, GenerateQuestions)}
+
+
+def run_scenario(scenario, requests, concurrency, random_seed):
+    from django.db import connections
+    from rest_framework.test import APIClient
+    from ongo.metrics import quantiles
+
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, queries, errors = [], [], []
+
+    def worker(worker_id):
+        rng = random.Random(random_seed * 1000 + worker_id)
+        client = APIClient()
+        if scenario.role:
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {scenario.tokens[scenario.role]}")
+        try:
+            while (i := next(counter)) < requests:
+                started = time.perf_counter()
+                response, expected = scenario.request(client, rng, i)
+                elapsed = time.perf_counter() - started
+                match = QUERIES.search(response.get('Server-Timing', ''))
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(int(match.group(1)) if match else 0)
+                    if response.status_code not in expected:
+                        errors.append(f"{response.status_code} {response.content[:200]!r}")
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latency = quantiles(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_rate': len(errors) / len(latencies) if latencies else 0.0,
+        'first_error': errors[0] if errors else None,
+        'p50_ms': latency[0.5] * 1000,
+        'p95_ms': latency[0.95] * 1000,
+        'p99_ms': latency[0.99] * 1000,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'queries_per_request': sum(queries) / len(queries) if queries else 0.0,
+    }
+
+
+# threshold key -> (result key, True when the limit is a maximum)
+CHECKS = {
+    'p50_ms': ('p50_ms', True),
+    'p95_ms': ('p95_ms', True),
+    'p99_ms': ('p99_ms', True),
+    'queries_per_request': ('queries_per_request', True),
+    'max_error_rate': ('error_rate', True),
+    'min_throughput': ('throughput', False),
+}
+
+
+def check_thresholds(results, thresholds):
+    """Return a list of regression messages; scenarios that did not run are skipped."""
+    failures = []
+    for name, limits in thresholds.items():
+        if name not in results:
+            continue
+        limits = {'max_error_rate': 0.0, **limits}
+        for key, limit in limits.items():
+            result_key, is_max = CHECKS[key]
+            value = results[name][result_key]
+            if (value > limit) if is_max else (value < limit):
+                failures.append(f"{name}: {result_key}={value:.4g} {'exceeds' if is_max else 'is below'} {limit}")
+    return failures
+
+
+def print_report(results):
+    print(f"{'scenario':20} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>7}")
+    for name, result in results.items():
+        print(
+            f"{name:20} {result['requests']:8d} {result['errors']:6d} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+            f"{result['p99_ms']:8.2f} {result['throughput']:8.1f} {result['queries_per_request']:7.2f}"
+        )
+        if result['first_error']:
+            print(f"  first error: {result['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario, unless it sets its own default')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads per scenario')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='fake OpenAI latency in seconds')
+    parser.add_argument('--thresholds', help='JSON file of per-scenario limits; exit 1 when one is exceeded')
+    parser.add_argument('--json', help='also write the results to this file')
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+    from accounts.models import User
+    from accounts.tokens import tokens_for_user
+
+    results = {}
+    with benchmark_database():
+        dataset = seed_from_args(args)
+        print(dataset.summary())
+        teacher = User.objects.get(pk=dataset.teacher_ids[0])
+        students = list(User.objects.filter(pk__in=dataset.student_ids[:50]))
+        tokens = {
+            'teacher': tokens_for_user(teacher)['access'],
+            'student': tokens_for_user(students[0])['access'],
+            'refresh': [tokens_for_user(student)['refresh'] for student in students],
+        }
+        # Pay for URLconf loading and lazy imports before any clock starts
+        APIClient().get('/api/courses/', HTTP_AUTHORIZATION=f"Bearer {tokens['student']}")
+        for name in names:
+            scenario = SCENARIOS[name](dataset, tokens)
+            for alias in ('default', settings.COURSE_TREE_CACHE_ALIAS):
+                caches[alias].clear()
+            with scenario.setup(args):
+                requests = min(args.requests, scenario.default_requests or args.requests)
+                results[name] = run_scenario(scenario, requests, args.concurrency, args.seed)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            failures = check_thresholds(results, json.load(f))
+        for failure in failures:
+            print(f"FAIL {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"All thresholds met ({args.thresholds})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare building question banks one prompt per ten questions, one call after
+another, with the packing planner (course/planner.py), against a fake OpenAI
+server whose latency grows with the length of the reply.
+
+    python -m benchmarks.question_packing --lessons 1 --questions 200
+    python -m benchmarks.question_packing --lessons 8 --questions 25 --latency 0.5 --token-latency 0.005
+"""
+import argparse
+import math
+import time
+
+from . import benchmark_database, setup_django
+from .fake_openai import FakeOpenAIServer
+
+PER_PROMPT = 10
+
+
+def run_per_prompt(course, lessons, questions):
+    from course import generation
+
+    created = 0
+    for lesson in lessons:
+        for part in range(math.ceil(questions / PER_PROMPT)):
+            count = min(PER_PROMPT, questions - part * PER_PROMPT)
+            data = generation.generate_questions_data(course.title, f'{lesson.title} part {part}', ['music'], count)
+            created += len(generation.save_questions(lesson, data))
+    return created
+
+
+def run_packed(course, lessons, questions):
+    from course import planner
+
+    results = planner.generate_bank(course.title, ['music'], [(lesson, lesson.title, questions) for lesson in lessons])
+    return sum(result['questions_created'] for result in results)
+
+
+def measure(server, run, *args):
+    requests, prompt, completion = server.requests, server.prompt_tokens, server.completion_tokens
+    started = time.perf_counter()
+    created = run(*args)
+    return {
+        'elapsed': time.perf_counter() - started,
+        'created': created,
+        'calls': server.requests - requests,
+        'prompt_tokens': server.prompt_tokens - prompt,
+        'completion_tokens': server.completion_tokens - completion,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lessons', type=int, default=1)
+    parser.add_argument('--questions', type=int, default=200, help='questions per lesson')
+    parser.add_argument('--latency', type=float, default=0.3, help='fake OpenAI latency per call in seconds')
+    parser.add_argument('--token-latency', type=float, default=0.001, help='fake OpenAI latency per completion token')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import caches
+    from course import llm
+    from accounts.models import User
+    from course.models import Course, Lesson
+
+    with benchmark_database(), FakeOpenAIServer(latency=args.latency, token_latency=args.token_latency) as server:
+        settings.OPENAI_API_BASE = server.base_url
+        settings.OPENAI_API_KEY = 'sk-bench'
+        llm.reset_clients()
+        caches[settings.GENERATION_CACHE_ALIAS].clear()
+        teacher = User.objects.create_user(email='bench@example.com', fullname='Bench', password='bench', role='teacher')
+        course = Course.objects.create(title='Physics', description='', author=teacher)
+
+        results = {}
+        for name, run in (('per-prompt', run_per_prompt), ('packed', run_packed)):
+            lessons = Lesson.objects.bulk_create(
+                Lesson(course=course, title=f'{name} lesson {i}', type='practice') for i in range(args.lessons)
+            )
+            results[name] = measure(server, run, course, lessons, args.questions)
+
+    print(f"lessons={args.lessons} questions/lesson={args.questions} latency={args.latency}s token_latency={args.token_latency}s")
+    print(f"{'path':10} {'calls':>6} {'created':>8} {'seconds':>8} {'prompt tok/q':>13} {'total tok/q':>12}")
+    for name, result in results.items():
+        created = result['created'] or 1
+        print(
+            f"{name:10} {result['calls']:6d} {result['created']:8d} {result['elapsed']:8.2f} "
+            f"{result['prompt_tokens'] / created:13.1f} {(result['prompt_tokens'] + result['completion_tokens']) / created:12.1f}"
+        )
+    baseline, packed = results['per-prompt'], results['packed']
+    print(
+        f"wall time {baseline['elapsed'] / packed['elapsed']:.1f}x faster, "
+        f"prompt tokens per question {baseline['prompt_tokens'] / max(packed['prompt_tokens'], 1):.1f}x fewer"
+    )
+
+
+if __name__ == '__main__':
+    main()
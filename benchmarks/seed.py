@@ -0,0 +1,124 @@
+"""
+Deterministic data generator for benchmarks.
+
+Seeds teachers and students, courses, lessons of every type, and practice
+questions split evenly between TrueFalseQuestion and MultipleChoiceQuestion.
+The same arguments and seed always produce the same rows. Everything is bulk
+inserted, and every user shares one precomputed password hash, so seeding
+thousands of users takes seconds.
+
+    python -m benchmarks.seed --students 1000 --courses 50
+"""
+import argparse
+import random
+import time
+from dataclasses import dataclass, field
+
+from . import benchmark_database, setup_django
+
+PASSWORD = 'bench-password'
+LESSON_TYPES = ('practice', 'practice', 'reading', 'video')
+
+
+@dataclass
+class Dataset:
+    teacher_ids: list = field(default_factory=list)
+    student_ids: list = field(default_factory=list)
+    course_ids: list = field(default_factory=list)
+    practice_lesson_ids: list = field(default_factory=list)
+    lesson_courses: dict = field(default_factory=dict)
+    course_authors: dict = field(default_factory=dict)
+    reading_lesson_ids: list = field(default_factory=list)
+    question_count: int = 0
+
+    def summary(self):
+        return (
+            f"teachers={len(self.teacher_ids)} students={len(self.student_ids)} courses={len(self.course_ids)} "
+            f"practice_lessons={len(self.practice_lesson_ids)} reading_lessons={len(self.reading_lesson_ids)} "
+            f"questions={self.question_count}"
+        )
+
+
+def seed(teachers=5, students=100, courses=20, lessons_per_course=8, questions_per_lesson=10, random_seed=0):
+    from django.contrib.auth.hashers import make_password
+    from accounts.models import User
+    from course.models import Course, Lesson, MultipleChoiceQuestion, Question, TrueFalseQuestion
+
+    rng = random.Random(random_seed)
+    password = make_password(PASSWORD)
+    dataset = Dataset()
+
+    users = [
+        User(email=f'teacher{i}@bench.local', fullname=f'Teacher {i}', role='teacher', password=password)
+        for i in range(teachers)
+    ] + [
+        User(email=f'student{i}@bench.local', fullname=f'Student {i}', role='student', password=password)
+        for i in range(students)
+    ]
+    users = User.objects.bulk_create(users, batch_size=500)
+    dataset.teacher_ids = [user.pk for user in users if user.role == 'teacher']
+    dataset.student_ids = [user.pk for user in users if user.role == 'student']
+
+    course_objs = Course.objects.bulk_create([
+        # Round robin, so every teacher authors a course when there are enough of them
+        Course(title=f'Course {i}', description=f'Seeded course {i}', author_id=dataset.teacher_ids[i % teachers])
+        for i in range(courses)
+    ])
+    dataset.course_ids = [course.pk for course in course_objs]
+    dataset.course_authors = {course.pk: course.author_id for course in course_objs}
+
+    lessons = Lesson.objects.bulk_create([
+        Lesson(course=course, title=f'Lesson {j}', type=LESSON_TYPES[j % len(LESSON_TYPES)], content='Seeded content')
+        for course in course_objs
+        for j in range(lessons_per_course)
+    ], batch_size=500)
+    practice = [lesson for lesson in lessons if lesson.type == 'practice']
+    dataset.practice_lesson_ids = [lesson.pk for lesson in practice]
+    dataset.lesson_courses = {lesson.pk: lesson.course_id for lesson in lessons}
+    dataset.reading_lesson_ids = [lesson.pk for lesson in lessons if lesson.type == 'reading']
+
+    questions = []
+    for lesson in practice:
+        for k in range(questions_per_lesson):
+            if k % 2:
+                questions.append(TrueFalseQuestion(lesson=lesson, text=f'Statement {k}', correct_answer=rng.random() < 0.5))
+            else:
+                options = [f'Option {n}' for n in range(4)]
+                questions.append(MultipleChoiceQuestion(
+                    lesson=lesson, text=f'Question {k}', _options=options, correct_answer=rng.choice(options)
+                ))
+    Question.objects.bulk_create_subclasses(questions, batch_size=500)
+    dataset.question_count = len(questions)
+    return dataset
+
+
+def add_arguments(parser):
+    parser.add_argument('--teachers', type=int, default=5)
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--courses', type=int, default=20)
+    parser.add_argument('--lessons', type=int, default=8, help='lessons per course, half of them practice')
+    parser.add_argument('--questions', type=int, default=10, help='questions per practice lesson')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def seed_from_args(args):
+    return seed(
+        teachers=args.teachers, students=args.students, courses=args.courses,
+        lessons_per_course=args.lessons, questions_per_lesson=args.questions, random_seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        started = time.perf_counter()
+        dataset = seed_from_args(args)
+        print(f"{dataset.summary()} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-question cost of serializing a course tree with the DRF serializers
+versus the .values()-based fast path in course.fast_serializers.
+
+    python -m benchmarks.serializer_throughput --lessons 50 --questions 40 --repeat 5
+"""
+import argparse
+import time
+
+from . import benchmark_database, setup_django
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lessons', type=int, default=50)
+    parser.add_argument('--questions', type=int, default=40, help='questions per lesson, half of each type')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from accounts.models import User
+    from course.fast_serializers import serialize_course_tree
+    from course.models import Course, Lesson, MultipleChoiceQuestion, Question, TrueFalseQuestion
+    from course.serializers import CourseSerializer
+
+    with benchmark_database():
+        teacher = User.objects.create_user(email='bench@example.com', fullname='Bench', password='bench', role='teacher')
+        course = Course.objects.create(title='Bench', description='', author=teacher)
+        lessons = Lesson.objects.bulk_create(
+            Lesson(course=course, title=f'Lesson {i}', type='practice') for i in range(args.lessons)
+        )
+        questions = []
+        for lesson in lessons:
+            for i in range(args.questions):
+                if i % 2:
+                    questions.append(TrueFalseQuestion(lesson=lesson, text=f'TF {i}', correct_answer=True))
+                else:
+                    questions.append(MultipleChoiceQuestion(
+                        lesson=lesson, text=f'MC {i}', _options=['a', 'b', 'c', 'd'], correct_answer='a'
+                    ))
+        Question.objects.bulk_create_subclasses(questions)
+        total = len(questions)
+        renderer = JSONRenderer()
+
+        def drf():
+            instance = Course.objects.with_lessons().get(pk=course.pk)
+            return renderer.render(CourseSerializer(instance, context={'hide_answers': False}).data)
+
+        def fast():
+            return renderer.render(serialize_course_tree(course.pk))
+
+        assert drf() == fast(), 'fast path output differs from CourseSerializer'
+        drf_elapsed = best_of(args.repeat, drf)
+        fast_elapsed = best_of(args.repeat, fast)
+
+    print(f"lessons={args.lessons} questions={total}")
+    print(f"drf : {drf_elapsed * 1000:8.1f} ms  {drf_elapsed / total * 1e6:6.2f} us/question")
+    print(f"fast: {fast_elapsed * 1000:8.1f} ms  {fast_elapsed / total * 1e6:6.2f} us/question")
+    print(f"speedup: {drf_elapsed / fast_elapsed:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
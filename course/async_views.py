@@ -0,0 +1,143 @@
+"""
+Native async variants of the generation endpoints.
+
+They await the OpenAI call and use the async ORM, so a single ASGI worker
+can keep many generations in flight. DRF views are synchronous, hence the
+plain Django views here; each one still authenticates, checks permissions
+and throttles through the DRF view it mirrors, before doing anything else.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from accounts.permissions import can_see_answers
+from . import generation, usage
+from .models import Course, Lesson
+from .serializers import GenerateQuestionsSerializer, GenerateReadingContentSerializer, LessonSerializer, QuestionSerializer
+from .views import GenerateQuestionsView, GenerateReadingContentView
+
+
+def _validated(serializer_class, request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None, JsonResponse({"error": "Invalid JSON body"}, status=400)
+    serializer = serializer_class(data=data)
+    if not serializer.is_valid():
+        return None, JsonResponse(serializer.errors, status=400)
+    return serializer.validated_data, None
+
+
+async def _get_lesson(user, course_id, lesson_id):
+    try:
+        course = await Course.objects.aget(id=course_id)
+        lesson = await Lesson.objects.aget(id=lesson_id, course=course)
+    except Course.DoesNotExist:
+        return None, None, JsonResponse({"error": "Course not found"}, status=404)
+    except Lesson.DoesNotExist:
+        return None, None, JsonResponse({"error": "Lesson not found"}, status=404)
+    if course.author_id != user.id:
+        return None, None, JsonResponse({"error": "Only the course author can generate its content"}, status=403)
+    return course, lesson, None
+
+
+def _authorize(request, view_class, action):
+    """
+    Run DRF's authentication, permission and throttle checks of view_class's
+    action on the request. Returns (user, None), or (None, the error response
+    DRF would have sent: 401 for a missing or invalid token, 403, 429).
+    """
+    view = view_class()
+    view.action_map = {'post': action}
+    view.setup(request)
+    drf_request = view.initialize_request(request)
+    view.request = drf_request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drf_request)
+    except Exception as e:
+        response = view.handle_exception(e)
+        headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+        return None, JsonResponse(response.data, status=response.status_code, headers=headers)
+    return drf_request.user, None
+
+
+def _answers_context(user):
+    # The Django request carries no DRF user, so the serializers are told outright
+    return {'hide_answers': not can_see_answers(user)}
+
+
+def _rate_limited(error):
+    return JsonResponse({"error": str(error)}, status=429, headers={'Retry-After': str(error.retry_after)})
+
+
+@csrf_exempt
+@require_POST
+async def generate_questions(request):
+    user, error = await sync_to_async(_authorize)(request, GenerateQuestionsView, 'generate')
+    if error:
+        return error
+    data, error = _validated(GenerateQuestionsSerializer, request)
+    if error:
+        return error
+    course, lesson, error = await _get_lesson(user, data['course_id'], data['lesson_id'])
+    if error:
+        return error
+
+    request_args = (course.title, data['lesson_topic'], data['student_interests'], data['num_questions'])
+    try:
+        bank = await sync_to_async(generation.bank_state)(lesson.pk)
+        async with usage.ascope(usage.caller_id(user), course.id):
+            questions_data = await generation.agenerate_questions_data(*request_args, bank=bank)
+        created_questions = await generation.asave_questions(lesson, questions_data)
+    except usage.RateLimited as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    if not created_questions:
+        # As in jobs._run_questions: the bank is unchanged, so a retry would replay this batch from the cache
+        await sync_to_async(generation.forget_questions)(*request_args, bank=bank)
+        return JsonResponse({"error": str(generation.duplicates_error(len(questions_data)))}, status=409)
+
+    return JsonResponse({
+        "message": f"{len(created_questions)} questions successfully generated",
+        "questions": QuestionSerializer(created_questions, many=True, context=_answers_context(user)).data
+    }, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def generate_reading(request):
+    user, error = await sync_to_async(_authorize)(request, GenerateReadingContentView, 'generate')
+    if error:
+        return error
+    data, error = _validated(GenerateReadingContentSerializer, request)
+    if error:
+        return error
+    course, lesson, error = await _get_lesson(user, data['course_id'], data['lesson_id'])
+    if error:
+        return error
+
+    if lesson.type != 'reading':
+        return JsonResponse({"error": "This lesson is not a reading lesson"}, status=400)
+
+    try:
+        async with usage.ascope(usage.caller_id(user), course.id):
+            content = await generation.agenerate_reading_markdown(
+                course.title, data['lesson_topic'], data['student_interests']
+            )
+        lesson = await generation.asave_reading_content(lesson, content)
+    except usage.RateLimited as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+    # LessonSerializer queries the lesson's questions, which must run off the event loop
+    lesson_data = await sync_to_async(lambda: LessonSerializer(lesson, context=_answers_context(user)).data)()
+    return JsonResponse({
+        "message": "Reading content successfully generated",
+        "lesson": lesson_data
+    }, status=201)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from accounts.checks import LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches, deploy=True)
+def check_rate_limit_cache(app_configs, **kwargs):
+    alias = settings.LLM_RATE_LIMIT_CACHE_ALIAS
+    if not settings.LLM_RATE_LIMIT_ENABLED or settings.CACHES.get(alias, {}).get('BACKEND') not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        f"LLM_RATE_LIMIT_CACHE_ALIAS '{alias}' is not shared between processes.",
+        hint="Each process enforces the per-user LLM limits on its own; point the alias at a shared cache such as Redis.",
+        id='course.W001',
+    )]
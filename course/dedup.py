@@ -0,0 +1,158 @@
+"""
+Near-duplicate detection for practice questions, run locally without any
+embedding service.
+
+Question text is normalized (case, accents, punctuation, whitespace) and
+cut into overlapping character shingles; a MinHash signature of the shingle
+set estimates the Jaccard similarity of two questions. Each lesson's
+signatures are cached and only recomputed for questions that are new or
+whose text changed, and they are bucketed by locality-sensitive hashing
+bands, so a new question is only compared with the few existing ones that
+share a band. Questions of different types are never duplicates of each other.
+"""
+import hashlib
+import random
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import MultipleChoiceQuestion, Question, TrueFalseQuestion
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+# 16 bands of 4 rows: pairs above ~0.5 similarity almost always share a band
+BANDS, ROWS = 16, 4
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Fixed seed, so signatures cached by one process are valid in every other
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+# Child table pointer -> question type, as in fast_serializers.QUESTION_TYPES
+_TYPE_POINTERS = {
+    'truefalsequestion__question_ptr': 'true_false',
+    'multiplechoicequestion__question_ptr': 'multiple_choice',
+}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    # "Newton's" and "Newtons" are the same word
+    return ' '.join(re.findall(r'\w+', re.sub(r"['\u2019]", '', text)))
+
+
+def shingles(text):
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+
+
+def fingerprint(text):
+    """The MinHash signature of the text's shingles, as a tuple of NUM_PERM ints."""
+    hashes = [_hash(shingle) for shingle in shingles(text)]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) & _MASK for a, b in _PERMUTATIONS)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def _bands(signature):
+    return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+
+def question_type(question):
+    if isinstance(question, TrueFalseQuestion):
+        return 'true_false'
+    if isinstance(question, MultipleChoiceQuestion):
+        return 'multiple_choice'
+    return 'unknown'
+
+
+class SimilarityIndex:
+    """Signatures of one lesson's questions, with LSH buckets for candidate lookup."""
+
+    def __init__(self, entries=(), threshold=None):
+        self.threshold = settings.QUESTION_DEDUP_THRESHOLD if threshold is None else threshold
+        self.entries = {}
+        self._buckets = {}
+        for key, kind, signature in entries:
+            self.add(key, kind, signature)
+
+    def add(self, key, kind, signature):
+        self.entries[key] = (kind, signature)
+        for band in _bands(signature):
+            self._buckets.setdefault((kind, band), []).append(key)
+
+    def find(self, kind, signature):
+        """The key of the most similar indexed question at or above the threshold, or None."""
+        candidates = dict.fromkeys(key for band in _bands(signature) for key in self._buckets.get((kind, band), ()))
+        best, best_score = None, None
+        for key in candidates:
+            score = similarity(signature, self.entries[key][1])
+            if score >= self.threshold and (best_score is None or score > best_score):
+                best, best_score = key, score
+        return best
+
+
+def lesson_entries(lesson_id):
+    """[(question id, type, signature)] for a lesson in id order, reusing cached signatures."""
+    cache = caches[settings.COURSE_TREE_CACHE_ALIAS]
+    cache_key = f"dedup-signatures:{lesson_id}"
+    known = cache.get(cache_key) or {}
+    rows = Question.objects.filter(lesson_id=lesson_id).order_by('id').values('id', 'text', *_TYPE_POINTERS)
+    signatures, entries = {}, []
+    for row in rows:
+        text, signature = known.get(row['id'], (None, None))
+        if text != row['text']:
+            signature = fingerprint(row['text'])
+        signatures[row['id']] = (row['text'], signature)
+        kind = next((kind for pointer, kind in _TYPE_POINTERS.items() if row[pointer] is not None), 'unknown')
+        entries.append((row['id'], kind, signature))
+    if signatures != known:
+        cache.set(cache_key, signatures, settings.COURSE_TREE_CACHE_TTL)
+    return entries
+
+
+def drop_duplicates(lesson_id, questions):
+    """
+    Split unsaved questions for a lesson into (new, duplicates): a question is
+    a duplicate when it is near-identical to one already in the lesson or to
+    an earlier one in the same batch.
+    """
+    index = SimilarityIndex(lesson_entries(lesson_id))
+    new, duplicates = [], []
+    for position, question in enumerate(questions):
+        kind, signature = question_type(question), fingerprint(question.text)
+        if index.find(kind, signature) is not None:
+            duplicates.append(question)
+            continue
+        index.add(('new', position), kind, signature)
+        new.append(question)
+    return new, duplicates
+
+
+def find_duplicates(lesson_id, threshold=None):
+    """
+    {kept question id: [duplicate ids]} for a lesson's existing bank. The
+    oldest question of each group of near-duplicates is the one kept.
+    """
+    index = SimilarityIndex(threshold=threshold)
+    groups = {}
+    for key, kind, signature in lesson_entries(lesson_id):
+        original = index.find(kind, signature)
+        if original is None:
+            index.add(key, kind, signature)
+        else:
+            groups.setdefault(original, []).append(key)
+    return groups
@@ -0,0 +1,114 @@
+"""
+Read-only fast path for course trees.
+
+Builds the same structure as CourseSerializer -> LessonSerializer ->
+QuestionSerializer straight from .values() rows, dispatching question types
+through a table instead of per-field isinstance checks. The output renders
+to byte-identical JSON; keep the key order in sync with the DRF serializers.
+"""
+from .models import Course, Lesson, Question
+
+QUESTION_FIELDS = (
+    'id', 'lesson_id', 'text',
+    'truefalsequestion__question_ptr', 'truefalsequestion__correct_answer',
+    'multiplechoicequestion__question_ptr', 'multiplechoicequestion___options', 'multiplechoicequestion__correct_answer',
+)
+
+
+def _true_false(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'type': 'true_false',
+        'options': None,
+        'correct_answer': row['truefalsequestion__correct_answer'],
+    }
+
+
+def _multiple_choice(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'type': 'multiple_choice',
+        'options': row['multiplechoicequestion___options'],
+        'correct_answer': row['multiplechoicequestion__correct_answer'],
+    }
+
+
+def _unknown(row):
+    return {'id': row['id'], 'text': row['text'], 'type': 'unknown', 'options': None, 'correct_answer': None}
+
+
+# (child table pointer column, serializer); the first non-null pointer wins
+QUESTION_TYPES = (
+    ('truefalsequestion__question_ptr', _true_false),
+    ('multiplechoicequestion__question_ptr', _multiple_choice),
+)
+
+
+def serialize_question_row(row):
+    for pointer, serialize in QUESTION_TYPES:
+        if row[pointer] is not None:
+            return serialize(row)
+    return _unknown(row)
+
+
+LESSON_FIELDS = ('id', 'title', 'type', 'content', 'video_url')
+
+
+# The querysets below are all the fast path runs; explain_queries audits them as they are
+
+def course_rows(course_ids):
+    return Course.objects.filter(pk__in=course_ids).values('id', 'title', 'description', 'author')
+
+
+def lesson_rows(course_ids):
+    return Lesson.objects.filter(course_id__in=course_ids).order_by('id').values('course_id', *LESSON_FIELDS)
+
+
+def lesson_row(lesson_id):
+    return Lesson.objects.filter(pk=lesson_id).order_by('pk').values(*LESSON_FIELDS)[:1]
+
+
+def question_rows(lesson_ids):
+    return Question.objects.filter(lesson_id__in=lesson_ids).order_by('id').values(*QUESTION_FIELDS)
+
+
+def _attach_questions(lessons):
+    """Fill each lesson row's 'questions' list, given {lesson_id: row}."""
+    for row in lessons.values():
+        row['questions'] = []
+    if lessons:
+        for row in question_rows(list(lessons)):
+            lessons[row['lesson_id']]['questions'].append(serialize_question_row(row))
+
+
+def serialize_course_trees(course_ids):
+    """Return {course_id: tree} for the given ids in three queries."""
+    courses = course_rows(course_ids)
+    trees = {}
+    for row in courses:
+        row['lessons'] = []
+        trees[row['id']] = row
+    if not trees:
+        return trees
+
+    lessons = {}
+    for row in lesson_rows(list(trees)):
+        course_id = row.pop('course_id')
+        lessons[row['id']] = row
+        trees[course_id]['lessons'].append(row)
+    _attach_questions(lessons)
+    return trees
+
+
+def serialize_course_tree(course_id):
+    return serialize_course_trees([course_id]).get(course_id)
+
+
+def serialize_lesson(lesson_id):
+    """The LessonSerializer representation of one lesson, in two queries."""
+    row = next(iter(lesson_row(lesson_id)), None)
+    if row is not None:
+        _attach_questions({row['id']: row})
+    return row
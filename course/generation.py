@@ -0,0 +1,305 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import dedup, llm, usage
+from .generation_cache import generation_cache
+from .models import Lesson, MultipleChoiceQuestion, Question
+from .schemas import parse_generated_questions
+
+QUESTIONS_SYSTEM_PROMPT = "You are a helpful assistant."
+QUESTIONS_MODEL_PARAMS = {
+    'model': llm.DEFAULT_MODEL,
+    'temperature': 0.7,
+}
+# One question object with four short options is about 90 tokens of JSON; the
+# margin covers the list around them and the odd longer question
+TOKENS_PER_QUESTION = 90
+QUESTIONS_REPLY_MARGIN = 100
+
+READING_SYSTEM_PROMPT = "You are a knowledgeable and engaging teacher."
+READING_MODEL_PARAMS = {
+    'model': llm.DEFAULT_MODEL,
+    'max_tokens': settings.GENERATION_READING_MAX_TOKENS,
+    'temperature': 0.7,
+}
+
+
+def build_questions_prompt(course_title, lesson_topic, student_interests, num_questions):
+    # Формируем запрос к OpenAI API
+    prompt = f"Create {num_questions} one-choice questions about {lesson_topic} for a {course_title} course. "
+    prompt += f"The questions should be related to the following student interests: {', '.join(student_interests)}. "
+    prompt += f"For each question, provide the question text, four options, and the correct answer index (0-3). Format the response as a JSON list of {num_questions} question objects."
+    prompt += "Provide the response in JSON format. like: [{'question': 'question text', 'options': ['option1', 'option2', 'option3', 'option4'], 'correct_answer_index': 0}, ...]"
+    return prompt
+
+
+def questions_max_tokens(num_questions):
+    """The reply budget for num_questions questions, so every call reserves only what it can use."""
+    return num_questions * TOKENS_PER_QUESTION + QUESTIONS_REPLY_MARGIN
+
+
+def build_reading_prompt(course_title, lesson_topic, student_interests):
+    # Формируем запрос к OpenAI API
+    prompt = f"Create a detailed explanation of the topic '{lesson_topic}' for a {course_title} course. "
+    prompt += f"The explanation should be tailored to a student with the following interests: {', '.join(student_interests)}. "
+    prompt += "The content should be informative, engaging, and easy to understand. "
+    prompt += "Structure the content with appropriate headings and subheadings. "
+    prompt += "Provide the response in Markdown format."
+    return prompt
+
+
+def bank_state(lesson_id):
+    """
+    A token for a lesson's current question bank. Question generations are
+    cached per bank state, so saving a batch changes the key and the next
+    request asks the model for new questions instead of replaying the last ones.
+    """
+    return bank_states([lesson_id])[lesson_id]
+
+
+def bank_states(lesson_ids):
+    """{lesson_id: bank_state()} for several lessons, in one query."""
+    rows = (
+        Question.objects.filter(lesson_id__in=lesson_ids)
+        .values('lesson_id').annotate(count=Count('id'), latest=Max('id')).order_by()
+    )
+    states = {row['lesson_id']: f"{row['count']}:{row['latest']}" for row in rows}
+    return {lesson_id: states.get(lesson_id, '0:0') for lesson_id in lesson_ids}
+
+
+def questions_request(course_title, lesson_topic, student_interests, num_questions, bank=None):
+    """Return (messages, cache inputs, cache model params) for a question generation."""
+    messages = [
+        {"role": "system", "content": QUESTIONS_SYSTEM_PROMPT},
+        {"role": "user", "content": build_questions_prompt(course_title, lesson_topic, student_interests, num_questions)}
+    ]
+    inputs = {
+        'course_title': course_title,
+        'lesson_topic': lesson_topic,
+        'student_interests': student_interests,
+        'num_questions': num_questions,
+        'bank': bank,
+    }
+    return messages, inputs, {'system': QUESTIONS_SYSTEM_PROMPT, **QUESTIONS_MODEL_PARAMS}
+
+
+def reading_request(course_title, lesson_topic, student_interests):
+    """Return (messages, cache inputs, cache model params) for a reading generation."""
+    messages = [
+        {"role": "system", "content": READING_SYSTEM_PROMPT},
+        {"role": "user", "content": build_reading_prompt(course_title, lesson_topic, student_interests)}
+    ]
+    inputs = {
+        'course_title': course_title,
+        'lesson_topic': lesson_topic,
+        'student_interests': student_interests,
+    }
+    return messages, inputs, {'system': READING_SYSTEM_PROMPT, **READING_MODEL_PARAMS}
+
+
+def parse_questions(content):
+    questions, _ = parse_generated_questions(content)
+    return questions
+
+
+def followup_messages(messages, content, received, missing):
+    """Continue the conversation, asking only for the questions that were missing or malformed."""
+    return messages + [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": (
+            f"Only {received} valid questions were received. Provide {missing} more, different question(s) "
+            "as a JSON list of objects with 'question', 'options' (four strings) and 'correct_answer_index' (0-3). "
+            "Respond with the JSON list only."
+        )},
+    ]
+
+
+def _checked_questions(questions, num_questions):
+    if not questions:
+        raise ValueError("The model response contained no valid questions")
+    return questions[:num_questions]
+
+
+def generate_questions_data(course_title, lesson_topic, student_interests, num_questions, bank=None):
+    """
+    Ask the model for questions and return the validated question dicts. Items
+    that fail validation are dropped and re-requested once, on their own. bank
+    is the target lesson's bank_state().
+    """
+    messages, inputs, model_params = questions_request(course_title, lesson_topic, student_interests, num_questions, bank)
+
+    def generate():
+        response = llm.chat_completion(
+            messages=messages, n=1, stop=None, max_tokens=questions_max_tokens(num_questions), **QUESTIONS_MODEL_PARAMS
+        )
+        content = llm.message_content(response)
+        questions = parse_questions(content)
+        missing = num_questions - len(questions)
+        if missing > 0:
+            response = llm.chat_completion(
+                messages=followup_messages(messages, content, len(questions), missing),
+                n=1, stop=None, max_tokens=questions_max_tokens(missing), **QUESTIONS_MODEL_PARAMS
+            )
+            questions += parse_questions(llm.message_content(response))[:missing]
+        return _checked_questions(questions, num_questions)
+
+    return generation_cache.get_or_generate('questions', inputs, model_params, generate)
+
+
+def duplicates_error(count):
+    """The failure of a batch that save_questions() dropped entirely as duplicates."""
+    return ValueError(f"All {count} generated questions duplicate questions already in the lesson")
+
+
+def forget_questions(course_title, lesson_topic, student_interests, num_questions, bank=None):
+    """Drop a cached question generation, so the same request asks the model again."""
+    _, inputs, model_params = questions_request(course_title, lesson_topic, student_interests, num_questions, bank)
+    generation_cache.delete('questions', inputs, model_params)
+
+
+async def agenerate_questions_data(course_title, lesson_topic, student_interests, num_questions, bank=None):
+    messages, inputs, model_params = questions_request(course_title, lesson_topic, student_interests, num_questions, bank)
+
+    async def generate():
+        response = await llm.achat_completion(
+            messages=messages, n=1, stop=None, max_tokens=questions_max_tokens(num_questions), **QUESTIONS_MODEL_PARAMS
+        )
+        content = llm.message_content(response)
+        questions = parse_questions(content)
+        missing = num_questions - len(questions)
+        if missing > 0:
+            response = await llm.achat_completion(
+                messages=followup_messages(messages, content, len(questions), missing),
+                n=1, stop=None, max_tokens=questions_max_tokens(missing), **QUESTIONS_MODEL_PARAMS
+            )
+            questions += parse_questions(llm.message_content(response))[:missing]
+        return _checked_questions(questions, num_questions)
+
+    return await generation_cache.aget_or_generate('questions', inputs, model_params, generate)
+
+
+def generate_reading_markdown(course_title, lesson_topic, student_interests):
+    messages, inputs, model_params = reading_request(course_title, lesson_topic, student_interests)
+
+    def generate():
+        response = llm.chat_completion(messages=messages, n=1, stop=None, **READING_MODEL_PARAMS)
+        return llm.message_content(response)
+
+    return generation_cache.get_or_generate('reading', inputs, model_params, generate)
+
+
+def stream_reading_markdown(course_title, lesson_topic, student_interests):
+    """Yield Markdown fragments as the model produces them; the full text is cached at the end."""
+    messages, inputs, model_params = reading_request(course_title, lesson_topic, student_interests)
+    cached = generation_cache.get('reading', inputs, model_params)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    for delta in llm.stream_chat_completion(messages=messages, n=1, stop=None, **READING_MODEL_PARAMS):
+        parts.append(delta)
+        yield delta
+    generation_cache.set('reading', inputs, model_params, ''.join(parts).strip())
+
+
+async def agenerate_reading_markdown(course_title, lesson_topic, student_interests):
+    messages, inputs, model_params = reading_request(course_title, lesson_topic, student_interests)
+
+    async def generate():
+        response = await llm.achat_completion(messages=messages, n=1, stop=None, **READING_MODEL_PARAMS)
+        return llm.message_content(response)
+
+    return await generation_cache.aget_or_generate('reading', inputs, model_params, generate)
+
+
+def save_questions(lesson, questions_data):
+    questions = [
+        MultipleChoiceQuestion(
+            lesson=lesson,
+            text=question_data['question'],
+            _options=question_data['options'],
+            correct_answer=question_data['options'][question_data['correct_answer_index']]
+        )
+        for question_data in questions_data
+    ]
+    with transaction.atomic():
+        # Serialize writers per lesson, so concurrent runs cannot both insert the same question
+        Lesson.objects.select_for_update().filter(pk=lesson.pk).exists()
+        questions, _ = dedup.drop_duplicates(lesson.pk, questions)
+        return Question.objects.bulk_create_subclasses(questions)
+
+
+def save_reading_content(lesson, content):
+    # Обновляем урок с новым контентом
+    lesson.content = content
+    lesson.save(update_fields=['content'])
+    return lesson
+
+
+async def asave_questions(lesson, questions_data):
+    # The async ORM has no multi-table bulk insert; run the single-transaction sync path off the loop
+    return await sync_to_async(save_questions)(lesson, questions_data)
+
+
+async def asave_reading_content(lesson, content):
+    lesson.content = content
+    await lesson.asave(update_fields=['content'])
+    return lesson
+
+
+def _save_reading(lesson, future, results):
+    result = results[lesson.id]
+    try:
+        with transaction.atomic():
+            save_reading_content(lesson, future.result())
+    except Exception as e:
+        result['error'] = str(e)
+
+
+def generate_course_content(course, student_interests, num_questions):
+    """
+    Generate reading content for every reading lesson and questions for every
+    practice lesson of a course. Practice lessons are packed into as few
+    prompts as fit the token budget (see planner.py); those prompts and one
+    per reading lesson fan out over a bounded thread pool, and each lesson is
+    written in its own transaction as soon as its call returns, on the calling
+    thread. Returns per-lesson status dicts in lesson order.
+    """
+    from . import planner
+
+    lessons = list(course.lessons.filter(type__in=['reading', 'practice']).order_by('id'))
+    if not lessons:
+        return []
+    results = {lesson.id: {'lesson_id': lesson.id, 'type': lesson.type} for lesson in lessons}
+    for lesson in lessons:
+        if lesson.type == 'practice':
+            results[lesson.id].update(questions_created=0, duplicates_dropped=0)
+    chunks = planner.plan(
+        course.title, student_interests,
+        [(lesson, lesson.title, num_questions) for lesson in lessons if lesson.type == 'practice'],
+    )
+    reading = [lesson for lesson in lessons if lesson.type == 'reading']
+
+    workers = min(settings.GENERATION_FANOUT_WORKERS, len(reading) + len(chunks))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='course-generation') as pool:
+        futures = {
+            pool.submit(usage.propagate(generate_reading_markdown), course.title, lesson.title, student_interests):
+                partial(_save_reading, lesson)
+            for lesson in reading
+        }
+        futures.update({
+            pool.submit(usage.propagate(planner.generate_chunk), course.title, student_interests, chunk):
+                partial(planner.save_chunk, course.title, student_interests, chunk)
+            for chunk in chunks
+        })
+        for future in as_completed(futures):
+            futures[future](future, results)
+
+    planner.set_statuses(results)
+    return [results[lesson.id] for lesson in lessons]
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+_MISSING = object()
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(value.split()).casefold()
+    if isinstance(value, (list, tuple, set)):
+        # Interest lists are order-insensitive and tolerate duplicates
+        return sorted({_normalize(item) for item in value})
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+class GenerationCache:
+    """
+    Content-addressed cache for LLM output, keyed by a hash of the normalized
+    prompt inputs and model parameters. Storage, TTL and eviction come from the
+    Django cache named by settings.GENERATION_CACHE_ALIAS.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias or settings.GENERATION_CACHE_ALIAS]
+
+    def make_key(self, kind, inputs, model_params):
+        payload = json.dumps(
+            {'kind': kind, 'inputs': _normalize(inputs), 'model': model_params},
+            sort_keys=True,
+            default=str,
+        )
+        return f"generation:{kind}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    def get(self, kind, inputs, model_params, default=None):
+        value = self.backend.get(self.make_key(kind, inputs, model_params), _MISSING)
+        self._count(hit=value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, kind, inputs, model_params, value):
+        self.backend.set(self.make_key(kind, inputs, model_params), value)
+
+    def delete(self, kind, inputs, model_params):
+        self.backend.delete(self.make_key(kind, inputs, model_params))
+
+    def get_or_generate(self, kind, inputs, model_params, generate):
+        key = self.make_key(kind, inputs, model_params)
+        value = self.backend.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count(hit=True)
+            return value
+        self._count(hit=False)
+        value = generate()
+        self.backend.set(key, value)
+        return value
+
+    async def aget_or_generate(self, kind, inputs, model_params, generate):
+        key = self.make_key(kind, inputs, model_params)
+        value = await self.backend.aget(key, _MISSING)
+        if value is not _MISSING:
+            self._count(hit=True)
+            return value
+        self._count(hit=False)
+        value = await generate()
+        await self.backend.aset(key, value)
+        return value
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,121 @@
+"""
+Server-side grading of practice lesson submissions.
+
+Each lesson's answer key is built from one .values() query and cached under
+the lesson's payload version (see tree_cache.py), so any question write makes
+the old key unreachable and grading a submission never queries per question.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import progress, tree_cache
+from .fast_serializers import QUESTION_FIELDS, serialize_question_row
+from .models import Answer, Question, Submission
+
+
+def _normalize(choice):
+    return str(choice).strip().casefold()
+
+
+def _split_choices(value, options):
+    """
+    MultipleChoiceQuestion.correct_answer holds comma-separated answers. A
+    value that is itself one of the options is kept whole, so options
+    containing commas still work.
+    """
+    if isinstance(value, (list, tuple)):
+        choices = value
+    elif _normalize(value) in options:
+        choices = [value]
+    else:
+        choices = str(value).split(',')
+    return frozenset(_normalize(choice) for choice in choices if str(choice).strip())
+
+
+def _key_entry(question):
+    if question['type'] == 'true_false':
+        return {'type': 'true_false', 'correct': question['correct_answer']}
+    if question['type'] == 'multiple_choice':
+        options = frozenset(_normalize(option) for option in question['options'] or [])
+        return {
+            'type': 'multiple_choice',
+            'correct': _split_choices(question['correct_answer'] or '', options),
+            'options': options,
+        }
+    return {'type': 'unknown', 'correct': None}
+
+
+def build_answer_key(lesson_id):
+    rows = Question.objects.filter(lesson_id=lesson_id).order_by('id').values(*QUESTION_FIELDS)
+    return {row['id']: _key_entry(serialize_question_row(row)) for row in rows}
+
+
+def get_answer_key(lesson_id):
+    """{question_id: entry} for a lesson, cached until any of its questions change."""
+    cache = caches[settings.COURSE_TREE_CACHE_ALIAS]
+    version = tree_cache.get_version(tree_cache.LESSON, lesson_id)
+    cache_key = f"answer-key:{lesson_id}:{version}"
+    key = cache.get(cache_key)
+    if key is None:
+        key = build_answer_key(lesson_id)
+        cache.set(cache_key, key, settings.COURSE_TREE_CACHE_TTL)
+    return key
+
+
+def _parse_true_false(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and _normalize(value) in ('true', 'false'):
+        return _normalize(value) == 'true'
+    return None
+
+
+def check_answer(entry, value):
+    """Return (stored text, is_correct) for one submitted answer."""
+    if entry['type'] == 'true_false':
+        parsed = _parse_true_false(value)
+        text = str(value).lower() if parsed is None else str(parsed).lower()
+        return text, parsed is not None and parsed == entry['correct']
+    if entry['type'] == 'multiple_choice':
+        text = ','.join(str(choice) for choice in value) if isinstance(value, (list, tuple)) else str(value)
+        return text, _split_choices(value, entry['options']) == entry['correct']
+    return str(value), False
+
+
+def grade(answer_key, answers):
+    """
+    Grade [{'question': id, 'answer': value}, ...] against an answer key.
+    Returns (results, unknown question ids); unanswered questions score zero.
+    """
+    results, unknown = [], []
+    for item in answers:
+        entry = answer_key.get(item['question'])
+        if entry is None:
+            unknown.append(item['question'])
+            continue
+        text, is_correct = check_answer(entry, item['answer'])
+        results.append({'question': item['question'], 'answer': text, 'is_correct': is_correct})
+    return results, unknown
+
+
+def record_submission(lesson, student, answer_key, results):
+    """Store a graded submission and its answers in two inserts, and roll it into the progress aggregates."""
+    with transaction.atomic():
+        submission = Submission.objects.create(
+            lesson=lesson,
+            student_id=student.id,
+            score=sum(result['is_correct'] for result in results),
+            total=len(answer_key),
+        )
+        Answer.objects.bulk_create([
+            Answer(
+                submission=submission,
+                question_id=result['question'],
+                text=result['answer'],
+                is_correct=result['is_correct'],
+            )
+            for result in results
+        ])
+        progress.record(submission, lesson.course_id)
+    return submission
@@ -0,0 +1,132 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import generation, planner, usage
+from .models import GenerationJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.GENERATION_WORKERS,
+                thread_name_prefix='generation',
+            )
+    return _executor
+
+
+def enqueue(kind, lesson, params, user=None, course=None):
+    """
+    Create a pending job and hand it to the worker pool once the request
+    commits. Jobs for a whole course pass the course instead of a lesson.
+    """
+    job = GenerationJob.objects.create(
+        kind=kind,
+        course=course or lesson.course,
+        lesson=lesson,
+        params=params,
+        created_by_id=user.id if user is not None and user.is_authenticated else None,
+    )
+    if settings.GENERATION_JOBS_EAGER:
+        job = run_job(job.pk)
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.pk))
+    return job
+
+
+def _run_in_worker(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # Worker threads own their connections; don't leave them open between jobs
+        connections.close_all()
+
+
+def _run_questions(job):
+    params = job.params
+    request = (job.course.title, params['lesson_topic'], params['student_interests'], params['num_questions'])
+    bank = generation.bank_state(job.lesson_id)
+    questions_data = generation.generate_questions_data(*request, bank=bank)
+    created_questions = generation.save_questions(job.lesson, questions_data)
+    if not created_questions:
+        # The bank is unchanged, so a retry would replay this batch from the cache; make it ask again
+        generation.forget_questions(*request, bank=bank)
+        raise generation.duplicates_error(len(questions_data))
+    # Ids only: GenerationJobSerializer renders the questions for whoever reads the job
+    return {
+        "message": f"{len(created_questions)} questions successfully generated",
+        "questions_created": len(created_questions),
+        "duplicates_dropped": len(questions_data) - len(created_questions),
+        "question_ids": [question.pk for question in created_questions],
+    }
+
+
+def _run_reading(job):
+    params = job.params
+    content = generation.generate_reading_markdown(
+        job.course.title, params['lesson_topic'], params['student_interests']
+    )
+    lesson = generation.save_reading_content(job.lesson, content)
+    return {
+        "message": "Reading content successfully generated",
+        "lesson_id": lesson.pk,
+    }
+
+
+def _run_course(job):
+    params = job.params
+    lessons = generation.generate_course_content(job.course, params['student_interests'], params['num_questions'])
+    return {"course_id": job.course_id, "lessons": lessons}
+
+
+def _run_bank(job):
+    params = job.params
+    lessons = job.course.lessons.in_bulk([item['lesson_id'] for item in params['lessons']])
+    if len(lessons) != len(params['lessons']):
+        raise ValueError("Lesson not found")
+    requests = [
+        (lessons[item['lesson_id']], item['lesson_topic'], item['num_questions']) for item in params['lessons']
+    ]
+    return {
+        "course_id": job.course_id,
+        "lessons": planner.generate_bank(job.course.title, params['student_interests'], requests),
+    }
+
+
+RUNNERS = {
+    'questions': _run_questions,
+    'reading': _run_reading,
+    'course': _run_course,
+    'bank': _run_bank,
+}
+
+
+def run_job(job_id):
+    job = GenerationJob.objects.select_related('course', 'lesson').get(pk=job_id)
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    try:
+        with usage.scope(job.created_by_id, job.course_id):
+            job.result = RUNNERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Generation job %s failed", job.pk)
+        job.status = 'failed'
+        job.error = str(e)
+    else:
+        job.status = 'succeeded'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
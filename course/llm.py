@@ -0,0 +1,233 @@
+"""
+Process-wide client for the OpenAI HTTP API.
+
+Every outbound LLM call goes through here so that they share keep-alive
+connection pools, per-request timeouts, retries with exponential backoff on
+429/5xx and transport errors, and a per-worker cap on concurrent calls.
+Sync callers share one httpx.Client; async callers get one httpx.AsyncClient
+per event loop. Calls are metered by usage.py, which can refuse one before it
+is sent when the caller is over their rate limit.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+from ongo import metrics
+from . import usage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_lock = threading.Lock()
+_client = None
+_semaphore = None
+# Async clients and semaphores are bound to the loop they were created on
+_async_state = weakref.WeakKeyDictionary()
+
+
+def _timeout(timeout=None):
+    return httpx.Timeout(timeout or settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+def _client_options():
+    return {
+        'base_url': settings.OPENAI_API_BASE,
+        'timeout': _timeout(),
+        'limits': httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+        ),
+        'headers': {'Authorization': f'Bearer {settings.OPENAI_API_KEY}'},
+    }
+
+
+def get_client():
+    global _client, _semaphore
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(**_client_options())
+            _semaphore = threading.BoundedSemaphore(settings.OPENAI_MAX_CONCURRENCY)
+    return _client, _semaphore
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        state = _async_state[loop] = (
+            httpx.AsyncClient(**_client_options()),
+            asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY),
+        )
+    return state
+
+
+def reset_clients():
+    """Drop pooled clients so the next call picks up changed settings."""
+    global _client, _semaphore
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = _semaphore = None
+    _async_state.clear()
+
+
+def _backoff(attempt, response=None):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.OPENAI_BACKOFF_MAX)
+        except ValueError:
+            pass
+    delay = min(settings.OPENAI_BACKOFF_BASE * 2 ** attempt, settings.OPENAI_BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 2)
+
+
+def _error(response):
+    try:
+        message = response.json()['error']['message']
+    except (ValueError, KeyError, TypeError):
+        message = response.text
+    return LLMError(f"OpenAI API error {response.status_code}: {message}", response.status_code)
+
+
+def _should_retry(attempt, response=None, exc=None):
+    if attempt >= settings.OPENAI_MAX_RETRIES:
+        return False
+    return exc is not None or response.status_code in RETRY_STATUSES
+
+
+def _send(path, payload, stream=False, timeout=None):
+    start = time.perf_counter()
+    try:
+        with metrics.timed('llm'):
+            return _send_with_retries(path, payload, stream, timeout)
+    finally:
+        metrics.observe_llm_call(path, time.perf_counter() - start)
+
+
+def _send_with_retries(path, payload, stream, timeout):
+    client, _ = get_client()
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        request = client.build_request('POST', path, json=payload, timeout=_timeout(timeout))
+        try:
+            response = client.send(request, stream=stream)
+        except httpx.TransportError as e:
+            if not _should_retry(attempt, exc=e):
+                raise LLMError(f"OpenAI API request failed: {e}") from e
+            delay = _backoff(attempt)
+        else:
+            if response.status_code < 400:
+                return response
+            response.read()
+            response.close()
+            if not _should_retry(attempt, response):
+                raise _error(response)
+            delay = _backoff(attempt, response)
+        logger.warning("Retrying OpenAI request to %s in %.2fs (attempt %d)", path, delay, attempt + 1)
+        time.sleep(delay)
+
+
+async def _asend(path, payload, timeout=None):
+    start = time.perf_counter()
+    try:
+        with metrics.timed('llm'):
+            return await _asend_with_retries(path, payload, timeout)
+    finally:
+        metrics.observe_llm_call(path, time.perf_counter() - start)
+
+
+async def _asend_with_retries(path, payload, timeout):
+    client, _ = get_async_client()
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        try:
+            response = await client.post(path, json=payload, timeout=_timeout(timeout))
+        except httpx.TransportError as e:
+            if not _should_retry(attempt, exc=e):
+                raise LLMError(f"OpenAI API request failed: {e}") from e
+            delay = _backoff(attempt)
+        else:
+            if response.status_code < 400:
+                return response
+            if not _should_retry(attempt, response):
+                raise _error(response)
+            delay = _backoff(attempt, response)
+        logger.warning("Retrying OpenAI request to %s in %.2fs (attempt %d)", path, delay, attempt + 1)
+        await asyncio.sleep(delay)
+
+
+def chat_completion(messages, model=DEFAULT_MODEL, timeout=None, **params):
+    """Run a chat completion and return the decoded JSON response."""
+    payload = {'model': model, 'messages': messages, **params}
+    _, semaphore = get_client()
+    with usage.metered(payload) as meter, semaphore:
+        data = _send('/chat/completions', payload, timeout=timeout).json()
+        meter.record(data)
+        return data
+
+
+def stream_chat_completion(messages, model=DEFAULT_MODEL, timeout=None, **params):
+    """Yield content deltas of a streamed chat completion as they arrive."""
+    # The final chunk then reports the usage of the whole stream
+    payload = {'model': model, 'messages': messages, 'stream': True, 'stream_options': {'include_usage': True}, **params}
+    _, semaphore = get_client()
+    with usage.metered(payload) as meter, semaphore:
+        response = _send('/chat/completions', payload, stream=True, timeout=timeout)
+        try:
+            for line in response.iter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    meter.record(chunk)
+                if not chunk.get('choices'):
+                    continue
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    meter.add_text(delta)
+                    yield delta
+        finally:
+            response.close()
+
+
+async def achat_completion(messages, model=DEFAULT_MODEL, timeout=None, **params):
+    """Awaitable chat completion; returns the decoded JSON response."""
+    payload = {'model': model, 'messages': messages, **params}
+    _, semaphore = get_async_client()
+    async with usage.ametered(payload) as meter:
+        async with semaphore:
+            data = (await _asend('/chat/completions', payload, timeout=timeout)).json()
+            meter.record(data)
+            return data
+
+
+def text_completion(prompt, model, timeout=None, **params):
+    """Legacy completions endpoint."""
+    payload = {'model': model, 'prompt': prompt, **params}
+    _, semaphore = get_client()
+    with usage.metered(payload) as meter, semaphore:
+        data = _send('/completions', payload, timeout=timeout).json()
+        meter.record(data)
+        return data
+
+
+def message_content(response):
+    return response['choices'][0]['message']['content'].strip()
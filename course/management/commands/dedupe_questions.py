@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from course import dedup, grading
+from course.models import Answer, Lesson, Question
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge near-duplicate questions in existing practice banks: the oldest question of each group is kept, "
+        "answers to the others are moved onto it and re-graded against it, and the others are deleted. A "
+        "submission keeps one answer per question, so further answers of the same submission are deleted too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lesson', type=int, action='append', help='Only this lesson (repeatable)')
+        parser.add_argument('--threshold', type=float, help='Similarity threshold (defaults to QUESTION_DEDUP_THRESHOLD)')
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without changing anything')
+
+    def handle(self, *args, **options):
+        lessons = Lesson.objects.filter(type='practice').order_by('id')
+        if options['lesson']:
+            lessons = lessons.filter(pk__in=options['lesson'])
+
+        removed = 0
+        for lesson_id in lessons.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                Lesson.objects.select_for_update().filter(pk=lesson_id).exists()
+                groups = dedup.find_duplicates(lesson_id, options['threshold'])
+                duplicates = [pk for group in groups.values() for pk in group]
+                if not duplicates:
+                    continue
+                self.stdout.write(f"lesson {lesson_id}: {len(duplicates)} duplicates of {len(groups)} questions")
+                removed += len(duplicates)
+                if options['dry_run']:
+                    continue
+                answer_key = grading.build_answer_key(lesson_id)
+                for kept, group in groups.items():
+                    self.move_answers(answer_key[kept], kept, group)
+                Question.objects.filter(pk__in=duplicates).delete()
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} duplicate questions"))
+
+    def move_answers(self, entry, kept, group):
+        """
+        Move answers to the group's duplicates onto the kept question, re-graded
+        against its key. Answers left behind, of submissions that already answer
+        the kept question, go with the duplicates. Submission scores stay as graded.
+        """
+        answered = set(
+            Answer.objects.filter(question_id=kept).exclude(submission=None).values_list('submission_id', flat=True)
+        )
+        moved = []
+        for answer in Answer.objects.filter(question_id__in=group).order_by('id'):
+            if answer.submission_id is not None:
+                if answer.submission_id in answered:
+                    continue
+                answered.add(answer.submission_id)
+            answer.question_id = kept
+            answer.is_correct = grading.check_answer(entry, answer.text)[1]
+            moved.append(answer)
+        Answer.objects.bulk_update(moved, ['question', 'is_correct'])
@@ -0,0 +1,76 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from course import fast_serializers
+from course.models import Course, Lesson
+
+# SQLite reports full table scans as "SCAN <table>" (index walks say "USING ... INDEX"),
+# PostgreSQL as "Seq Scan on <table>".
+SEQ_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)(?! USING)(?!.*\bINDEX\b)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def endpoint_queries(course_id, lesson_id, author_id):
+    """The ORM queries behind each hot endpoint, as (endpoint, description, queryset)."""
+    course_ids = [course_id]
+    lesson_ids = list(Lesson.objects.filter(course_id=course_id).values_list('id', flat=True)) or [lesson_id]
+    return [
+        ('GET /api/courses/', 'catalogue page',
+         Course.objects.with_lesson_count().order_by('-created_at', '-id')[:21]),
+        ('GET /api/course/my/', 'courses by author',
+         Course.objects.filter(author_id=author_id).with_lesson_count().order_by('-created_at', '-id')[:21]),
+        ('GET /api/course/<pk>/', 'course by id',
+         fast_serializers.course_rows(course_ids)),
+        ('GET /api/course/<pk>/', 'course lessons',
+         fast_serializers.lesson_rows(course_ids)),
+        ('GET /api/course/<pk>/', 'lesson questions',
+         fast_serializers.question_rows(lesson_ids)),
+        ('POST /api/generate-*/generate/', 'lesson by id and course',
+         Lesson.objects.filter(id=lesson_id, course_id=course_id)),
+        ('POST /api/generate-course/generate/', 'course lessons by type',
+         Lesson.objects.filter(course_id=course_id, type__in=['reading', 'practice']).order_by('id')),
+        ('GET /api/lessons/<pk>/', 'lesson by id',
+         fast_serializers.lesson_row(lesson_id)),
+        ('GET /api/lessons/<pk>/', 'questions by lesson',
+         fast_serializers.question_rows([lesson_id])),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN on the ORM queries behind each hot endpoint and flag sequential scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, help='Course id to plan against (defaults to the first course)')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any sequential scan is found')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full plan of every query')
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"EXPLAIN parsing is not implemented for the {connection.vendor} backend")
+
+        course = Course.objects.filter(pk=options['course']).first() if options['course'] else Course.objects.order_by('id').first()
+        lesson = Lesson.objects.filter(course=course).order_by('id').first() if course else None
+        course_id = course.pk if course else 1
+        lesson_id = lesson.pk if lesson else 1
+        author_id = course.author_id if course else 1
+
+        flagged = []
+        for endpoint, description, queryset in endpoint_queries(course_id, lesson_id, author_id):
+            plan = queryset.explain()
+            scans = sorted(set(pattern.findall(plan)))
+            label = f"{endpoint} [{description}]"
+            if scans:
+                flagged.append(label)
+                self.stdout.write(self.style.WARNING(f"SEQ SCAN {label}: {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok       {label}"))
+            if options['verbose_plans'] or scans:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError(f"{len(flagged)} queries use sequential scans")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from course import search
+
+
+class Command(BaseCommand):
+    help = "Recreate every full-text search document from the course, lesson and question tables."
+
+    def handle(self, *args, **options):
+        if connection.vendor not in search.SUPPORTED_VENDORS:
+            raise CommandError(f"Full-text search is not implemented for the {connection.vendor} backend")
+        with transaction.atomic():
+            count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents"))
@@ -0,0 +1,100 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_progress(apps, schema_editor):
+    """Replay submissions recorded before the aggregates existed, oldest first."""
+    Submission = apps.get_model('course', 'Submission')
+    LessonProgress = apps.get_model('course', 'LessonProgress')
+    CourseProgress = apps.get_model('course', 'CourseProgress')
+    CourseAnalytics = apps.get_model('course', 'CourseAnalytics')
+
+    lessons, courses, analytics = {}, {}, {}
+    for submission in Submission.objects.select_related('lesson').order_by('created_at', 'id').iterator():
+        course_id = submission.lesson.course_id
+        lesson = lessons.setdefault(
+            (submission.student_id, submission.lesson_id),
+            LessonProgress(student_id=submission.student_id, lesson_id=submission.lesson_id),
+        )
+        course = courses.setdefault(
+            (submission.student_id, course_id),
+            CourseProgress(student_id=submission.student_id, course_id=course_id),
+        )
+        totals = analytics.setdefault(course_id, CourseAnalytics(course_id=course_id))
+        if course.attempts == 0:
+            totals.students += 1
+        if lesson.attempts == 0:
+            course.lessons_completed += 1
+            totals.lessons_completed += 1
+        best_score = max(min(lesson.best_score, submission.total), submission.score)
+        for row in (course, totals):
+            row.score += best_score - lesson.best_score
+            row.total += submission.total - lesson.total
+        lesson.attempts += 1
+        course.attempts += 1
+        totals.submissions += 1
+        lesson.best_score, lesson.last_score, lesson.total = best_score, submission.score, submission.total
+
+    LessonProgress.objects.bulk_create(lessons.values())
+    CourseProgress.objects.bulk_create(courses.values())
+    CourseAnalytics.objects.bulk_create(analytics.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0006_submission'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseAnalytics',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='analytics', serialize=False, to='course.course')),
+                ('students', models.PositiveIntegerField(default=0)),
+                ('submissions', models.PositiveIntegerField(default=0)),
+                ('lessons_completed', models.PositiveIntegerField(default=0)),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lessons_completed', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='course.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['course', 'updated_at', 'id'], name='course_progress_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('student', 'course'), name='course_progress_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LessonProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('best_score', models.PositiveIntegerField(default=0)),
+                ('last_score', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='course.lesson')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lesson_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('student', 'lesson'), name='lesson_progress_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# SQLite rebuilds a table to alter it, which drops its triggers: any later migration
+# that alters SearchDocument must recreate them
+SQLITE_INDEX = [
+    # External-content FTS5 table over course_searchdocument, kept in sync by triggers
+    """CREATE VIRTUAL TABLE course_searchindex USING fts5(
+        title, body, content='course_searchdocument', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER course_searchdocument_ai AFTER INSERT ON course_searchdocument BEGIN
+        INSERT INTO course_searchindex(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER course_searchdocument_ad AFTER DELETE ON course_searchdocument BEGIN
+        INSERT INTO course_searchindex(course_searchindex, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER course_searchdocument_au AFTER UPDATE ON course_searchdocument BEGIN
+        INSERT INTO course_searchindex(course_searchindex, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO course_searchindex(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS course_searchdocument_au",
+    "DROP TRIGGER IF EXISTS course_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS course_searchdocument_ai",
+    "DROP TABLE IF EXISTS course_searchindex",
+]
+
+POSTGRESQL_INDEX = [
+    # Titles outrank bodies; the column is maintained by PostgreSQL itself
+    """ALTER TABLE course_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(body, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX course_searchdocument_vector_idx ON course_searchdocument USING GIN (search_vector)",
+]
+
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS course_searchdocument_vector_idx",
+    "ALTER TABLE course_searchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX})
+
+
+def drop_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP})
+
+
+def backfill_documents(apps, schema_editor):
+    Course = apps.get_model('course', 'Course')
+    Lesson = apps.get_model('course', 'Lesson')
+    Question = apps.get_model('course', 'Question')
+    SearchDocument = apps.get_model('course', 'SearchDocument')
+
+    documents = [
+        SearchDocument(kind='course', object_id=pk, course_id=pk, title=title, body=description or '')
+        for pk, title, description in Course.objects.values_list('pk', 'title', 'description').iterator()
+    ]
+    documents += [
+        SearchDocument(kind='lesson', object_id=pk, course_id=course_id, lesson_id=pk, title=title, body=content or '')
+        for pk, course_id, title, content in Lesson.objects.values_list('pk', 'course_id', 'title', 'content').iterator()
+    ]
+    documents += [
+        SearchDocument(kind='question', object_id=pk, course_id=course_id, lesson_id=lesson_id, question_id=pk, body=text)
+        for pk, course_id, lesson_id, text in Question.objects.values_list('pk', 'lesson__course_id', 'lesson_id', 'text').iterator()
+    ]
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0007_progress_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('course', 'Course'), ('lesson', 'Lesson'), ('question', 'Question')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='course.course')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='course.lesson')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='course.question')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_unique')],
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(backfill_documents, migrations.RunPython.noop),
+    ]
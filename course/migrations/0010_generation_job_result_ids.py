@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def results_to_ids(apps, schema_editor):
+    """Job results used to embed serialized questions and lessons, answers included; keep only their ids."""
+    GenerationJob = apps.get_model('course', 'GenerationJob')
+    for job in GenerationJob.objects.exclude(result=None).iterator():
+        result = dict(job.result)
+        if 'questions' in result:
+            result['question_ids'] = [question['id'] for question in result.pop('questions')]
+        if 'lesson' in result:
+            result['lesson_id'] = (result.pop('lesson') or {}).get('id')
+        if result != job.result:
+            job.result = result
+            job.save(update_fields=['result'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0009_llm_usage'),
+    ]
+
+    operations = [
+        migrations.RunPython(results_to_ids, migrations.RunPython.noop),
+    ]
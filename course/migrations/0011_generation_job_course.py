@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0010_generation_job_result_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='course',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='course.course'),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='lesson',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='course.lesson'),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='kind',
+            field=models.CharField(choices=[('questions', 'Questions'), ('reading', 'Reading'), ('course', 'Course')], max_length=10),
+        ),
+    ]
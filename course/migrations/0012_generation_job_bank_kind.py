@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0011_generation_job_course'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='generationjob',
+            name='kind',
+            field=models.CharField(choices=[('questions', 'Questions'), ('reading', 'Reading'), ('course', 'Course'), ('bank', 'Question bank')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def course_from_lesson(apps, schema_editor):
+    GenerationJob = apps.get_model('course', 'GenerationJob')
+    Lesson = apps.get_model('course', 'Lesson')
+    GenerationJob.objects.filter(course__isnull=True).update(
+        course_id=models.Subquery(Lesson.objects.filter(pk=models.OuterRef('lesson_id')).values('course_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+    # The backfill runs in its own migration: PostgreSQL refuses to alter a
+    # table with pending trigger events in the transaction that updated it
+
+    dependencies = [
+        ('course', '0012_generation_job_bank_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(course_from_lesson, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,35 @@
 import json
-from django.db import models
+import uuid
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
 from model_utils.managers import InheritanceManager
 from accounts.models import User
+from .signals import questions_bulk_created
+
+
+class CourseQuerySet(models.QuerySet):
+    def with_lessons(self):
+        """Prefetch lessons and their concrete question subclasses in two extra queries."""
+        return self.prefetch_related(
+            models.Prefetch('lessons', queryset=Lesson.objects.order_by('id')),
+            models.Prefetch(
+                'lessons__questions',
+                queryset=Question.objects.select_subclasses().order_by('id'),
+            ),
+        )
+
+    def with_lesson_count(self):
+        # A correlated subquery instead of Count('lessons') avoids a GROUP BY, so
+        # the (created_at, id) index can drive the paginated ordering
+        lesson_count = (
+            Lesson.objects.filter(course=models.OuterRef('pk'))
+            .order_by()
+            .values('course')
+            .annotate(count=models.Count('id'))
+            .values('count')
+        )
+        return self.annotate(lesson_count=Coalesce(models.Subquery(lesson_count), 0))
+
 
 class Course(models.Model):
     title = models.CharField(max_length=255)
@@ -9,6 +37,16 @@ class Course(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CourseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # CoursesMyView: filter by author, newest first
+            models.Index(fields=['author', 'created_at'], name='course_author_created_idx'),
+            # Catalogue cursor pagination order
+            models.Index(fields=['created_at', 'id'], name='course_created_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -26,14 +64,67 @@ class Lesson(models.Model):
     video_url = models.URLField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'type'], name='lesson_course_type_idx'),
+        ]
+
     def __str__(self):
         return f"{self.course.title} - {self.title}"
 
+class QuestionManager(InheritanceManager):
+    def bulk_create_subclasses(self, questions, batch_size=None):
+        """
+        Insert concrete Question subclasses in one transaction with a handful of
+        statements. bulk_create() refuses multi-table inheritance, so the parent
+        rows are bulk inserted first and each subclass table then gets a batched
+        insert keyed by the returned primary keys.
+        """
+        questions = list(questions)
+        if not questions:
+            return questions
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db, savepoint=False):
+            if not connection.features.can_return_rows_from_bulk_insert:
+                for question in questions:
+                    question.save(using=self.db)
+                return questions
+
+            parents = Question._base_manager.db_manager(self.db).bulk_create(
+                [Question(lesson_id=question.lesson_id, text=question.text) for question in questions],
+                batch_size=batch_size,
+            )
+            by_model = {}
+            for question, parent in zip(questions, parents):
+                question.pk = question.id = parent.pk
+                by_model.setdefault(type(question), []).append(question)
+
+            for model, objs in by_model.items():
+                fields = model._meta.local_concrete_fields
+                max_size = connection.ops.bulk_batch_size(fields, objs)
+                size = min(batch_size, max_size) if batch_size else max_size
+                for start in range(0, len(objs), size):
+                    model._base_manager.db_manager(self.db)._insert(objs[start:start + size], fields=fields, using=self.db)
+
+        for question in questions:
+            question._state.adding = False
+            question._state.db = self.db
+        questions_bulk_created.send(
+            sender=Question, lesson_ids={question.lesson_id for question in questions}, questions=questions
+        )
+        return questions
+
+
 class Question(models.Model):
     lesson = models.ForeignKey(Lesson, related_name='questions', on_delete=models.CASCADE)
     text = models.TextField()
 
-    objects = InheritanceManager()
+    objects = QuestionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lesson', 'id'], name='question_lesson_id_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -53,10 +144,142 @@ class MultipleChoiceQuestion(Question):
     def options(self, value):
         self._options = value
 
+class Submission(models.Model):
+    lesson = models.ForeignKey(Lesson, related_name='submissions', on_delete=models.CASCADE)
+    student = models.ForeignKey(User, related_name='submissions', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'lesson', 'created_at'], name='submission_student_lesson_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.lesson.title} ({self.score}/{self.total})"
+
 class Answer(models.Model):
     question = models.ForeignKey(Question, related_name='answers', on_delete=models.CASCADE)
+    submission = models.ForeignKey(Submission, related_name='answers', blank=True, null=True, on_delete=models.CASCADE)
     text = models.TextField()
     is_correct = models.BooleanField(default=False)
 
     def __str__(self):
         return self.text
+
+class LessonProgress(models.Model):
+    """A student's standing on one practice lesson, updated as each submission is recorded."""
+    student = models.ForeignKey(User, related_name='lesson_progress', on_delete=models.CASCADE)
+    lesson = models.ForeignKey(Lesson, related_name='progress', on_delete=models.CASCADE)
+    attempts = models.PositiveIntegerField(default=0)
+    best_score = models.PositiveIntegerField(default=0)
+    last_score = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'lesson'], name='lesson_progress_unique'),
+        ]
+
+class CourseProgress(models.Model):
+    """Per-student course totals: sums of each lesson's best score and question count."""
+    student = models.ForeignKey(User, related_name='course_progress', on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, related_name='progress', on_delete=models.CASCADE)
+    lessons_completed = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    score = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'course'], name='course_progress_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['course', 'updated_at', 'id'], name='course_progress_recent_idx'),
+        ]
+
+class CourseAnalytics(models.Model):
+    """Course-wide totals across every student, so dashboards read a single row."""
+    course = models.OneToOneField(Course, related_name='analytics', on_delete=models.CASCADE, primary_key=True)
+    students = models.PositiveIntegerField(default=0)
+    submissions = models.PositiveIntegerField(default=0)
+    lessons_completed = models.PositiveIntegerField(default=0)
+    score = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class SearchDocument(models.Model):
+    """
+    One searchable course, lesson or question. The full-text index over
+    title and body is backend-specific and lives outside the ORM (see search.py).
+    """
+    KIND_CHOICES = [
+        ('course', 'Course'),
+        ('lesson', 'Lesson'),
+        ('question', 'Question'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # Foreign keys let deletes cascade to the documents in bulk, without signal handlers
+    course = models.ForeignKey(Course, related_name='search_documents', on_delete=models.CASCADE)
+    lesson = models.ForeignKey(Lesson, related_name='search_documents', blank=True, null=True, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, related_name='search_documents', blank=True, null=True, on_delete=models.CASCADE)
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_document_unique'),
+        ]
+
+class GenerationJob(models.Model):
+    KIND_CHOICES = [
+        ('questions', 'Questions'),
+        ('reading', 'Reading'),
+        ('course', 'Course'),
+        ('bank', 'Question bank'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    course = models.ForeignKey(Course, related_name='generation_jobs', on_delete=models.CASCADE)
+    # Empty for jobs that generate a whole course
+    lesson = models.ForeignKey(Lesson, related_name='generation_jobs', blank=True, null=True, on_delete=models.CASCADE)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+class LLMUsage(models.Model):
+    """Model calls and tokens spent per user, course and day, written by usage.py."""
+    # Kept when the user or course is deleted: the tokens were still paid for
+    user = models.ForeignKey(User, related_name='llm_usage', blank=True, null=True, on_delete=models.SET_NULL)
+    course = models.ForeignKey(Course, related_name='llm_usage', blank=True, null=True, on_delete=models.SET_NULL)
+    day = models.DateField()
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day'], name='llm_usage_day_idx'),
+            models.Index(fields=['user', 'course', 'day'], name='llm_usage_lookup_idx'),
+        ]
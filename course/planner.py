@@ -0,0 +1,244 @@
+"""
+Packing of question generation into few, token-budgeted prompts.
+
+Asking for one lesson's questions at a time pays the full instructions and a
+round trip per lesson, and a single reply only has room for a handful of
+questions. plan() packs (lesson, topic, count) requests into chunks whose
+prompt and expected reply fit GENERATION_PROMPT_TOKEN_BUDGET: large counts
+continue in the next chunk and small lessons share one. Every chunk asks for
+one JSON list whose items are tagged with a short lesson key, so the reply
+splits back to the right lessons. generate_bank() runs the chunks of a plan
+concurrently and saves each lesson through save_questions(), deduplication
+included.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from . import generation, llm, usage
+from .generation import TOKENS_PER_QUESTION
+from .generation_cache import generation_cache
+from .models import Lesson
+from .schemas import parse_packed_questions
+from .usage import estimate_tokens
+
+PACKED_MODEL_PARAMS = {
+    'model': llm.DEFAULT_MODEL,
+    'temperature': 0.7,
+}
+
+
+@dataclass(frozen=True)
+class Section:
+    """Part of a chunk: count questions about topic for one lesson."""
+    lesson: Lesson
+    topic: str
+    count: int
+    # Numbers the parts of a lesson split across chunks, so each asks for different questions
+    part: int = 0
+    # The lesson's bank_state() when planned, so a saved chunk is not replayed from the cache
+    bank: str = ''
+
+    @property
+    def label(self):
+        return f"{self.topic}, part {self.part + 1}" if self.part else self.topic
+
+
+def _key(position):
+    return f'L{position + 1}'
+
+
+def _section_line(position, label, count):
+    return f"{_key(position)}: {label} - {count} questions"
+
+
+def build_packed_prompt(course_title, student_interests, sections):
+    lines = [
+        f"Create one-choice questions for several lessons of a {course_title} course. "
+        f"The questions should be related to the following student interests: {', '.join(student_interests)}. "
+        "For each question, provide the question text, four options, and the correct answer index (0-3).",
+        "Lessons, as key: topic - number of questions:",
+        *(_section_line(i, section.label, section.count) for i, section in enumerate(sections)),
+        "Respond with a single JSON list only, with exactly the requested number of questions for every lesson, "
+        "each tagged with its lesson key, like: "
+        '[{"lesson": "L1", "question": "question text", "options": ["option1", "option2", "option3", "option4"], '
+        '"correct_answer_index": 0}, ...]',
+    ]
+    return '\n'.join(lines)
+
+
+def packed_messages(course_title, student_interests, sections):
+    return [
+        {"role": "system", "content": generation.QUESTIONS_SYSTEM_PROMPT},
+        {"role": "user", "content": build_packed_prompt(course_title, student_interests, sections)},
+    ]
+
+
+def _prompt_tokens(messages):
+    return sum(estimate_tokens(message['content']) for message in messages)
+
+
+def plan(course_title, student_interests, requests, budget=None):
+    """
+    Pack [(lesson, topic, count)] into chunks, each a list of Sections whose
+    prompt and expected reply fit the token budget. Lessons keep their order.
+    """
+    budget = budget or settings.GENERATION_PROMPT_TOKEN_BUDGET
+    banks = generation.bank_states([lesson.pk for lesson, _, _ in requests])
+    base = _prompt_tokens(packed_messages(course_title, student_interests, []))
+    chunks, current, used = [], [], base
+    for lesson, topic, count in requests:
+        # Sized for the worst case, so the estimate holds wherever the section lands
+        section_tokens = estimate_tokens(_section_line(999, f"{topic}, part 999", count)) + 1
+        part = 0
+        while count > 0:
+            fits = (budget - used - section_tokens) // TOKENS_PER_QUESTION
+            if fits <= 0:
+                if not current:
+                    raise ValueError(f"A prompt for lesson {lesson.pk} does not fit the token budget of {budget}")
+                chunks.append(current)
+                current, used = [], base
+                continue
+            section = Section(lesson, topic, min(count, fits), part, banks[lesson.pk])
+            current.append(section)
+            used += section_tokens + section.count * TOKENS_PER_QUESTION
+            count -= section.count
+            part += 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _followup_messages(messages, content, missing):
+    wanted = ', '.join(f"{count} for {key}" for key, count in missing.items())
+    return messages + [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": (
+            f"Some questions were missing or malformed. Provide {wanted}: different questions, as a JSON list of "
+            "objects with 'lesson', 'question', 'options' (four strings) and 'correct_answer_index' (0-3). "
+            "Respond with the JSON list only."
+        )},
+    ]
+
+
+def chunk_request(course_title, student_interests, sections):
+    """Return (messages, model params, cache inputs) for a chunk."""
+    messages = packed_messages(course_title, student_interests, sections)
+    # What the chunk's questions need, within what the prompt leaves of the budget
+    max_tokens = min(
+        settings.GENERATION_PROMPT_TOKEN_BUDGET - _prompt_tokens(messages),
+        generation.questions_max_tokens(sum(section.count for section in sections)),
+    )
+    model_params = {**PACKED_MODEL_PARAMS, 'max_tokens': max_tokens}
+    inputs = {
+        'course_title': course_title,
+        'student_interests': student_interests,
+        # Serialized, since the cache key ignores the order of lists
+        'sections': json.dumps([
+            [section.lesson.pk, section.bank, section.label, section.count] for section in sections
+        ]),
+    }
+    return messages, model_params, inputs
+
+
+def forget_chunk(course_title, student_interests, sections):
+    """Drop a chunk's cached reply, so the same chunk asks the model again."""
+    _, model_params, inputs = chunk_request(course_title, student_interests, sections)
+    generation_cache.delete('questions-packed', inputs, {'system': generation.QUESTIONS_SYSTEM_PROMPT, **model_params})
+
+
+def generate_chunk(course_title, student_interests, sections):
+    """
+    Ask for one chunk's questions in a single call and return a list of
+    validated question dicts per section, in order. Questions missing from
+    the reply are re-requested once, all sections together.
+    """
+    keys = [_key(i) for i in range(len(sections))]
+    messages, model_params, inputs = chunk_request(course_title, student_interests, sections)
+
+    def generate():
+        response = llm.chat_completion(messages=messages, n=1, stop=None, **model_params)
+        content = llm.message_content(response)
+        grouped, _ = parse_packed_questions(content, keys)
+        missing = {
+            key: section.count - len(grouped[key])
+            for key, section in zip(keys, sections)
+            if len(grouped[key]) < section.count
+        }
+        if missing:
+            response = llm.chat_completion(
+                messages=_followup_messages(messages, content, missing), n=1, stop=None, **model_params
+            )
+            extra, _ = parse_packed_questions(llm.message_content(response), keys)
+            for key, count in missing.items():
+                grouped[key] += extra[key][:count]
+        if not any(grouped.values()):
+            raise ValueError("The model response contained no valid questions")
+        return [grouped[key][:section.count] for key, section in zip(keys, sections)]
+
+    return generation_cache.get_or_generate(
+        'questions-packed', inputs, {'system': generation.QUESTIONS_SYSTEM_PROMPT, **model_params}, generate
+    )
+
+
+def generate_bank(course_title, student_interests, requests):
+    """
+    Generate and save questions for [(lesson, topic, count)]. Chunks run on a
+    bounded thread pool; each lesson's share of a chunk is saved in its own
+    transaction as the chunk returns, on the calling thread. Returns one status
+    dict per lesson, in request order.
+    """
+    results = {
+        lesson.pk: {'lesson_id': lesson.pk, 'requested': count, 'questions_created': 0, 'duplicates_dropped': 0}
+        for lesson, _, count in requests
+    }
+    chunks = plan(course_title, student_interests, requests)
+    if chunks:
+        workers = min(settings.GENERATION_FANOUT_WORKERS, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='question-planner') as pool:
+            futures = {
+                pool.submit(usage.propagate(generate_chunk), course_title, student_interests, chunk): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                save_chunk(course_title, student_interests, futures[future], future, results)
+    set_statuses(results)
+    return list(results.values())
+
+
+def save_chunk(course_title, student_interests, chunk, future, results):
+    """
+    Save a finished chunk's questions, counting them into results[lesson_id];
+    failures set 'error'. A chunk with a section that saved nothing is dropped
+    from the cache: that lesson's bank is unchanged, so a retry would replay it.
+    """
+    try:
+        outputs = future.result()
+    except Exception as e:
+        for section in chunk:
+            results[section.lesson.pk]['error'] = str(e)
+        return
+    replayable = False
+    for section, questions in zip(chunk, outputs):
+        result = results[section.lesson.pk]
+        try:
+            created = generation.save_questions(section.lesson, questions)
+        except Exception as e:
+            result['error'] = str(e)
+            continue
+        result['questions_created'] += len(created)
+        result['duplicates_dropped'] += len(questions) - len(created)
+        if questions and not created:
+            replayable = True
+    if replayable:
+        forget_chunk(course_title, student_interests, chunk)
+
+
+def set_statuses(results):
+    """Set each result's status; a lesson whose generated questions were all duplicates failed."""
+    for result in results.values():
+        if 'error' not in result and result.get('duplicates_dropped') and not result['questions_created']:
+            result['error'] = str(generation.duplicates_error(result['duplicates_dropped']))
+        result['status'] = 'failed' if 'error' in result else 'succeeded'
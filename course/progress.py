@@ -0,0 +1,82 @@
+"""
+Materialized progress aggregates, kept current as submissions are recorded.
+
+Each submission touches one LessonProgress row (locked, since the new best
+score depends on the old one) and then applies F() deltas to the student's
+CourseProgress row and the course's CourseAnalytics row, so the cost of a
+submission and of reading a dashboard never depends on how many
+submissions exist.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CourseAnalytics, CourseProgress, LessonProgress
+
+
+def _apply(model, lookup, **deltas):
+    """Add deltas to the row matching lookup, creating it when missing. Returns True if created."""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(updated_at=timezone.now(), **changes):
+        return False
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+        return True
+    except IntegrityError:
+        # Another submission created the row first
+        model.objects.filter(**lookup).update(updated_at=timezone.now(), **changes)
+        return False
+
+
+def record(submission, course_id):
+    with transaction.atomic(savepoint=False):
+        progress, first_attempt = LessonProgress.objects.select_for_update().get_or_create(
+            student_id=submission.student_id, lesson_id=submission.lesson_id
+        )
+        # Best scores count against the lesson's current question count
+        best_score = max(min(progress.best_score, submission.total), submission.score)
+        score_delta = best_score - progress.best_score
+        total_delta = submission.total - progress.total
+
+        progress.attempts += 1
+        progress.best_score = best_score
+        progress.last_score = submission.score
+        progress.total = submission.total
+        progress.save(update_fields=['attempts', 'best_score', 'last_score', 'total', 'updated_at'])
+
+        new_student = _apply(
+            CourseProgress,
+            {'student_id': submission.student_id, 'course_id': course_id},
+            lessons_completed=int(first_attempt),
+            attempts=1,
+            score=score_delta,
+            total=total_delta,
+        )
+        _apply(
+            CourseAnalytics,
+            {'course_id': course_id},
+            students=int(new_student),
+            submissions=1,
+            lessons_completed=int(first_attempt),
+            score=score_delta,
+            total=total_delta,
+        )
+    return progress
+
+
+def summarize(analytics, practice_lessons):
+    """Dashboard figures from a CourseAnalytics row (or None before any submission)."""
+    students = analytics.students if analytics else 0
+    completed = analytics.lessons_completed if analytics else 0
+    total = analytics.total if analytics else 0
+    possible = students * practice_lessons
+    return {
+        'students': students,
+        'submissions': analytics.submissions if analytics else 0,
+        'practice_lessons': practice_lessons,
+        'lessons_completed': completed,
+        'completion_rate': completed / possible if possible else 0.0,
+        'average_score': analytics.score / total if total else 0.0,
+        'updated_at': analytics.updated_at if analytics else None,
+    }
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, tree_cache
+from .models import Course, Lesson, Question
+from .signals import questions_bulk_created
+
+
+def _invalidate(kind, object_id):
+    tree_cache.invalidate(kind, object_id)
+    # Again once the write is visible, in case a reader re-cached the old payload meanwhile
+    transaction.on_commit(lambda: tree_cache.invalidate(kind, object_id))
+
+
+def _course_id_for_lesson(lesson_id):
+    return Lesson.objects.filter(pk=lesson_id).values_list('course_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Course)
+def course_changed(sender, instance, signal, created=False, **kwargs):
+    _invalidate(tree_cache.COURSE, instance.pk)
+    # Deletes need nothing: search documents cascade with what they index
+    if signal is post_save:
+        search.index(search.course_document(instance), created)
+
+
+@receiver([post_save, post_delete], sender=Lesson)
+def lesson_changed(sender, instance, signal, created=False, **kwargs):
+    _invalidate(tree_cache.COURSE, instance.course_id)
+    _invalidate(tree_cache.LESSON, instance.pk)
+    if signal is post_save:
+        search.index(search.lesson_document(instance), created)
+
+
+@receiver([post_save, post_delete])
+def question_changed(sender, instance, signal, created=False, **kwargs):
+    # Sent with the concrete subclass as sender, so match on the instance
+    if not isinstance(instance, Question):
+        return
+    _invalidate(tree_cache.LESSON, instance.lesson_id)
+    if Question.lesson.is_cached(instance):
+        course_id = instance.lesson.course_id
+    else:
+        course_id = _course_id_for_lesson(instance.lesson_id)
+    # None when the lesson is being deleted too; its own signal covers the course
+    if course_id is not None:
+        _invalidate(tree_cache.COURSE, course_id)
+        if signal is post_save:
+            search.index(search.question_document(instance, course_id), created)
+
+
+@receiver(questions_bulk_created)
+def questions_created(sender, lesson_ids, questions, **kwargs):
+    lesson_courses = {q.lesson_id: q.lesson.course_id for q in questions if Question.lesson.is_cached(q)}
+    unresolved = set(lesson_ids) - lesson_courses.keys()
+    if unresolved:
+        lesson_courses.update(Lesson.objects.filter(pk__in=unresolved).values_list('pk', 'course_id'))
+    for course_id in set(lesson_courses.values()):
+        _invalidate(tree_cache.COURSE, course_id)
+    for lesson_id in lesson_ids:
+        _invalidate(tree_cache.LESSON, lesson_id)
+    search.index_many(search.question_document(q, lesson_courses[q.lesson_id]) for q in questions)
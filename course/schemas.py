@@ -0,0 +1,149 @@
+"""
+Parsing and validation of structured LLM output.
+
+Model replies are not guaranteed to be valid JSON: they arrive wrapped in
+Markdown fences, with Python-style single quotes, or cut off at max_tokens.
+parse_generated_questions() recovers whatever well-formed questions it can
+and reports the rest instead of discarding the whole (paid-for) reply.
+"""
+import ast
+import json
+import logging
+import re
+
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+logger = logging.getLogger(__name__)
+
+FENCE_RE = re.compile(r"```(?:json|python)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+class GeneratedQuestion(BaseModel):
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=2, max_length=10)
+    correct_answer_index: int = Field(ge=0)
+
+    @field_validator('question')
+    @classmethod
+    def strip_question(cls, value):
+        value = value.strip()
+        if not value:
+            raise ValueError('question text is empty')
+        return value
+
+    @model_validator(mode='after')
+    def check_answer_index(self):
+        if self.correct_answer_index >= len(self.options):
+            raise ValueError('correct_answer_index is out of range of options')
+        return self
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        # Single-quoted, Python-literal style replies; literal_eval never executes code
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _iter_objects(text):
+    """Yield every balanced top-level {...} span, ignoring braces inside strings."""
+    depth, start, quote, escaped = 0, None, None, False
+    for i, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
+
+
+def extract_items(text):
+    """Return the list of candidate question objects found in a model reply."""
+    fenced = FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = text.strip()
+
+    start, end = text.find('['), text.rfind(']')
+    if start != -1 and end > start:
+        data = _loads(text[start:end + 1])
+        if isinstance(data, list):
+            return data
+    data = _loads(text)
+    if isinstance(data, dict):
+        for value in data.values():
+            if isinstance(value, list):
+                return value
+        return [data]
+
+    # Malformed or truncated list: salvage the individual objects that did parse
+    return [item for item in map(_loads, _iter_objects(text)) if item is not None]
+
+
+def parse_generated_questions(text):
+    """
+    Return (valid, rejected): validated question dicts and (item, error) pairs
+    for the items that failed the schema.
+    """
+    valid, rejected = [], []
+    for item in extract_items(text):
+        try:
+            valid.append(GeneratedQuestion.model_validate(item).model_dump())
+        except ValidationError as e:
+            rejected.append((item, e))
+    if rejected:
+        logger.warning("Rejected %d malformed generated question(s)", len(rejected))
+    return valid, rejected
+
+
+def _section_items(text, keys):
+    """Yield (key, item) pairs from a packed reply: a flat list tagged with 'lesson', or {key: [items]}."""
+    fenced = FENCE_RE.search(text)
+    data = _loads((fenced.group(1) if fenced else text).strip())
+    if isinstance(data, dict) and data and all(isinstance(value, list) for value in data.values()):
+        for key, items in data.items():
+            for item in items:
+                yield str(key), item
+        return
+    for item in extract_items(text):
+        key = item.get('lesson') if isinstance(item, dict) else None
+        # With a single section an untagged item can only belong to it
+        if key is None and len(keys) == 1:
+            key = keys[0]
+        yield (str(key) if key is not None else None), item
+
+
+def parse_packed_questions(text, keys):
+    """
+    Parse a reply to a packed prompt (see planner.py). Return (grouped, rejected):
+    {key: [question dicts]} for every key, and (item, error) pairs for items that
+    failed the schema or named no known section.
+    """
+    grouped, rejected = {key: [] for key in keys}, []
+    for key, item in _section_items(text, keys):
+        if key not in grouped:
+            rejected.append((item, 'unknown lesson key'))
+            continue
+        try:
+            grouped[key].append(GeneratedQuestion.model_validate(item).model_dump())
+        except ValidationError as e:
+            rejected.append((item, e))
+    if rejected:
+        logger.warning("Rejected %d malformed generated question(s)", len(rejected))
+    return grouped, rejected
@@ -0,0 +1,201 @@
+"""
+Full-text search over courses, lessons and questions.
+
+SearchDocument rows are written by the receivers in receivers.py as content
+changes. The inverted index over their title and body is backend-specific
+(migration 0008): an external-content FTS5 table on SQLite, a generated,
+GIN-indexed tsvector column on PostgreSQL. Results are ranked (bm25 /
+ts_rank_cd, with titles weighted above bodies) and carry an HTML-safe
+snippet with the matches wrapped in <mark>. Both backends treat the last word
+of a query as a prefix.
+
+Documents hold course and lesson text and question wording, never answers,
+so results show no more than the course tree any signed-in user can read.
+"""
+import html
+import re
+
+from django.db import NotSupportedError, connection
+
+from .models import SearchDocument
+
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+# Snippet delimiters that cannot occur in user text, swapped for <mark> after escaping
+START, STOP = '\x02', '\x03'
+
+RESULT_FIELDS = ('kind', 'object_id', 'course_id', 'lesson_id', 'title', 'snippet', 'score')
+
+
+def course_document(course):
+    return {
+        'kind': 'course', 'object_id': course.pk, 'course_id': course.pk,
+        'title': course.title, 'body': course.description or '',
+    }
+
+
+def lesson_document(lesson):
+    return {
+        'kind': 'lesson', 'object_id': lesson.pk, 'course_id': lesson.course_id, 'lesson_id': lesson.pk,
+        'title': lesson.title, 'body': lesson.content or '',
+    }
+
+
+def question_document(question, course_id):
+    return {
+        'kind': 'question', 'object_id': question.pk, 'course_id': course_id, 'lesson_id': question.lesson_id,
+        'question_id': question.pk, 'body': question.text,
+    }
+
+
+def index(document, created=False):
+    """Write one document; a new object gets a plain insert, an edit a single UPDATE."""
+    lookup = {'kind': document['kind'], 'object_id': document['object_id']}
+    if created or not SearchDocument.objects.filter(**lookup).update(**document):
+        SearchDocument.objects.create(**document)
+
+
+def index_many(documents):
+    SearchDocument.objects.bulk_create([SearchDocument(**document) for document in documents], batch_size=500)
+
+
+def rebuild():
+    """Recreate every document from the content tables. Returns the number indexed."""
+    from .models import Course, Lesson, Question
+
+    documents = [course_document(course) for course in Course.objects.only('title', 'description').iterator()]
+    documents += [
+        lesson_document(lesson)
+        for lesson in Lesson.objects.only('course_id', 'title', 'content').iterator()
+    ]
+    documents += [
+        question_document(question, question.lesson.course_id)
+        for question in Question.objects.select_related('lesson').only('text', 'lesson__course_id').iterator()
+    ]
+    SearchDocument.objects.all().delete()
+    index_many(documents)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO course_searchindex(course_searchindex) VALUES ('optimize')")
+    return len(documents)
+
+
+def match_expression(text):
+    """
+    An FTS5 MATCH expression for free text: every word must match, and the
+    last one may be a prefix, for search-as-you-type. None when there are no words.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def tsquery_expression(text):
+    """The to_tsquery() counterpart of match_expression(), with the same semantics."""
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    terms[-1] += ':*'
+    return ' & '.join(terms)
+
+
+def _filters(kind, course_id):
+    clauses, params = [], []
+    if kind:
+        clauses.append('d.kind = %s')
+        params.append(kind)
+    if course_id:
+        clauses.append('d.course_id = %s')
+        params.append(course_id)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def _sqlite_sql(query, where, params):
+    expression = match_expression(query)
+    base = (
+        'FROM course_searchindex JOIN course_searchdocument d ON d.id = course_searchindex.rowid '
+        f'WHERE course_searchindex MATCH %s{where}'
+    )
+    select = (
+        'SELECT d.kind, d.object_id, d.course_id, d.lesson_id, d.title, '
+        f"snippet(course_searchindex, -1, '{START}', '{STOP}', '…', 16), "
+        # bm25 is lower for better matches; the title column counts four times the body
+        f'-bm25(course_searchindex, 4.0, 1.0) AS score {base} ORDER BY score DESC, d.id LIMIT %s OFFSET %s'
+    )
+    return expression, f'SELECT COUNT(*) {base}', select, [expression, *params], []
+
+
+def _postgresql_sql(query, where, params):
+    expression = tsquery_expression(query)
+    base = (
+        "FROM course_searchdocument d, to_tsquery('english', %s) q "
+        f'WHERE d.search_vector @@ q{where}'
+    )
+    select = (
+        'SELECT d.kind, d.object_id, d.course_id, d.lesson_id, d.title, '
+        "ts_headline('english', coalesce(nullif(d.body, ''), d.title), q, %s), "
+        f'ts_rank_cd(d.search_vector, q) AS score {base} ORDER BY score DESC, d.id LIMIT %s OFFSET %s'
+    )
+    options = f'StartSel={START}, StopSel={STOP}, MaxWords=24, MinWords=8, MaxFragments=1'
+    return expression, f'SELECT COUNT(*) {base}', select, [expression, *params], [options]
+
+
+def highlight(snippet):
+    return html.escape(snippet or '').replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+class SearchResults:
+    """
+    Lazily evaluated ranked results, sliceable and countable so that Django's
+    Paginator (and so DRF's page number pagination) can page through them.
+    """
+
+    def __init__(self, query, kind=None, course_id=None):
+        if connection.vendor not in SUPPORTED_VENDORS:
+            raise NotSupportedError(f"Full-text search is not available on {connection.vendor}")
+        self.query = query
+        self.kind = kind
+        self.course_id = course_id
+        self._count = None
+
+    def _sql(self):
+        """(match expression or None, count SQL, select SQL, shared params, select-only leading params)."""
+        where, params = _filters(self.kind, self.course_id)
+        build = _sqlite_sql if connection.vendor == 'sqlite' else _postgresql_sql
+        return build(self.query, where, params)
+
+    def count(self):
+        if self._count is None:
+            expression, count_sql, _, params, _ = self._sql()
+            if expression is None:
+                self._count = 0
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(count_sql, params)
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("SearchResults only supports slicing")
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        if stop <= start:
+            return []
+        expression, _, select_sql, params, leading = self._sql()
+        if expression is None:
+            return []
+        with connection.cursor() as cursor:
+            # ts_headline's options come before the query parameter in the select list
+            cursor.execute(select_sql, [*leading, *params, stop - start, start])
+            rows = cursor.fetchall()
+        return [
+            {**dict(zip(RESULT_FIELDS, row)), 'snippet': highlight(row[5]), 'score': float(row[6])}
+            for row in rows
+        ]
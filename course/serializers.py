@@ -1,6 +1,20 @@
+from django.conf import settings
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Course, Lesson, Question, TrueFalseQuestion, MultipleChoiceQuestion, Answer
+from .models import Course, Lesson, Question, TrueFalseQuestion, MultipleChoiceQuestion, Answer, Submission, CourseProgress, GenerationJob, SearchDocument
 from model_utils.managers import InheritanceManager
+from accounts.permissions import can_see_answers
+
+
+def hide_answers(context):
+    """
+    Answers are shown only when the context allows it explicitly, or when it
+    carries a request whose user may see them. Without either they are hidden.
+    """
+    if 'hide_answers' in context:
+        return context['hide_answers']
+    request = context.get('request')
+    return request is None or not can_see_answers(request.user)
 
 class AnswerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -38,6 +52,11 @@ class QuestionSerializer(serializers.ModelSerializer):
         model = Question
         fields = ['id', 'text', 'type', 'options', 'correct_answer']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if hide_answers(self.context):
+            self.fields.pop('correct_answer')
+
     def get_type(self, obj):
         if isinstance(obj, TrueFalseQuestion):
             return 'true_false'
@@ -65,8 +84,12 @@ class LessonSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'type', 'content', 'video_url', 'questions']
 
     def get_questions(self, obj):
-        questions = obj.questions.select_subclasses()
-        return QuestionSerializer(questions, many=True).data
+        # Reuse the subclass-aware prefetch from CourseQuerySet.with_lessons when present
+        if 'questions' in getattr(obj, '_prefetched_objects_cache', {}):
+            questions = obj.questions.all()
+        else:
+            questions = obj.questions.select_subclasses()
+        return QuestionSerializer(questions, many=True, context=self.context).data
 
 class CourseSerializer(serializers.ModelSerializer):
     lessons = LessonSerializer(many=True, read_only=True)
@@ -78,9 +101,17 @@ class CourseSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        course = Course.objects.create(author=user, **validated_data)
+        course = Course.objects.create(author_id=user.id, **validated_data)
         return course
 
+class CourseSummarySerializer(serializers.ModelSerializer):
+    lesson_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Course
+        fields = ['id', 'title', 'description', 'author', 'created_at', 'lesson_count']
+        read_only_fields = fields
+
 class GenerateQuestionsSerializer(serializers.Serializer):
     course_id = serializers.IntegerField()
     lesson_id = serializers.IntegerField()
@@ -88,8 +119,160 @@ class GenerateQuestionsSerializer(serializers.Serializer):
     lesson_topic = serializers.CharField()
     num_questions = serializers.IntegerField(min_value=1, max_value=10, default=1)
 
+class QuestionBankLessonSerializer(serializers.Serializer):
+    lesson_id = serializers.IntegerField()
+    lesson_topic = serializers.CharField(max_length=200, required=False, help_text="Defaults to the lesson title")
+    num_questions = serializers.IntegerField(min_value=1, max_value=settings.GENERATION_MAX_QUESTIONS)
+
+class GenerateQuestionBankSerializer(serializers.Serializer):
+    course_id = serializers.IntegerField()
+    student_interests = serializers.ListField(child=serializers.CharField())
+    lessons = serializers.ListField(child=QuestionBankLessonSerializer(), allow_empty=False, max_length=100)
+
+    def validate_lessons(self, value):
+        lesson_ids = [item['lesson_id'] for item in value]
+        if len(set(lesson_ids)) != len(lesson_ids):
+            raise serializers.ValidationError("Each lesson can only be listed once")
+        return value
+
 class GenerateReadingContentSerializer(serializers.Serializer):
     course_id = serializers.IntegerField()
     lesson_id = serializers.IntegerField()
     student_interests = serializers.ListField(child=serializers.CharField())
     lesson_topic = serializers.CharField()
+
+class GenerateCourseContentSerializer(serializers.Serializer):
+    course_id = serializers.IntegerField()
+    student_interests = serializers.ListField(child=serializers.CharField())
+    num_questions = serializers.IntegerField(min_value=1, max_value=10, default=1)
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    status_url = serializers.HyperlinkedIdentityField(view_name='generation-job-detail')
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'kind', 'course', 'lesson', 'status', 'result', 'error', 'created_at', 'started_at', 'finished_at', 'status_url']
+        read_only_fields = fields
+
+    @staticmethod
+    def result_objects(jobs):
+        """
+        Serializer context holding the questions and lessons that the results of
+        several jobs refer to, loaded in one query each instead of one per job.
+        """
+        question_ids = [pk for job in jobs for pk in (job.result or {}).get('question_ids', [])]
+        lesson_ids = [job.result['lesson_id'] for job in jobs if (job.result or {}).get('lesson_id')]
+        questions = Question.objects.filter(pk__in=question_ids).select_subclasses() if question_ids else []
+        lessons = Lesson.objects.filter(pk__in=lesson_ids).prefetch_related(
+            Prefetch('questions', queryset=Question.objects.select_subclasses().order_by('id'))
+        ) if lesson_ids else []
+        return {
+            'result_questions': {question.pk: question for question in questions},
+            'result_lessons': {lesson.pk: lesson for lesson in lessons},
+        }
+
+    def get_result(self, obj):
+        """
+        The stored result with its question and lesson ids expanded, serialized
+        for the reader, so students never see correct answers through a job.
+        """
+        if not obj.result:
+            return obj.result
+        result = dict(obj.result)
+        objects = self.context if 'result_questions' in self.context else self.result_objects([obj])
+        if 'question_ids' in result:
+            found = objects['result_questions']
+            questions = [found[pk] for pk in sorted(result.pop('question_ids')) if pk in found]
+            result['questions'] = QuestionSerializer(questions, many=True, context=self.context).data
+        if 'lesson_id' in result:
+            lesson = objects['result_lessons'].get(result.pop('lesson_id'))
+            result['lesson'] = LessonSerializer(lesson, context=self.context).data if lesson else None
+        return result
+
+class SubmittedAnswerSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    # true/false, an option, a comma-separated string of options or a list of options
+    answer = serializers.JSONField()
+
+class SubmitAnswersSerializer(serializers.Serializer):
+    answers = serializers.ListField(child=SubmittedAnswerSerializer(), allow_empty=False, max_length=1000)
+
+    def validate_answers(self, value):
+        question_ids = [item['question'] for item in value]
+        if len(set(question_ids)) != len(question_ids):
+            raise serializers.ValidationError("Each question can only be answered once")
+        return value
+
+class GradedAnswerSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    answer = serializers.CharField()
+    is_correct = serializers.BooleanField()
+
+class SubmissionSerializer(serializers.ModelSerializer):
+    results = GradedAnswerSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Submission
+        fields = ['id', 'lesson', 'student', 'score', 'total', 'created_at', 'results']
+        read_only_fields = fields
+
+class CourseAnalyticsSerializer(serializers.Serializer):
+    students = serializers.IntegerField()
+    submissions = serializers.IntegerField()
+    practice_lessons = serializers.IntegerField()
+    lessons_completed = serializers.IntegerField()
+    completion_rate = serializers.FloatField()
+    average_score = serializers.FloatField()
+    updated_at = serializers.DateTimeField(allow_null=True)
+
+class CourseProgressSerializer(serializers.ModelSerializer):
+    email = serializers.EmailField(source='student.email', read_only=True)
+    fullname = serializers.CharField(source='student.fullname', read_only=True)
+
+    class Meta:
+        model = CourseProgress
+        fields = ['student', 'email', 'fullname', 'lessons_completed', 'attempts', 'score', 'total', 'updated_at']
+        read_only_fields = fields
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    kind = serializers.ChoiceField(choices=SearchDocument.KIND_CHOICES, required=False)
+    course = serializers.IntegerField(required=False, min_value=1)
+
+class SearchResultSerializer(serializers.Serializer):
+    kind = serializers.CharField()
+    object_id = serializers.IntegerField()
+    course_id = serializers.IntegerField()
+    lesson_id = serializers.IntegerField(allow_null=True)
+    title = serializers.CharField()
+    snippet = serializers.CharField(help_text="HTML-escaped text with the matched terms wrapped in <mark>")
+    score = serializers.FloatField()
+
+class UsageReportQuerySerializer(serializers.Serializer):
+    since = serializers.DateField(required=False, help_text="First day included; defaults to 30 days before until")
+    until = serializers.DateField(required=False, help_text="Last day included; defaults to today")
+    group_by = serializers.ChoiceField(choices=['user', 'course'], default='user')
+
+    def validate(self, data):
+        if data.get('since') and data.get('until') and data['since'] > data['until']:
+            raise serializers.ValidationError("since must not be after until")
+        return data
+
+class UsageFiguresSerializer(serializers.Serializer):
+    requests = serializers.IntegerField()
+    prompt_tokens = serializers.IntegerField()
+    completion_tokens = serializers.IntegerField()
+    total_tokens = serializers.IntegerField()
+    cost = serializers.FloatField(help_text="USD at the configured per-token prices")
+
+class UsageReportRowSerializer(UsageFiguresSerializer):
+    id = serializers.IntegerField(allow_null=True, help_text="User or course id; null for calls outside a course or deleted ones")
+    name = serializers.CharField(allow_null=True, help_text="User email or course title")
+
+class UsageReportSerializer(serializers.Serializer):
+    since = serializers.DateField()
+    until = serializers.DateField()
+    group_by = serializers.CharField()
+    rows = UsageReportRowSerializer(many=True)
+    totals = UsageFiguresSerializer()
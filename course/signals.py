@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by QuestionManager.bulk_create_subclasses(), which bypasses post_save.
+# Arguments: lesson_ids, questions
+questions_bulk_created = Signal()
@@ -1,3 +1,1583 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import hashlib
+import math
+import re
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from accounts.tokens import add_user_claims, tokens_for_user
+from ongo import metrics
+from . import dedup, llm, planner, search, usage
+from .generation import save_questions, save_reading_content
+from .fast_serializers import serialize_course_trees
+from .generation_cache import generation_cache
+from .models import (
+    Answer, Course, CourseProgress, GenerationJob, Lesson, LessonProgress, LLMUsage, MultipleChoiceQuestion, Question,
+    SearchDocument, Submission, TrueFalseQuestion,
+)
+from .schemas import parse_generated_questions
+from .serializers import CourseSerializer, QuestionSerializer
+
+
+class StubChatCompletion:
+    """Stands in for the OpenAI client; replies with queued message contents in order."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def __call__(self, messages, **params):
+        self.calls.append({'messages': messages, **params})
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return {'choices': [{'message': {'role': 'assistant', 'content': reply}}]}
+
+    def patch(self):
+        return mock.patch('course.llm.chat_completion', self)
+
+    def stream_patch(self):
+        def stream_chat_completion(messages, **params):
+            self.calls.append({'messages': messages, **params})
+            reply = self.replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            yield from reply
+        return mock.patch('course.llm.stream_chat_completion', stream_chat_completion)
+
+    def apatch(self):
+        async def achat_completion(messages, **params):
+            return self(messages, **params)
+        return mock.patch('course.llm.achat_completion', achat_completion)
+
+
+class CourseTestMixin:
+    def setUp(self):
+        caches['default'].clear()
+        caches[settings.COURSE_TREE_CACHE_ALIAS].clear()
+        self.teacher = User.objects.create_user(
+            email='teacher@example.com', fullname='Teacher', password='pass12345', role='teacher'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def make_user(self, role, email=None):
+        return User.objects.create_user(
+            email=email or f'{role}@example.com', fullname=role.title(), password='pass12345', role=role
+        )
+
+    def make_course(self, lessons=2, questions=2, author=None):
+        course = Course.objects.create(title='Course', description='Description', author=author or self.teacher)
+        for i in range(lessons):
+            lesson = Lesson.objects.create(course=course, title=f'Lesson {i}', type='practice')
+            for j in range(questions):
+                TrueFalseQuestion.objects.create(lesson=lesson, text=f'TF {j}', correct_answer=True)
+                MultipleChoiceQuestion.objects.create(
+                    lesson=lesson, text=f'MC {j}', _options=['a', 'b', 'c', 'd'], correct_answer='a'
+                )
+        return course
+
+
+class CourseReadQueryTests(CourseTestMixin, TestCase):
+    def test_list_query_count_is_flat(self):
+        self.make_course()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('course-list'))
+
+        for _ in range(5):
+            self.make_course(lessons=4, questions=3)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('course-list'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_my_courses_query_count_is_flat(self):
+        for _ in range(4):
+            self.make_course(lessons=3)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('courses-my'))
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_detail_query_count_is_flat(self):
+        course = self.make_course(lessons=1, questions=1)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('course-detail', args=[course.pk]))
+        course = self.make_course(lessons=6, questions=4)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('course-detail', args=[course.pk]))
+
+    def test_detail_serializes_question_subclasses(self):
+        course = self.make_course(lessons=3, questions=2)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('courses-by-id', args=[course.pk]))
+        lessons = response.data['lessons']
+        self.assertEqual(len(lessons), 3)
+        types = [question['type'] for question in lessons[0]['questions']]
+        self.assertEqual(types, ['true_false', 'multiple_choice', 'true_false', 'multiple_choice'])
+        self.assertEqual(lessons[0]['questions'][1]['options'], ['a', 'b', 'c', 'd'])
+
+
+class CourseListPaginationTests(CourseTestMixin, TestCase):
+    def test_list_returns_summaries(self):
+        self.make_course(lessons=3)
+        response = self.client.get(reverse('course-list'))
+        course = response.data['results'][0]
+        self.assertEqual(course['lesson_count'], 3)
+        self.assertNotIn('lessons', course)
+
+    def test_cursor_pages_through_catalogue(self):
+        for _ in range(5):
+            self.make_course(lessons=1, questions=0)
+        response = self.client.get(reverse('course-list'), {'page_size': 2})
+        seen = [course['id'] for course in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [course['id'] for course in response.data['results']]
+        self.assertEqual(seen, sorted(Course.objects.values_list('id', flat=True), reverse=True))
+
+
+QUESTIONS_REPLY = str([
+    {'question': 'Q1', 'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 1},
+    {'question': 'Q2', 'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 3},
+])
+
+
+class GenerationTestMixin(CourseTestMixin):
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(title='Physics', description='', author=self.teacher)
+        self.practice = Lesson.objects.create(course=self.course, title='Forces', type='practice')
+        self.reading = Lesson.objects.create(course=self.course, title='Forces', type='reading')
+        caches[settings.GENERATION_CACHE_ALIAS].clear()
+        generation_cache.reset_stats()
+
+    def generate_questions(self, **overrides):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        payload.update(overrides)
+        return self.client.post('/api/generate-questions/generate/', payload, format='json')
+
+
+@override_settings(GENERATION_JOBS_EAGER=True)
+class GenerationJobTests(GenerationTestMixin, TestCase):
+    def test_questions_job_writes_questions(self):
+        with StubChatCompletion(QUESTIONS_REPLY).patch():
+            response = self.generate_questions()
+        self.assertEqual(response.status_code, 202)
+        job = GenerationJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(len(job.result['question_ids']), 2)
+        self.assertEqual([q['correct_answer'] for q in response.data['result']['questions']], ['b', 'd'])
+        self.assertEqual(
+            list(MultipleChoiceQuestion.objects.filter(lesson=self.practice).values_list('correct_answer', flat=True)),
+            ['b', 'd'],
+        )
+
+    def test_reading_job_writes_lesson_content(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        with StubChatCompletion('# Waves\n').patch():
+            response = self.client.post('/api/generate-reading/generate/', payload, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.reading.refresh_from_db()
+        self.assertEqual(self.reading.content, '# Waves')
+
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.data['status'], 'succeeded')
+        self.assertEqual(status_response.data['result']['lesson']['content'], '# Waves')
+
+    def test_failed_job_reports_error(self):
+        with StubChatCompletion(RuntimeError('upstream down')).patch(), self.assertLogs('course.jobs', 'ERROR'):
+            response = self.generate_questions()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error'], 'upstream down')
+
+    def test_jobs_are_visible_to_their_owner_and_admins_only(self):
+        with StubChatCompletion(QUESTIONS_REPLY).patch():
+            job_id = self.generate_questions().data['id']
+        url = reverse('generation-job-detail', args=[job_id])
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('generation-job-list')).status_code, 401)
+        self.client.force_authenticate(self.make_user('teacher', 'other@example.com'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('generation-job-list')).data['results'], [])
+        self.client.force_authenticate(self.make_user('admin'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_job_list_is_paginated_and_expands_results_in_constant_queries(self):
+        def listed():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('generation-job-list'))
+            return response, len(queries)
+
+        with StubChatCompletion(QUESTIONS_REPLY, '# Waves').patch():
+            self.generate_questions()
+            self.client.post('/api/generate-reading/generate/', {
+                'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+                'student_interests': ['music'], 'lesson_topic': 'Waves',
+            }, format='json')
+        response, few = listed()
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('next', response.data)
+        self.assertEqual(len(response.data['results'][1]['result']['questions']), 2)
+
+        second = self.make_course(lessons=1, questions=0)
+        lesson = second.lessons.get()
+        for i in range(3):
+            question = MultipleChoiceQuestion.objects.create(lesson=lesson, text=f'MC {i}', _options=['a'], correct_answer='a')
+            GenerationJob.objects.create(
+                kind='questions', course=second, lesson=lesson, created_by=self.teacher,
+                status='succeeded', result={'question_ids': [question.pk]},
+            )
+        response, many = listed()
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(many, few)
+
+    def test_only_the_course_author_can_queue_generation(self):
+        payload = {'course_id': self.course.pk, 'student_interests': ['football'], 'num_questions': 1}
+        callers = {
+            None: 401,
+            self.make_user('student'): 403,
+            self.make_user('teacher', 'other@example.com'): 403,
+        }
+        for user, status_code in callers.items():
+            self.client.force_authenticate(user)
+            stub = StubChatCompletion()
+            with stub.patch():
+                self.assertEqual(self.generate_questions().status_code, status_code)
+                self.assertEqual(self.client.post('/api/generate-course/generate/', payload, format='json').status_code, status_code)
+            self.assertEqual(stub.calls, [])
+        self.assertFalse(GenerationJob.objects.exists())
+
+    @override_settings(GENERATION_JOBS_EAGER=False)
+    def test_job_is_queued_after_commit(self):
+        with mock.patch('course.jobs.get_executor') as get_executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.generate_questions()
+        self.assertEqual(response.data['status'], 'pending')
+        get_executor.return_value.submit.assert_called_once()
+
+
+@override_settings(GENERATION_JOBS_EAGER=True)
+class GenerationCacheTests(GenerationTestMixin, TestCase):
+    def test_identical_inputs_hit_cache_while_the_bank_is_unchanged(self):
+        stub = StubChatCompletion(QUESTIONS_REPLY)
+        with stub.patch(), mock.patch('course.generation.save_questions', side_effect=RuntimeError('db down')), \
+                self.assertLogs('course.jobs', 'ERROR'):
+            self.generate_questions(student_interests=['football', 'chess'])
+            # The first batch was never saved, so a retry replays it instead of paying for a new one
+            self.generate_questions(student_interests=['Chess ', 'football'], lesson_topic='newton  laws')
+        self.assertEqual(len(stub.calls), 1)
+        self.assertEqual(generation_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_saved_batches_are_not_replayed(self):
+        second = str([
+            {'question': 'Q3', 'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 0},
+            {'question': 'Q4', 'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 2},
+        ])
+        stub = StubChatCompletion(QUESTIONS_REPLY, second)
+        with stub.patch():
+            self.generate_questions()
+            response = self.generate_questions()
+        self.assertEqual(len(stub.calls), 2)
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(MultipleChoiceQuestion.objects.filter(lesson=self.practice).count(), 4)
+        self.assertEqual(generation_cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_job_fails_when_every_question_is_a_duplicate(self):
+        stub = StubChatCompletion(QUESTIONS_REPLY, QUESTIONS_REPLY, QUESTIONS_REPLY)
+        with stub.patch():
+            first = self.generate_questions()
+            with self.assertLogs('course.jobs', 'ERROR'):
+                second = self.generate_questions()
+                self.generate_questions()
+        self.assertEqual(first.data['result']['questions_created'], 2)
+        self.assertEqual(first.data['result']['duplicates_dropped'], 0)
+        self.assertEqual(second.data['status'], 'failed')
+        self.assertEqual(second.data['error'], 'All 2 generated questions duplicate questions already in the lesson')
+        # The failed batch was not cached for replay: the retry asked the model again
+        self.assertEqual(len(stub.calls), 3)
+        self.assertEqual(MultipleChoiceQuestion.objects.filter(lesson=self.practice).count(), 2)
+
+    def test_different_inputs_miss_cache(self):
+        stub = StubChatCompletion(QUESTIONS_REPLY, str([{'question': 'Q3', 'options': ['a', 'b'], 'correct_answer_index': 0}]))
+        with stub.patch():
+            self.generate_questions()
+            self.generate_questions(num_questions=1)
+        self.assertEqual(len(stub.calls), 2)
+        self.assertEqual(generation_cache.stats(), {'hits': 0, 'misses': 2})
+
+
+class AsyncGenerationViewTests(GenerationTestMixin, TestCase):
+    async def test_async_questions_view_creates_questions(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        access = (await sync_to_async(tokens_for_user)(self.teacher))['access']
+        with StubChatCompletion(QUESTIONS_REPLY).apatch():
+            response = await AsyncClient().post(
+                reverse('generate-questions-async'), payload, content_type='application/json',
+                headers={'Authorization': f'Bearer {access}'},
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([q['correct_answer'] for q in response.json()['questions']], ['b', 'd'])
+        self.assertEqual(await MultipleChoiceQuestion.objects.filter(lesson=self.practice).acount(), 2)
+
+    async def test_async_questions_view_fails_an_all_duplicate_batch(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        access = (await sync_to_async(tokens_for_user)(self.teacher))['access']
+        stub = StubChatCompletion(QUESTIONS_REPLY, QUESTIONS_REPLY, QUESTIONS_REPLY)
+        with stub.apatch():
+            responses = [
+                await AsyncClient().post(
+                    reverse('generate-questions-async'), payload, content_type='application/json',
+                    headers={'Authorization': f'Bearer {access}'},
+                )
+                for _ in range(3)
+            ]
+        self.assertEqual([response.status_code for response in responses], [201, 409, 409])
+        self.assertEqual(responses[1].json()['error'], 'All 2 generated questions duplicate questions already in the lesson')
+        # The failed batch was not cached for replay
+        self.assertEqual(len(stub.calls), 3)
+        self.assertEqual(await MultipleChoiceQuestion.objects.filter(lesson=self.practice).acount(), 2)
+
+    async def post_reading(self, payload, user):
+        headers = {}
+        if user is not None:
+            headers['Authorization'] = f"Bearer {(await sync_to_async(tokens_for_user)(user))['access']}"
+        return await AsyncClient().post(
+            reverse('generate-reading-async'), payload, content_type='application/json', headers=headers
+        )
+
+    async def test_async_views_refuse_everyone_but_the_course_author(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        student = await sync_to_async(self.make_user)('student')
+        other = await sync_to_async(self.make_user)('teacher', 'other@example.com')
+        stub = StubChatCompletion()
+        with stub.apatch():
+            self.assertEqual((await self.post_reading(payload, None)).status_code, 401)
+            self.assertEqual((await self.post_reading(payload, student)).status_code, 403)
+            self.assertEqual((await self.post_reading(payload, other)).status_code, 403)
+        self.assertEqual(stub.calls, [])
+
+    async def test_async_reading_view_updates_lesson(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        with StubChatCompletion('# Waves').apatch():
+            response = await self.post_reading(payload, self.teacher)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['lesson']['content'], '# Waves')
+        lesson = await Lesson.objects.aget(pk=self.reading.pk)
+        self.assertEqual(lesson.content, '# Waves')
+
+    async def test_async_views_authenticate_and_authorize_like_their_drf_views(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        url = reverse('generate-questions-async')
+        response = await AsyncClient().post(
+            url, payload, content_type='application/json', headers={'Authorization': 'Bearer not-a-token'}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response.headers)
+
+        from .views import GenerateQuestionsView
+        with mock.patch.object(GenerateQuestionsView, 'permission_classes', [IsAuthenticated]):
+            response = await AsyncClient().post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_async_reading_view_rejects_practice_lesson(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        response = await self.post_reading(payload, self.teacher)
+        self.assertEqual(response.status_code, 400)
+
+
+class ReadingStreamTests(GenerationTestMixin, TestCase):
+    def stream(self):
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        response = self.client.post('/api/generate-reading/stream/', payload, format='json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return [chunk.decode() for chunk in response.streaming_content]
+
+    def test_streams_deltas_then_saves_lesson(self):
+        with StubChatCompletion(['# Wa', 'ves\n', 'Body']).stream_patch():
+            events = self.stream()
+        self.assertEqual(events[0], 'data: {"delta": "# Wa"}\n\n')
+        self.assertEqual(len(events), 4)
+        self.assertTrue(events[-1].startswith('event: done\n'))
+        self.reading.refresh_from_db()
+        self.assertEqual(self.reading.content, '# Waves\nBody')
+
+    def test_cached_content_is_sent_in_one_event(self):
+        with StubChatCompletion(['# Waves']).stream_patch():
+            self.stream()
+        with StubChatCompletion().stream_patch():
+            events = self.stream()
+        self.assertEqual(events[0], 'data: {"delta": "# Waves"}\n\n')
+        self.assertEqual(generation_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_done_event_carries_answers_for_the_author(self):
+        TrueFalseQuestion.objects.create(lesson=self.reading, text='Check', correct_answer=True)
+        with StubChatCompletion(['# Waves']).stream_patch():
+            done = self.stream()[-1]
+        self.assertEqual(json.loads(done.split('data: ', 1)[1])['lesson']['questions'][0]['correct_answer'], True)
+
+    def test_students_cannot_stream(self):
+        self.client.force_authenticate(self.make_user('student'))
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        stub = StubChatCompletion()
+        with stub.stream_patch():
+            response = self.client.post('/api/generate-reading/stream/', payload, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(stub.calls, [])
+
+    async def test_streams_event_by_event_under_asgi(self):
+        released = threading.Event()
+        waited = []
+
+        def stream_chat_completion(messages, **params):
+            yield '# Wa'
+            # Only sent on once the client has received the first delta
+            waited.append(released.wait(5))
+            yield 'ves'
+
+        access = (await sync_to_async(tokens_for_user)(self.teacher))['access']
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.reading.pk,
+            'student_interests': ['music'], 'lesson_topic': 'Waves',
+        }
+        with mock.patch('course.llm.stream_chat_completion', stream_chat_completion):
+            response = await AsyncClient().post(
+                '/api/generate-reading/stream/', payload, content_type='application/json',
+                headers={'Authorization': f'Bearer {access}'},
+            )
+            self.assertTrue(response.is_async)
+            events = aiter(response.streaming_content)
+            self.assertEqual((await anext(events)).decode(), 'data: {"delta": "# Wa"}\n\n')
+            released.set()
+            rest = [chunk.decode() async for chunk in events]
+        self.assertEqual(waited, [True])
+        self.assertEqual(rest[0], 'data: {"delta": "ves"}\n\n')
+        self.assertTrue(rest[-1].startswith('event: done\n'))
+
+    def test_upstream_error_is_reported_as_event(self):
+        with StubChatCompletion(RuntimeError('upstream down')).stream_patch():
+            events = self.stream()
+        self.assertEqual(events, ['event: error\ndata: {"error": "upstream down"}\n\n'])
+        self.reading.refresh_from_db()
+        self.assertIsNone(self.reading.content)
+
+
+class BulkQuestionTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        course = Course.objects.create(title='Physics', description='', author=self.teacher)
+        self.lesson = Lesson.objects.create(course=course, title='Forces', type='practice')
+
+    def payload(self, count):
+        questions = []
+        for i in range(count):
+            if i % 2:
+                questions.append({'type': 'true_false', 'text': f'TF {i}', 'correct_answer': True})
+            else:
+                questions.append({'type': 'multiple_choice', 'text': f'MC {i}', 'options': ['a', 'b'], 'correct_answer': 'b'})
+        return questions
+
+    def add_questions(self, questions):
+        return self.client.post(reverse('lesson-add-questions', args=[self.lesson.pk]), questions, format='json')
+
+    def test_mixed_batch_is_created(self):
+        response = self.add_questions(self.payload(6))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([q['type'] for q in response.data][:2], ['multiple_choice', 'true_false'])
+        self.assertEqual(TrueFalseQuestion.objects.filter(lesson=self.lesson).count(), 3)
+        mc = MultipleChoiceQuestion.objects.filter(lesson=self.lesson).order_by('id').first()
+        self.assertEqual((mc.text, mc.options, mc.correct_answer), ('MC 0', ['a', 'b'], 'b'))
+        self.assertEqual(response.data[0]['id'], mc.pk)
+
+    def test_statement_count_does_not_grow_with_batch(self):
+        def search_batches(count):
+            fields = [f for f in SearchDocument._meta.concrete_fields if not f.primary_key]
+            return math.ceil(count / connection.ops.bulk_batch_size(fields, [None] * count))
+
+        # Lesson, parent rows, one insert per subclass table, then the search documents
+        with self.assertNumQueries(4 + search_batches(10)):
+            self.add_questions(self.payload(10))
+        with self.assertNumQueries(4 + search_batches(300)):
+            self.add_questions(self.payload(300))
+        self.assertEqual(self.lesson.questions.count(), 310)
+
+    def test_created_questions_carry_answers_for_the_caller_only(self):
+        self.assertIn('correct_answer', self.add_questions(self.payload(2)).data[0])
+        self.client.force_authenticate(self.make_user('student'))
+        response = self.add_questions(self.payload(2))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('correct_answer', response.data[0])
+
+    def test_invalid_item_rejects_whole_batch(self):
+        questions = self.payload(3)
+        questions[1] = {'type': 'essay', 'text': 'Explain'}
+        response = self.add_questions(questions)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[1], {'type': ['Invalid question type']})
+        self.assertEqual(response.data[0], {})
+        self.assertFalse(self.lesson.questions.exists())
+
+
+class GeneratedQuestionParsingTests(TestCase):
+    def test_parses_fenced_json(self):
+        text = 'Here you go:\n```json\n[{"question": "Q", "options": ["a", "b", "c", "d"], "correct_answer_index": 2}]\n```'
+        valid, rejected = parse_generated_questions(text)
+        self.assertEqual(valid, [{'question': 'Q', 'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 2}])
+        self.assertEqual(rejected, [])
+
+    def test_parses_single_quoted_literal(self):
+        valid, _ = parse_generated_questions(QUESTIONS_REPLY)
+        self.assertEqual([q['question'] for q in valid], ['Q1', 'Q2'])
+
+    def test_rejects_invalid_items_and_keeps_the_rest(self):
+        text = (
+            '[{"question": "Q1", "options": ["a", "b"], "correct_answer_index": 5},'
+            ' {"question": "Q2", "options": ["a", "b"], "correct_answer_index": 1},'
+            ' {"text": "Q3"}]'
+        )
+        with self.assertLogs('course.schemas', 'WARNING'):
+            valid, rejected = parse_generated_questions(text)
+        self.assertEqual([q['question'] for q in valid], ['Q2'])
+        self.assertEqual(len(rejected), 2)
+
+    def test_salvages_truncated_output(self):
+        text = '[{"question": "Q1 {x}", "options": ["a", "b"], "correct_answer_index": 0}, {"question": "Q2", "opt'
+        valid, _ = parse_generated_questions(text)
+        self.assertEqual([q['question'] for q in valid], ['Q1 {x}'])
+
+    def test_never_evaluates_code(self):
+        valid, rejected = parse_generated_questions('__import__("os").getcwd()')
+        self.assertEqual((valid, rejected), ([], []))
+
+
+@override_settings(GENERATION_JOBS_EAGER=True)
+class QuestionRepromptTests(GenerationTestMixin, TestCase):
+    def test_reprompts_once_for_missing_questions(self):
+        first = '[{"question": "Q1", "options": ["a", "b", "c", "d"], "correct_answer_index": 0}, {"question": ""}]'
+        second = '[{"question": "Q2", "options": ["a", "b", "c", "d"], "correct_answer_index": 1},' \
+                 ' {"question": "Q3", "options": ["a", "b", "c", "d"], "correct_answer_index": 2}]'
+        stub = StubChatCompletion(first, second)
+        with stub.patch(), self.assertLogs('course.schemas', 'WARNING'):
+            response = self.generate_questions(num_questions=3)
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual([q['text'] for q in response.data['result']['questions']], ['Q1', 'Q2', 'Q3'])
+        self.assertEqual(len(stub.calls), 2)
+        self.assertIn('Provide 2 more', stub.calls[1]['messages'][-1]['content'])
+
+    def test_fails_when_nothing_is_salvageable(self):
+        stub = StubChatCompletion('Sorry, I cannot help.', 'Still no.')
+        with stub.patch(), self.assertLogs('course.jobs', 'ERROR'):
+            response = self.generate_questions()
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error'], 'The model response contained no valid questions')
+
+
+class ScriptedOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append({'path': self.path, 'port': self.client_address[1], 'json': json.loads(body)})
+        status, payload, delay = self.server.script.pop(0)
+        time.sleep(delay)
+        data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/event-stream' if isinstance(payload, str) else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except BrokenPipeError:
+            pass  # the client already timed out
+
+    def log_message(self, *args):
+        pass
+
+
+def completion(content):
+    return {'choices': [{'message': {'role': 'assistant', 'content': content}}], 'usage': {'prompt_tokens': 3, 'completion_tokens': 1}}
+
+
+class LLMClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedOpenAIHandler)
+        self.server.script, self.server.requests = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        settings_override = override_settings(
+            OPENAI_API_BASE=f'http://127.0.0.1:{self.server.server_address[1]}/v1',
+            OPENAI_API_KEY='sk-test', OPENAI_TIMEOUT=0.5, OPENAI_MAX_RETRIES=2, OPENAI_BACKOFF_BASE=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        llm.reset_clients()
+        self.addCleanup(llm.reset_clients)
+
+    def script(self, *responses):
+        for status, payload, *delay in responses:
+            self.server.script.append((status, payload, delay[0] if delay else 0))
+
+    def test_reuses_pooled_connection(self):
+        metrics.registry.reset()
+        self.script((200, completion('one')), (200, completion('two')))
+        self.assertEqual(llm.message_content(llm.chat_completion([{'role': 'user', 'content': 'hi'}])), 'one')
+        self.assertEqual(llm.message_content(llm.chat_completion([{'role': 'user', 'content': 'hi'}])), 'two')
+        self.assertEqual(len({request['port'] for request in self.server.requests}), 1)
+        self.assertEqual(self.server.requests[0]['path'], '/v1/chat/completions')
+        self.assertEqual(metrics.registry.snapshot()[('ongo_llm_call_seconds', ('path', '/chat/completions'))][2], 2)
+
+    def test_retries_rate_limit_and_server_errors(self):
+        self.script((429, {'error': {'message': 'slow down'}}), (502, {}), (200, completion('ok')))
+        with self.assertLogs('course.llm', 'WARNING'):
+            response = llm.chat_completion([{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(llm.message_content(response), 'ok')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.script(*[(503, {'error': {'message': 'overloaded'}})] * 3)
+        with self.assertLogs('course.llm', 'WARNING'), self.assertRaises(llm.LLMError) as raised:
+            llm.chat_completion([{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(str(raised.exception), 'OpenAI API error 503: overloaded')
+
+    def test_client_errors_are_not_retried(self):
+        self.script((400, {'error': {'message': 'bad request'}}))
+        with self.assertRaises(llm.LLMError):
+            llm.chat_completion([{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout_is_retried(self):
+        self.script((200, completion('late'), 1), (200, completion('ok')))
+        with self.assertLogs('course.llm', 'WARNING'):
+            response = llm.chat_completion([{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(llm.message_content(response), 'ok')
+
+    def test_streams_deltas(self):
+        chunks = ''.join(
+            f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n" for word in ['# Wa', 'ves']
+        )
+        self.script((200, chunks + 'data: [DONE]\n\n'))
+        self.assertEqual(list(llm.stream_chat_completion([{'role': 'user', 'content': 'hi'}])), ['# Wa', 'ves'])
+        self.assertTrue(self.server.requests[0]['json']['stream'])
+
+    async def test_async_client_retries(self):
+        self.script((500, {}), (200, completion('ok')))
+        with self.assertLogs('course.llm', 'WARNING'):
+            response = await llm.achat_completion([{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(llm.message_content(response), 'ok')
+
+
+class ConcurrencyProbe:
+    """Counts how many calls are inside it at once; each call waits briefly so that concurrent ones overlap."""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.active -= 1
+
+
+@override_settings(GENERATION_JOBS_EAGER=True)
+class CourseGenerationTests(GenerationTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.probe = ConcurrencyProbe()
+
+    def fake_completion(self, messages, **params):
+        prompt = messages[-1]['content']
+        with self.probe:
+            if 'Broken' in prompt:
+                raise llm.LLMError('OpenAI API error 500: boom', 500)
+            if 'one-choice questions' in prompt:
+                return completion(QUESTIONS_REPLY)
+            return completion('# Content')
+
+    def test_generates_all_lessons_concurrently(self):
+        for i in range(4):
+            Lesson.objects.create(course=self.course, title=f'Reading {i}', type='reading')
+        Lesson.objects.create(course=self.course, title='Video', type='video')
+
+        with mock.patch('course.llm.chat_completion', side_effect=self.fake_completion) as chat:
+            response = self.client.post('/api/generate-course/generate/', {
+                'course_id': self.course.pk, 'student_interests': ['music'], 'num_questions': 2,
+            }, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['kind'], 'course')
+        self.assertEqual(response.data['course'], self.course.pk)
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(chat.call_count, 6)
+        self.assertGreater(self.probe.max_active, 1)
+        self.assertLessEqual(self.probe.max_active, settings.GENERATION_FANOUT_WORKERS)
+        lessons = response.data['result']['lessons']
+        self.assertEqual([lesson['lesson_id'] for lesson in lessons], sorted(lesson['lesson_id'] for lesson in lessons))
+        self.assertTrue(all(lesson['status'] == 'succeeded' for lesson in lessons))
+        self.assertEqual(lessons[0], {
+            'lesson_id': self.practice.pk, 'type': 'practice', 'questions_created': 2, 'duplicates_dropped': 0,
+            'status': 'succeeded',
+        })
+        self.assertEqual(Lesson.objects.filter(course=self.course, content='# Content').count(), 5)
+
+    def test_failed_lesson_does_not_block_others(self):
+        broken = Lesson.objects.create(course=self.course, title='Broken', type='reading')
+        with mock.patch('course.llm.chat_completion', side_effect=self.fake_completion):
+            response = self.client.post('/api/generate-course/generate/', {
+                'course_id': self.course.pk, 'student_interests': ['music'],
+            }, format='json')
+        lessons = response.data['result']['lessons']
+        statuses = {lesson['lesson_id']: lesson['status'] for lesson in lessons}
+        self.assertEqual(statuses, {self.practice.pk: 'succeeded', self.reading.pk: 'succeeded', broken.pk: 'failed'})
+        self.assertEqual(lessons[2]['error'], 'OpenAI API error 500: boom')
+
+    @override_settings(GENERATION_JOBS_EAGER=False)
+    def test_course_generation_is_queued_without_calling_the_model(self):
+        with mock.patch('course.jobs.get_executor') as get_executor, \
+                mock.patch('course.llm.chat_completion') as chat, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/generate-course/generate/', {
+                'course_id': self.course.pk, 'student_interests': ['music'],
+            }, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        chat.assert_not_called()
+        get_executor.return_value.submit.assert_called_once()
+
+
+class ExplainQueriesCommandTests(CourseTestMixin, TestCase):
+    def test_hot_lookups_use_indexes(self):
+        self.make_course(lessons=3)
+        out = io.StringIO()
+        call_command('explain_queries', '--verbose-plans', stdout=out)
+        report = out.getvalue()
+        for label in ['courses by author', 'lesson by id and course', 'course lessons by type', 'course lessons', 'questions by lesson']:
+            self.assertRegex(report, rf'ok +\S.*\[{label}\]')
+
+
+class CourseTreeCacheTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(lessons=2, questions=1)
+        self.url = reverse('courses-by-id', args=[self.course.pk])
+
+    def test_hot_read_skips_database(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('course-detail', args=[self.course.pk]))
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_default_cache_churn_does_not_evict_trees(self):
+        self.client.get(self.url)
+        for i in range(400):
+            caches['default'].set(f'churn:{i}', i)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        caches[settings.COURSE_TREE_CACHE_ALIAS].delete(f'course-tree:{self.course.pk}:teacher')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_lesson_and_question_writes_invalidate(self):
+        etag = self.client.get(self.url)['ETag']
+        lesson = self.course.lessons.first()
+        lesson.title = 'Renamed'
+        lesson.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['lessons'][0]['title'], 'Renamed')
+
+        etag = response['ETag']
+        TrueFalseQuestion.objects.filter(lesson=lesson).first().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.data['lessons'][0]['questions']), 1)
+
+    def test_bulk_question_insert_invalidates(self):
+        self.client.get(self.url)
+        lesson = self.course.lessons.first()
+        self.client.post(reverse('lesson-add-questions', args=[lesson.pk]), [
+            {'type': 'true_false', 'text': 'New', 'correct_answer': False},
+        ], format='json')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['lessons'][0]['questions'][-1]['text'], 'New')
+
+    def test_missing_course_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('courses-by-id', args=[999])).status_code, 404)
+
+
+class FastCourseSerializerTests(CourseTestMixin, TestCase):
+    def test_matches_drf_serializers_byte_for_byte(self):
+        course = self.make_course(lessons=2, questions=2)
+        Lesson.objects.create(course=course, title='Read', type='reading', content='# Title\n\u00e9t\u00e9 "quoted"')
+        Lesson.objects.create(course=course, title='Watch', type='video', video_url='https://example.com/v')
+        Question.objects.create(lesson=course.lessons.first(), text='Plain question')
+        MultipleChoiceQuestion.objects.create(
+            lesson=course.lessons.first(), text='Multi', _options=['x', 'y', 'z'], correct_answer='x,z'
+        )
+        other = self.make_course(lessons=1, questions=1)
+
+        renderer = JSONRenderer()
+        trees = serialize_course_trees([course.pk, other.pk])
+        for instance in Course.objects.with_lessons().filter(pk__in=[course.pk, other.pk]):
+            self.assertEqual(renderer.render(trees[instance.pk]), renderer.render(CourseSerializer(instance, context={'hide_answers': False}).data))
+
+    def test_uses_three_queries(self):
+        courses = [self.make_course(lessons=3, questions=2) for _ in range(3)]
+        with self.assertNumQueries(3):
+            trees = serialize_course_trees([course.pk for course in courses])
+        self.assertEqual(len(trees), 3)
+
+
+class RoleAwarePayloadTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(lessons=1, questions=1)
+        self.lesson = self.course.lessons.get()
+        self.student = APIClient()
+        self.student.force_authenticate(self.make_user('student'))
+
+    def questions(self, response, lesson=True):
+        return response.data['questions'] if lesson else response.data['lessons'][0]['questions']
+
+    def test_serializers_hide_answers_unless_the_context_allows_them(self):
+        questions = self.lesson.questions.select_subclasses()
+        self.assertNotIn('correct_answer', QuestionSerializer(questions, many=True).data[0])
+        self.assertIn('correct_answer', QuestionSerializer(questions, many=True, context={'hide_answers': False}).data[0])
+
+    def test_course_tree_hides_answers_from_students(self):
+        url = reverse('courses-by-id', args=[self.course.pk])
+        student_response = self.student.get(url)
+        teacher_response = self.client.get(url)
+        self.assertTrue(all('correct_answer' not in q for q in self.questions(student_response, lesson=False)))
+        self.assertEqual(self.questions(teacher_response, lesson=False)[1]['correct_answer'], 'a')
+        self.assertNotEqual(student_response['ETag'], teacher_response['ETag'])
+
+    def test_lesson_payload_is_cached_per_role(self):
+        url = reverse('lesson-detail', args=[self.lesson.pk])
+        anonymous = APIClient().get(url)
+        self.assertEqual(anonymous.status_code, 200)
+        self.assertNotIn('correct_answer', self.questions(anonymous)[0])
+        # Every role's variant was built on the first miss
+        with self.assertNumQueries(0):
+            student = self.student.get(url)
+            teacher = self.client.get(url)
+        self.assertEqual(student.data, anonymous.data)
+        self.assertIs(self.questions(teacher)[0]['correct_answer'], True)
+
+    def test_lesson_payload_invalidated_by_question_write(self):
+        url = reverse('lesson-detail', args=[self.lesson.pk])
+        self.student.get(url)
+        TrueFalseQuestion.objects.create(lesson=self.lesson, text='Fresh', correct_answer=False)
+        self.assertEqual(self.questions(self.student.get(url))[-1], {
+            'id': TrueFalseQuestion.objects.get(text='Fresh').pk, 'text': 'Fresh', 'type': 'true_false', 'options': None,
+        })
+
+    def test_lesson_list_hides_answers_from_students(self):
+        response = self.student.get(reverse('lesson-list'))
+        self.assertTrue(all('correct_answer' not in q for lesson in response.data for q in lesson['questions']))
+        response = self.client.get(reverse('lesson-list'))
+        self.assertIn('correct_answer', response.data[0]['questions'][0])
+
+
+class SubmissionTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.lesson = self.make_course(lessons=1, questions=0).lessons.get()
+        self.true_false = TrueFalseQuestion.objects.create(lesson=self.lesson, text='TF', correct_answer=True)
+        self.multi = MultipleChoiceQuestion.objects.create(
+            lesson=self.lesson, text='Multi', _options=['Red', 'Green', 'Blue'], correct_answer='Red, Blue'
+        )
+        self.comma = MultipleChoiceQuestion.objects.create(
+            lesson=self.lesson, text='Comma', _options=['Yes, always', 'No'], correct_answer='Yes, always'
+        )
+        self.student = self.make_user('student')
+        self.client.force_authenticate(self.student)
+        self.url = reverse('lesson-submit', args=[self.lesson.pk])
+
+    def submit(self, *answers):
+        return self.client.post(self.url, {'answers': [{'question': q.pk, 'answer': a} for q, a in answers]}, format='json')
+
+    def test_grades_and_stores_answers(self):
+        response = self.submit((self.true_false, 'true'), (self.multi, ['blue', 'red']), (self.comma, 'Yes, always'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['score'], response.data['total']), (3, 3))
+        submission = Submission.objects.get()
+        self.assertEqual(submission.student, self.student)
+        self.assertEqual(Answer.objects.filter(submission=submission, is_correct=True).count(), 3)
+
+    def test_partial_multi_answer_is_wrong_and_unanswered_counts(self):
+        response = self.submit((self.true_false, False), (self.multi, 'Red'))
+        self.assertEqual((response.data['score'], response.data['total']), (0, 3))
+        self.assertEqual([r['is_correct'] for r in response.data['results']], [False, False])
+
+    def test_rejects_questions_from_other_lessons(self):
+        other = self.make_course(lessons=1, questions=1).lessons.get().questions.first()
+        response = self.submit((self.true_false, True), (other, True))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['questions'], [other.pk])
+        self.assertFalse(Submission.objects.exists())
+
+    def test_answer_key_is_cached_until_questions_change(self):
+        self.submit((self.true_false, True))
+        # Lesson lookup, submission and bulk answer inserts, and one write per progress
+        # aggregate after locking the lesson's progress row, inside a savepoint
+        with self.assertNumQueries(9):
+            self.submit((self.true_false, True), (self.multi, 'Red,Blue'), (self.comma, 'No'))
+
+        self.true_false.correct_answer = False
+        self.true_false.save()
+        self.assertEqual(self.submit((self.true_false, False)).data['score'], 1)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.submit((self.true_false, True)).status_code, 401)
+
+
+class ProgressAggregateTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(lessons=2, questions=1)
+        self.first, self.second = self.course.lessons.order_by('id')
+        self.students = [self.make_user('student', f'student{i}@example.com') for i in range(2)]
+
+    def submit(self, student, lesson, correct):
+        client = APIClient()
+        client.force_authenticate(student)
+        answers = [
+            {'question': q.pk, 'answer': (q.correct_answer if correct else 'zzz') if hasattr(q, '_options') else correct}
+            for q in lesson.questions.select_subclasses()
+        ]
+        return client.post(reverse('lesson-submit', args=[lesson.pk]), {'answers': answers}, format='json')
+
+    def test_aggregates_track_best_scores_incrementally(self):
+        self.submit(self.students[0], self.first, correct=False)
+        self.submit(self.students[0], self.first, correct=True)
+        self.submit(self.students[0], self.first, correct=False)
+        self.submit(self.students[1], self.second, correct=True)
+
+        progress = LessonProgress.objects.get(student=self.students[0], lesson=self.first)
+        self.assertEqual((progress.attempts, progress.best_score, progress.last_score, progress.total), (3, 2, 0, 2))
+        course_progress = CourseProgress.objects.get(student=self.students[0], course=self.course)
+        self.assertEqual((course_progress.lessons_completed, course_progress.score, course_progress.total), (1, 2, 2))
+
+        response = self.client.get(reverse('course-analytics', args=[self.course.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['students'], 2)
+        self.assertEqual(response.data['submissions'], 4)
+        self.assertEqual(response.data['completion_rate'], 0.5)
+        self.assertEqual(response.data['average_score'], 1.0)
+
+    def test_dashboard_cost_does_not_grow_with_submissions(self):
+        self.submit(self.students[0], self.first, correct=True)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('course-analytics', args=[self.course.pk]))
+        for student in self.students:
+            for lesson in (self.first, self.second):
+                self.submit(student, lesson, correct=False)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('course-analytics', args=[self.course.pk]))
+
+    def test_student_progress_is_paginated(self):
+        for student in self.students:
+            self.submit(student, self.first, correct=True)
+        response = self.client.get(reverse('course-student-progress', args=[self.course.pk]), {'page_size': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['email'], 'student1@example.com')
+        self.assertIsNotNone(response.data['next'])
+
+    def test_analytics_only_visible_to_author(self):
+        self.client.force_authenticate(self.make_user('teacher', 'other@example.com'))
+        self.assertEqual(self.client.get(reverse('course-analytics', args=[self.course.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('course-student-progress', args=[self.course.pk])).status_code, 404)
+
+
+class InstrumentationTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.course = self.make_course(lessons=1, questions=1)
+
+    def test_server_timing_reports_queries(self):
+        response = self.client.get(reverse('course-detail', args=[self.course.pk]))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn('total;dur=', timing)
+        cached = self.client.get(reverse('course-detail', args=[self.course.pk]))
+        self.assertIn('desc="0 queries"', cached['Server-Timing'])
+
+    def test_metrics_endpoint_is_admin_only(self):
+        for _ in range(3):
+            self.client.get(reverse('course-detail', args=[self.course.pk]))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.client.force_authenticate(self.make_user('admin'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE ongo_request_duration_seconds summary', body)
+        self.assertIn('ongo_request_duration_seconds{endpoint="GET course-detail",quantile="0.99"}', body)
+        self.assertIn('ongo_request_db_queries_count{endpoint="GET course-detail"} 3', body)
+        self.assertIn('ongo_request_db_queries_sum{endpoint="GET course-detail"} 3', body)
+
+    def test_serialize_timing_covers_serializer_evaluation(self):
+        def slow(serializer, instance):
+            time.sleep(0.05)
+            return {'id': instance.pk}
+
+        for url in (reverse('course-list'), reverse('courses-my')):
+            with mock.patch('course.serializers.CourseSummarySerializer.to_representation', slow):
+                timing = self.client.get(url)['Server-Timing']
+            serialize = float(re.search(r'serialize;dur=([\d.]+)', timing).group(1))
+            self.assertGreaterEqual(serialize, 50)
+
+    def test_timings_add_up_across_threads(self):
+        timings, token = metrics.start_request()
+        try:
+            def work():
+                for _ in range(1000):
+                    with metrics.timed('llm'):
+                        pass
+                    timings.add('serialize', 1)
+
+            threads = [threading.Thread(target=usage.propagate(work)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            metrics.end_request(token)
+        self.assertEqual(timings.serialize, 8000)
+        self.assertGreater(timings.llm, 0)
+
+    @override_settings(METRICS_WINDOW=4)
+    def test_percentiles_cover_recent_requests(self):
+        for value in (100, 1, 2, 3, 4):
+            metrics.registry.observe('ongo_request_duration_seconds', ('endpoint', 'GET test'), value)
+        quantiles, total, count = metrics.registry.snapshot()[('ongo_request_duration_seconds', ('endpoint', 'GET test'))]
+        self.assertEqual((quantiles[0.5], quantiles[0.99], total, count), (3, 4, 110, 5))
+
+
+class SearchTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(
+            title='Photosynthesis basics', description='How plants turn light into sugar', author=self.teacher
+        )
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Chlorophyll', type='reading', content='Leaves absorb light with chlorophyll.'
+        )
+        self.other = Course.objects.create(title='Algebra', description='Solving equations', author=self.teacher)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_title_matches_rank_first_with_highlighted_snippet(self):
+        other = Lesson.objects.create(course=self.other, title='Pigments', type='reading', content='Chlorophyll and carotene.')
+        results = self.search(q='chlorophyll')['results']
+        self.assertEqual([r['object_id'] for r in results], [self.lesson.pk, other.pk])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[0]['snippet'], '<mark>Chlorophyll</mark>')
+        self.assertIn('<mark>Chlorophyll</mark> and carotene', results[1]['snippet'])
+
+    def test_edits_are_indexed_incrementally(self):
+        self.lesson.title = 'Stomata'
+        self.lesson.save()
+        save_reading_content(self.lesson, 'Gas exchange through pores.')
+        self.assertEqual(self.search(q='chlorophyll')['count'], 0)
+        self.assertEqual(self.search(q='pores')['results'][0]['object_id'], self.lesson.pk)
+        self.assertEqual(SearchDocument.objects.filter(kind='lesson', object_id=self.lesson.pk).count(), 1)
+
+    def test_bulk_created_questions_are_searchable(self):
+        practice = Lesson.objects.create(course=self.course, title='Quiz', type='practice')
+        Question.objects.bulk_create_subclasses([
+            TrueFalseQuestion(lesson=practice, text='Glucose is a product', correct_answer=True),
+            MultipleChoiceQuestion(lesson=practice, text='Which gas is released?', _options=['O2', 'N2'], correct_answer='O2'),
+        ])
+        results = self.search(q='glucose', kind='question')['results']
+        self.assertEqual((len(results), results[0]['lesson_id'], results[0]['course_id']), (1, practice.pk, self.course.pk))
+
+    def test_deletes_cascade_to_the_index(self):
+        TrueFalseQuestion.objects.create(lesson=self.lesson, text='Chlorophyll is green', correct_answer=True)
+        self.assertEqual(self.search(q='chlorophyll')['count'], 2)
+        self.course.delete()
+        self.assertEqual(self.search(q='chlorophyll')['count'], 0)
+        self.assertFalse(SearchDocument.objects.filter(course_id=self.course.pk).exists())
+
+    def test_filters_prefixes_and_pagination(self):
+        for i in range(5):
+            Lesson.objects.create(course=self.other, title=f'Equation set {i}', type='practice')
+        self.assertEqual(self.search(q='equa')['count'], 6)
+        self.assertEqual(self.search(q='equa', kind='course')['count'], 1)
+        self.assertEqual(self.search(q='equa', course=self.course.pk)['count'], 0)
+        page = self.search(q='equa', page_size=4, page=2)
+        self.assertEqual((page['count'], len(page['results'])), (6, 2))
+        self.assertEqual(self.search(q='"*')['count'], 0)
+        self.assertEqual(self.client.get(reverse('search')).status_code, 400)
+
+    def test_postgresql_query_matches_every_word_and_a_prefix_of_the_last(self):
+        self.assertEqual(search.tsquery_expression("plants' sug"), 'plants & sug:*')
+        self.assertEqual(search.tsquery_expression('"*'), None)
+
+    def test_students_search_every_course_without_answers(self):
+        TrueFalseQuestion.objects.create(lesson=self.lesson, text='Is chlorophyll green?', correct_answer=True)
+        self.client.force_authenticate(self.make_user('student'))
+        results = self.search(q='chlorophyll')['results']
+        self.assertEqual({result['kind'] for result in results}, {'lesson', 'question'})
+        self.assertTrue(all(set(result) == {*search.RESULT_FIELDS} for result in results))
+
+    def test_snippets_escape_user_text(self):
+        Lesson.objects.create(course=self.other, title='Markup', type='reading', content='<script>alert(1)</script> sugar')
+        snippet = self.search(q='alert')['results'][0]['snippet']
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('&lt;script&gt;<mark>alert</mark>', snippet)
+
+    def test_rebuild_command_restores_the_index(self):
+        SearchDocument.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 documents', out.getvalue())
+        self.assertEqual(self.search(q='sugar')['count'], 1)
+
+
+class QuestionDedupTests(CourseTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        course = Course.objects.create(title='Physics', description='', author=self.teacher)
+        self.lesson = Lesson.objects.create(course=course, title='Forces', type='practice')
+
+    def generated(self, *texts):
+        return [{'question': text, 'options': ['a', 'b', 'c'], 'correct_answer_index': 0} for text in texts]
+
+    def test_fingerprints_ignore_case_accents_and_punctuation(self):
+        a = dedup.fingerprint("What is Newton's first law of motion?")
+        self.assertEqual(a, dedup.fingerprint('what is newtons first law of motion'))
+        self.assertEqual(dedup.fingerprint('Qu\u00e9 es la fuerza?'), dedup.fingerprint('que es la FUERZA'))
+        self.assertGreaterEqual(dedup.similarity(a, dedup.fingerprint("What is Newton's first law of motion, exactly?")), 0.8)
+        self.assertLess(dedup.similarity(a, dedup.fingerprint('How does friction depend on the normal force?')), 0.5)
+
+    def test_generated_near_duplicates_are_dropped(self):
+        save_questions(self.lesson, self.generated("What is Newton's first law?", 'Define inertia.'))
+        created = save_questions(self.lesson, self.generated(
+            'What is Newtons first law', 'What does the second law state?', 'What does the second law state!',
+        ))
+        self.assertEqual([q.text for q in created], ['What does the second law state?'])
+        self.assertEqual(self.lesson.questions.count(), 3)
+        # Cached signatures are reused; only questions added or edited since are fingerprinted
+        question = self.lesson.questions.get(text='Define inertia.')
+        question.text = 'Define momentum.'
+        question.save()
+        with mock.patch.object(dedup, 'fingerprint', wraps=dedup.fingerprint) as fingerprint:
+            self.assertEqual(len(save_questions(self.lesson, self.generated('Define inertia'))), 1)
+        self.assertEqual([c.args[0] for c in fingerprint.call_args_list], [
+            'Define momentum.', 'What does the second law state?', 'Define inertia',
+        ])
+
+    def test_types_are_never_merged(self):
+        TrueFalseQuestion.objects.create(lesson=self.lesson, text='Force equals mass times acceleration', correct_answer=True)
+        created = save_questions(self.lesson, self.generated('Force equals mass times acceleration'))
+        self.assertEqual(len(created), 1)
+
+    def test_command_merges_existing_banks(self):
+        kept = MultipleChoiceQuestion.objects.create(
+            lesson=self.lesson, text='What is inertia?', _options=['a', 'b'], correct_answer='a'
+        )
+        copies = [
+            MultipleChoiceQuestion.objects.create(lesson=self.lesson, text=text, _options=['a', 'b'], correct_answer='a')
+            for text in ('What is inertia', 'what is INERTIA?')
+        ]
+        other = MultipleChoiceQuestion.objects.create(
+            lesson=self.lesson, text='What is momentum?', _options=['a', 'b'], correct_answer='a'
+        )
+        student = self.make_user('student')
+        submissions = [Submission.objects.create(lesson=self.lesson, student=student, score=1, total=4) for _ in range(2)]
+        # Graded against its own key, which the kept question does not share
+        copies[1].correct_answer = 'b'
+        copies[1].save()
+        Answer.objects.create(question=copies[0], text='a', is_correct=True)
+        moved = Answer.objects.create(question=copies[1], submission=submissions[0], text='b', is_correct=True)
+        Answer.objects.create(question=kept, submission=submissions[1], text='a', is_correct=True)
+        Answer.objects.create(question=copies[0], submission=submissions[1], text='b', is_correct=False)
+
+        out = io.StringIO()
+        call_command('dedupe_questions', '--dry-run', stdout=out)
+        self.assertIn('Would remove 2 duplicate questions', out.getvalue())
+        self.assertEqual(self.lesson.questions.count(), 4)
+
+        call_command('dedupe_questions', stdout=io.StringIO())
+        self.assertEqual(sorted(self.lesson.questions.values_list('id', flat=True)), [kept.pk, other.pk])
+        self.assertEqual(set(Answer.objects.values_list('question_id', flat=True)), {kept.pk})
+        moved.refresh_from_db()
+        self.assertFalse(moved.is_correct)
+        # One answer per question per submission: the second submission keeps its answer to the kept question
+        self.assertEqual(list(submissions[1].answers.values_list('text', flat=True)), ['a'])
+        self.assertEqual(Answer.objects.filter(submission=None).count(), 1)
+
+
+@override_settings(GENERATION_JOBS_EAGER=True)
+class QuestionPlannerTests(GenerationTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.probe = ConcurrencyProbe()
+
+    def packed_reply(self, messages, skip=0):
+        """Answer a packed prompt with distinct questions tagged by lesson key, leaving out the last `skip`."""
+        questions = [
+            {
+                'lesson': key, 'question': f"{label} {hashlib.sha1(f'{label}:{i}'.encode()).hexdigest()}",
+                'options': ['a', 'b', 'c', 'd'], 'correct_answer_index': 0,
+            }
+            for key, label, count in re.findall(r'^(L\d+): (.*) - (\d+) questions$', messages[-1]['content'], re.M)
+            for i in range(int(count))
+        ]
+        return completion(json.dumps(questions[:len(questions) - skip]))
+
+    def fake_completion(self, messages, **params):
+        with self.probe:
+            return self.packed_reply(messages)
+
+    def practice_lessons(self, count):
+        return [self.practice] + [
+            Lesson.objects.create(course=self.course, title=f'Topic {i}', type='practice') for i in range(count - 1)
+        ]
+
+    @override_settings(GENERATION_PROMPT_TOKEN_BUDGET=4000)
+    def test_plan_packs_small_lessons_and_splits_large_ones(self):
+        small = planner.plan('Physics', ['music'], [(lesson, lesson.title, 5) for lesson in self.practice_lessons(6)])
+        self.assertEqual([[s.count for s in chunk] for chunk in small], [[5] * 6])
+
+        chunks = planner.plan('Physics', ['music'], [(self.practice, 'Forces', 200)])
+        self.assertEqual(sum(s.count for chunk in chunks for s in chunk), 200)
+        self.assertEqual([s.part for chunk in chunks for s in chunk], list(range(len(chunks))))
+        self.assertLessEqual(len(chunks), 6)
+        for chunk in chunks:
+            prompt = planner._prompt_tokens(planner.packed_messages('Physics', ['music'], chunk))
+            self.assertLessEqual(prompt + sum(s.count for s in chunk) * planner.TOKENS_PER_QUESTION, 4000)
+
+        with self.assertRaises(ValueError):
+            planner.plan('Physics', ['music'], [(self.practice, 'Forces', 1)], budget=100)
+
+    def test_bank_endpoint_runs_chunks_concurrently(self):
+        lessons = self.practice_lessons(3)
+        with mock.patch('course.llm.chat_completion', side_effect=self.fake_completion) as chat:
+            response = self.client.post('/api/generate-questions/bank/', {
+                'course_id': self.course.pk, 'student_interests': ['music'],
+                'lessons': [
+                    {'lesson_id': lessons[0].pk, 'num_questions': 200},
+                    {'lesson_id': lessons[1].pk, 'lesson_topic': 'Friction', 'num_questions': 3},
+                    {'lesson_id': lessons[2].pk, 'num_questions': 4},
+                ],
+            }, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['kind'], response.data['status']), ('bank', 'succeeded'))
+        self.assertEqual(
+            [(r['lesson_id'], r['questions_created'], r['status']) for r in response.data['result']['lessons']],
+            [(lessons[0].pk, 200, 'succeeded'), (lessons[1].pk, 3, 'succeeded'), (lessons[2].pk, 4, 'succeeded')],
+        )
+        # 207 questions in a handful of calls, instead of 21 ten-question prompts one after another
+        self.assertLessEqual(chat.call_count, 6)
+        self.assertGreater(self.probe.max_active, 1)
+        self.assertTrue(lessons[1].questions.filter(text__startswith='Friction').exists())
+
+    def test_chunk_cache_is_keyed_by_lesson_and_bank(self):
+        twin = Lesson.objects.create(course=self.course, title='Forces', type='practice')
+        with mock.patch('course.llm.chat_completion', side_effect=self.fake_completion) as chat:
+            for lesson in (self.practice, twin, self.practice):
+                planner.generate_bank('Physics', ['music'], [(lesson, 'Forces', 2)])
+        # Same topic and count, but another lesson, then the first lesson's grown bank: no replays
+        self.assertEqual(chat.call_count, 3)
+        self.assertEqual(twin.questions.count(), 2)
+        self.assertEqual(generation_cache.stats(), {'hits': 0, 'misses': 3})
+
+    def test_all_duplicate_section_fails_its_lesson_and_is_not_replayed(self):
+        with mock.patch('course.llm.chat_completion', side_effect=self.fake_completion) as chat:
+            results = [planner.generate_bank('Physics', ['music'], [(self.practice, 'Forces', 2)]) for _ in range(3)]
+        self.assertEqual([r[0]['status'] for r in results], ['succeeded', 'failed', 'failed'])
+        self.assertEqual(results[1][0]['error'], 'All 2 generated questions duplicate questions already in the lesson')
+        self.assertEqual(results[1][0]['duplicates_dropped'], 2)
+        # The bank did not change after the second run, but its chunk was dropped from the cache
+        self.assertEqual(chat.call_count, 3)
+        self.assertEqual(generation_cache.stats(), {'hits': 0, 'misses': 3})
+        self.assertEqual(self.practice.questions.count(), 2)
+
+    def test_missing_questions_are_requested_once_more(self):
+        lessons = self.practice_lessons(2)
+        followup = completion(json.dumps([
+            {'lesson': 'L2', 'question': 'What slows a sliding box?', 'options': ['a', 'b'], 'correct_answer_index': 1},
+        ]))
+
+        def fake(messages, **params):
+            # The follow-up continues the conversation after the first reply
+            return followup if len(messages) > 2 else self.packed_reply(messages, skip=1)
+
+        with mock.patch('course.llm.chat_completion', side_effect=fake) as chat:
+            results = planner.generate_bank('Physics', ['music'], [(lessons[0], 'Forces', 2), (lessons[1], 'Friction', 2)])
+        self.assertEqual(chat.call_count, 2)
+        self.assertIn('Provide 1 for L2', chat.call_args.kwargs['messages'][-1]['content'])
+        self.assertEqual([r['questions_created'] for r in results], [2, 2])
+
+    def test_bank_rejects_lessons_outside_the_course_or_not_practice(self):
+        url = '/api/generate-questions/bank/'
+        other = Course.objects.create(title='Other', description='', author=self.teacher)
+        foreign = Lesson.objects.create(course=other, title='Elsewhere', type='practice')
+        payload = {'course_id': self.course.pk, 'student_interests': [], 'lessons': [{'lesson_id': foreign.pk, 'num_questions': 1}]}
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 404)
+        payload['lessons'] = [{'lesson_id': self.reading.pk, 'num_questions': 1}]
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 400)
+        payload['lessons'] = [{'lesson_id': self.practice.pk, 'num_questions': 201}]
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 400)
+
+
+def sent(data):
+    """What llm._send returns for a decoded JSON body."""
+    return mock.Mock(**{'json.return_value': data})
+
+
+class LLMUsageTests(GenerationTestMixin, TestCase):
+    """Metering runs below chat_completion, so these stub the transport (_send) instead."""
+
+    def reply(self, content=QUESTIONS_REPLY, prompt_tokens=120, completion_tokens=80):
+        return {
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens},
+        }
+
+    def send(self, **kwargs):
+        return mock.patch('course.llm._send', side_effect=lambda path, payload, **options: sent(self.reply(**kwargs)))
+
+    @override_settings(GENERATION_JOBS_EAGER=True)
+    def test_jobs_book_reported_tokens_to_user_and_course(self):
+        with self.send() as send:
+            self.assertEqual(self.generate_questions().data['status'], 'succeeded')
+            friction = Lesson.objects.create(course=self.course, title='Friction', type='practice')
+            response = self.generate_questions(lesson_id=friction.pk, lesson_topic='Friction')
+            self.assertEqual(response.data['status'], 'succeeded')
+        # A reply budget sized for two questions, instead of a fixed 1000 tokens
+        self.assertEqual(send.call_args.args[1]['max_tokens'], 2 * 90 + 100)
+
+        row = LLMUsage.objects.get()
+        self.assertEqual((row.user, row.course), (self.teacher, self.course))
+        self.assertEqual((row.requests, row.prompt_tokens, row.completion_tokens), (2, 240, 160))
+
+    @override_settings(GENERATION_JOBS_EAGER=True, LLM_USER_REQUESTS_PER_MINUTE=1)
+    def test_rate_limit_refuses_calls_per_user_before_sending(self):
+        with self.send() as send:
+            self.assertEqual(self.generate_questions().status_code, 202)
+            response = self.generate_questions(lesson_topic='Friction')
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(0 < int(response['Retry-After']) <= 60)
+
+            other = self.make_user('teacher', 'other@example.com')
+            self.client.force_authenticate(other)
+            course = Course.objects.create(title='Physics', description='', author=other)
+            friction = Lesson.objects.create(course=course, title='Friction', type='practice')
+            response = self.generate_questions(course_id=course.pk, lesson_id=friction.pk, lesson_topic='Friction')
+            self.assertEqual(response.status_code, 202)
+        self.assertEqual(send.call_count, 2)
+
+    @override_settings(LLM_USER_TOKENS_PER_MINUTE=1000)
+    def test_unspent_reservations_are_given_back(self):
+        messages = [{'role': 'user', 'content': 'hi'}]
+        with self.send(prompt_tokens=3, completion_tokens=1) as send, \
+                mock.patch('course.usage._clock', return_value=1000.0), \
+                usage.scope(self.teacher.pk, self.course.pk) as scope:
+            # Each call reserves 901 tokens and spends 4; without refunds the second could not start
+            llm.chat_completion(messages, max_tokens=900)
+            llm.chat_completion(messages, max_tokens=900)
+            with self.assertRaises(usage.RateLimited):
+                llm.chat_completion(messages, max_tokens=2000)
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual((scope.requests, scope.prompt_tokens, scope.completion_tokens), (2, 6, 2))
+
+    @override_settings(LLM_USER_REQUESTS_PER_MINUTE=10)
+    def test_concurrent_charges_never_overdraw_a_bucket(self):
+        granted = []
+        with mock.patch('course.usage._clock', return_value=1000.0):
+            threads = [threading.Thread(target=lambda: granted.append(usage.take('user:1', 1) == 0)) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(granted.count(True), 10)
+
+    def test_bucket_updates_wait_for_a_lock_held_in_the_cache(self):
+        cache = caches[settings.LLM_RATE_LIMIT_CACHE_ALIAS]
+        # As another process sharing the cache would hold it
+        self.assertTrue(cache.add('llm-bucket:user:1:lock', 1, 5))
+        charged = threading.Event()
+        thread = threading.Thread(target=lambda: (usage.take('user:1', 1), charged.set()))
+        thread.start()
+        self.assertFalse(charged.wait(0.1))
+        cache.delete('llm-bucket:user:1:lock')
+        thread.join(5)
+        self.assertTrue(charged.is_set())
+
+    def test_streams_are_metered_from_the_usage_chunk(self):
+        chunks = [
+            f"data: {json.dumps({'choices': [{'delta': {'content': '# Waves'}}]})}",
+            f"data: {json.dumps({'choices': [], 'usage': {'prompt_tokens': 30, 'completion_tokens': 2}})}",
+            'data: [DONE]',
+        ]
+        response = mock.Mock(**{'iter_lines.return_value': chunks})
+        with mock.patch('course.llm._send', return_value=response) as send, usage.scope(self.teacher.pk) as scope:
+            self.assertEqual(list(llm.stream_chat_completion([{'role': 'user', 'content': 'hi'}])), ['# Waves'])
+        self.assertTrue(send.call_args.args[1]['stream_options']['include_usage'])
+        self.assertEqual((scope.requests, scope.prompt_tokens, scope.completion_tokens), (1, 30, 2))
+        self.assertFalse(LLMUsage.objects.get().course_id)
+
+    @override_settings(LLM_USER_REQUESTS_PER_MINUTE=1)
+    async def test_async_view_meters_the_bearer_and_limits_them(self):
+        async def asend(path, payload, **options):
+            return sent(self.reply())
+
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        access = (await sync_to_async(tokens_for_user)(self.teacher))['access']
+        headers = {'Authorization': f'Bearer {access}'}
+        url = reverse('generate-questions-async')
+        with mock.patch('course.llm._asend', asend):
+            response = await AsyncClient().post(url, payload, content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 201)
+            payload['lesson_topic'] = 'Friction'
+            response = await AsyncClient().post(url, payload, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        row = await LLMUsage.objects.aget()
+        self.assertEqual((row.user_id, row.course_id, row.requests), (self.teacher.pk, self.course.pk, 1))
+
+    async def test_async_calls_wait_for_the_bucket_lock_without_blocking_the_loop(self):
+        async def asend(path, payload, **options):
+            return sent(self.reply())
+
+        cache = caches[settings.LLM_RATE_LIMIT_CACHE_ALIAS]
+        lock = f'llm-bucket:user:{self.teacher.pk}:lock'
+        # As another process sharing the cache would hold it
+        self.assertTrue(await cache.aadd(lock, 1, 5))
+        blocking = mock.patch('course.usage.time.sleep', side_effect=AssertionError('time.sleep on the event loop'))
+        with blocking, mock.patch('course.llm._asend', asend):
+            async with usage.ascope(self.teacher.pk, self.course.pk) as scope:
+                call = asyncio.ensure_future(llm.achat_completion([{'role': 'user', 'content': 'hi'}], max_tokens=100))
+                # The loop keeps running other work while the call waits for the lock
+                await asyncio.sleep(0.05)
+                self.assertFalse(call.done())
+                await cache.adelete(lock)
+                await asyncio.wait_for(call, 5)
+        self.assertEqual((scope.requests, scope.prompt_tokens, scope.completion_tokens), (1, 120, 80))
+        self.assertEqual(usage.retry_after(usage.identity(self.teacher.pk)), 0)
+
+    async def test_async_view_rejects_an_expired_bearer_without_calling_the_model(self):
+        token = add_user_claims(AccessToken.for_user(self.teacher), self.teacher)
+        token.set_exp(lifetime=-timedelta(minutes=1))
+        payload = {
+            'course_id': self.course.pk, 'lesson_id': self.practice.pk,
+            'student_interests': ['football'], 'lesson_topic': 'Newton laws', 'num_questions': 2,
+        }
+        with mock.patch('course.llm._asend') as asend:
+            response = await AsyncClient().post(
+                reverse('generate-questions-async'), payload, content_type='application/json',
+                headers={'Authorization': f'Bearer {token}'},
+            )
+        self.assertEqual(response.status_code, 401)
+        asend.assert_not_called()
+        self.assertFalse(await LLMUsage.objects.aexists())
+
+    def test_usage_report_is_admin_only_and_groups_usage(self):
+        today = timezone.localdate()
+        student = self.make_user('student')
+        other = Course.objects.create(title='Chemistry', description='', author=self.teacher)
+        LLMUsage.objects.create(user=self.teacher, course=self.course, day=today, requests=3, prompt_tokens=3000, completion_tokens=1000)
+        LLMUsage.objects.create(user=self.teacher, course=other, day=today, requests=1, prompt_tokens=500, completion_tokens=500)
+        LLMUsage.objects.create(user=student, course=other, day=today, requests=2, prompt_tokens=9000, completion_tokens=1000)
+        LLMUsage.objects.create(user=student, course=other, day=today - timedelta(days=40), requests=5, prompt_tokens=1, completion_tokens=1)
+
+        url = reverse('llm-usage')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(self.make_user('admin'))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['id'], row['requests'], row['total_tokens']) for row in response.data['rows']],
+            [(student.pk, 2, 10000), (self.teacher.pk, 4, 5000)],
+        )
+        self.assertEqual(response.data['rows'][1]['name'], 'teacher@example.com')
+        self.assertAlmostEqual(response.data['totals']['cost'], usage.cost(12500, 2500))
+
+        response = self.client.get(url, {'group_by': 'course', 'since': (today - timedelta(days=60)).isoformat()})
+        self.assertEqual(
+            [(row['name'], row['requests']) for row in response.data['rows']],
+            [('Chemistry', 8), ('Physics', 3)],
+        )
+        self.assertEqual(self.client.get(url, {'since': today.isoformat(), 'until': (today - timedelta(days=1)).isoformat()}).status_code, 400)
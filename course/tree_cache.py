@@ -0,0 +1,154 @@
+"""
+Cache of serialized course trees (course -> lessons -> questions) and of
+single lesson payloads.
+
+Every course and lesson has a version token that is replaced whenever it,
+or anything nested in it, changes (see receivers.py). Payloads are cached
+once per role, because students must never receive correct answers. Each
+entry carries the version it was built from, so a hot read is a single
+cache get, and the version doubles as the ETag for conditional requests.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from accounts.permissions import ANSWER_ROLES, PAYLOAD_ROLES
+from ongo import metrics
+
+COURSE = 'course-tree'
+LESSON = 'lesson'
+
+
+def _cache():
+    return caches[settings.COURSE_TREE_CACHE_ALIAS]
+
+
+def _version_key(kind, object_id):
+    return f"{kind}-version:{object_id}"
+
+
+def _entry_key(kind, object_id, role):
+    return f"{kind}:{object_id}:{role}"
+
+
+def get_version(kind, object_id):
+    cache = _cache()
+    version = cache.get(_version_key(kind, object_id))
+    if version is None:
+        cache.add(_version_key(kind, object_id), uuid.uuid4().hex, timeout=None)
+        version = cache.get(_version_key(kind, object_id))
+    return version
+
+
+def invalidate(kind, object_id):
+    cache = _cache()
+    cache.set(_version_key(kind, object_id), uuid.uuid4().hex, timeout=None)
+    cache.delete_many([_entry_key(kind, object_id, role) for role in PAYLOAD_ROLES])
+
+
+def invalidate_course(course_id):
+    invalidate(COURSE, course_id)
+
+
+def invalidate_lesson(lesson_id):
+    invalidate(LESSON, lesson_id)
+
+
+def make_etag(kind, object_id, version, role):
+    return f'"{kind}-{object_id}-{version}-{role}"'
+
+
+def _not_modified(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return '*' in etags or etag in etags
+
+
+def build_course_tree(course_id):
+    from .fast_serializers import serialize_course_tree
+
+    tree = serialize_course_tree(course_id)
+    if tree is None:
+        raise Http404
+    return tree
+
+
+def build_lesson(lesson_id):
+    from .fast_serializers import serialize_lesson
+
+    lesson = serialize_lesson(lesson_id)
+    if lesson is None:
+        raise Http404
+    return lesson
+
+
+def _without_answers(lesson):
+    questions = [{k: v for k, v in q.items() if k != 'correct_answer'} for q in lesson['questions']]
+    return {**lesson, 'questions': questions}
+
+
+def hide_course_answers(tree):
+    return {**tree, 'lessons': [_without_answers(lesson) for lesson in tree['lessons']]}
+
+
+# kind -> (builder of the full payload, derivation of the answer-free variant)
+BUILDERS = {
+    COURSE: (build_course_tree, hide_course_answers),
+    LESSON: (build_lesson, _without_answers),
+}
+
+
+def get_payload(kind, object_id, role):
+    """Return (version, data) for one role, caching every role's variant on a miss."""
+    cache = _cache()
+    entry = cache.get(_entry_key(kind, object_id, role))
+    if entry is not None:
+        return entry['version'], entry['data']
+
+    version = get_version(kind, object_id)
+    build, hide = BUILDERS[kind]
+    with metrics.timed('serialize'):
+        full = build(object_id)
+        variants = {False: full, True: hide(full)}
+    entries = {
+        _entry_key(kind, object_id, each): {'version': version, 'data': variants[each not in ANSWER_ROLES]}
+        for each in PAYLOAD_ROLES
+    }
+    cache.set_many(entries, settings.COURSE_TREE_CACHE_TTL)
+    # A write may have landed while we were building; don't keep payloads older than it
+    if cache.get(_version_key(kind, object_id)) != version:
+        cache.delete_many(list(entries))
+    return version, variants[role not in ANSWER_ROLES]
+
+
+def payload_response(request, kind, object_id, role):
+    """
+    Serve a cached payload with an ETag, answering If-None-Match with 304
+    before anything is serialized.
+    """
+    try:
+        object_id = int(object_id)
+    except (TypeError, ValueError):
+        raise Http404
+
+    entry = _cache().get(_entry_key(kind, object_id, role))
+    if entry is None and request.headers.get('If-None-Match'):
+        etag = make_etag(kind, object_id, get_version(kind, object_id), role)
+        if _not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    if entry is not None:
+        version, data = entry['version'], entry['data']
+    else:
+        version, data = get_payload(kind, object_id, role)
+    etag = make_etag(kind, object_id, version, role)
+    if _not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(data, headers={'ETag': etag})
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CourseViewSet, LessonViewSet, GenerateQuestionsView, GenerateReadingContentView, CoursesMyView, CoursesByIDView 
+from . import async_views
+from .views import CourseViewSet, LessonViewSet, GenerateQuestionsView, GenerateReadingContentView, GenerateCourseContentView, GenerationJobViewSet, CoursesMyView, CoursesByIDView, SearchView, UsageReportView
 
 
 router = DefaultRouter()
@@ -8,8 +9,14 @@ router.register(r'courses', CourseViewSet)
 router.register(r'lessons', LessonViewSet)
 router.register(r'generate-questions', GenerateQuestionsView, basename='generate-questions')
 router.register(r'generate-reading', GenerateReadingContentView, basename='generate-reading')
+router.register(r'generate-course', GenerateCourseContentView, basename='generate-course')
+router.register(r'generation-jobs', GenerationJobViewSet, basename='generation-job')
 
 urlpatterns = [
+    path('generate-questions/generate-async/', async_views.generate_questions, name='generate-questions-async'),
+    path('generate-reading/generate-async/', async_views.generate_reading, name='generate-reading-async'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('usage/', UsageReportView.as_view(), name='llm-usage'),
     path('', include(router.urls)),
     path('course/my/', CoursesMyView.as_view(), name='courses-my'),
     path('course/<int:pk>/', CoursesByIDView.as_view(), name='courses-by-id'),
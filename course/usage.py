@@ -0,0 +1,420 @@
+"""
+Accounting and per-user rate limiting of outbound LLM calls.
+
+Views and jobs open a scope() naming who a generation runs for: the user
+and course its usage is booked to, and the identity whose token buckets
+pay for it. llm.py meters every call against the current scope. Before a
+call leaves the process, the identity's buckets (requests and tokens per
+minute) are charged its worst case, the prompt estimate plus max_tokens,
+and a call they cannot cover raises RateLimited without being sent. The
+buckets live in the cache, so the check is a get and a set, never a query;
+a lock held in the same cache keeps concurrent updates from every process
+from overwriting each other. Async calls go through ametered(), which waits
+for that lock with the cache's async methods instead of blocking the event
+loop. Limits only hold across processes when
+LLM_RATE_LIMIT_CACHE_ALIAS names a shared backend.
+Once the response is in, the buckets get back whatever its reported usage
+shows was not spent, and the usage is added up on the scope. The totals are
+written to LLMUsage once, when the scope closes, on the thread that opened it.
+
+Calls made outside any scope (the shell, benchmarks) are neither limited nor recorded.
+"""
+import asyncio
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Subquery, Sum
+from django.utils import timezone
+
+from .models import LLMUsage
+
+# Estimates without a tokenizer: English runs about four characters a token
+CHARS_PER_TOKEN = 4
+# Reply tokens reserved for a call that does not set max_tokens
+DEFAULT_REPLY_TOKENS = 1000
+
+_current = contextvars.ContextVar('llm_usage_scope', default=None)
+_clock = time.time
+
+# Seconds after which a bucket lock whose holder died is taken over
+BUCKET_LOCK_TIMEOUT = 2
+BUCKET_LOCK_POLL = 0.005
+
+
+class RateLimited(Exception):
+    """The caller's buckets cannot cover a call; nothing was sent."""
+
+    def __init__(self, retry_after):
+        self.retry_after = math.ceil(retry_after)
+        super().__init__(f"Generation rate limit exceeded, retry in {self.retry_after}s")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prompt_tokens(payload):
+    if 'messages' in payload:
+        return sum(estimate_tokens(message.get('content') or '') for message in payload['messages'])
+    return estimate_tokens(payload.get('prompt') or '')
+
+
+def reply_tokens(payload):
+    return (payload.get('max_tokens') or DEFAULT_REPLY_TOKENS) * payload.get('n', 1)
+
+
+def identity(user_id=None):
+    """The bucket key for a caller. Anonymous callers, where generation is open to them, share one."""
+    return f'user:{user_id}' if user_id is not None else 'anonymous'
+
+
+def caller_id(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+# Token buckets
+
+def _limits():
+    return {
+        'requests': settings.LLM_USER_REQUESTS_PER_MINUTE,
+        'tokens': settings.LLM_USER_TOKENS_PER_MINUTE,
+    }
+
+
+def _bucket_key(identity):
+    return f'llm-bucket:{identity}'
+
+
+def _levels(state, limits, now):
+    """Bucket levels refilled up to now. A missing bucket is full: one idle for a minute would be."""
+    if state is None:
+        return dict(limits)
+    levels, updated_at = state
+    elapsed = max(now - updated_at, 0)
+    return {name: min(limit, levels[name] + limit * elapsed / 60) for name, limit in limits.items()}
+
+
+def _wait(levels, limits, amounts):
+    """Seconds until every bucket holds its amount; an amount above the limit waits for a full bucket."""
+    return max(
+        (min(amounts[name], limit) - levels[name]) * 60 / limit if limit else 0
+        for name, limit in limits.items()
+    )
+
+
+@contextmanager
+def _bucket_lock(cache, identity):
+    """Hold the identity's bucket lock, an add()-ed key that every process sharing the cache sees."""
+    key = f'{_bucket_key(identity)}:lock'
+    while not cache.add(key, 1, BUCKET_LOCK_TIMEOUT):
+        time.sleep(BUCKET_LOCK_POLL)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+@asynccontextmanager
+async def _abucket_lock(cache, identity):
+    key = f'{_bucket_key(identity)}:lock'
+    while not await cache.aadd(key, 1, BUCKET_LOCK_TIMEOUT):
+        await asyncio.sleep(BUCKET_LOCK_POLL)
+    try:
+        yield
+    finally:
+        await cache.adelete(key)
+
+
+def _update(identity, change):
+    cache = caches[settings.LLM_RATE_LIMIT_CACHE_ALIAS]
+    limits = _limits()
+    with _bucket_lock(cache, identity):
+        now = _clock()
+        levels = _levels(cache.get(_bucket_key(identity)), limits, now)
+        result = change(levels, limits)
+        # Refilled completely after a minute, when the key may as well be gone
+        cache.set(_bucket_key(identity), (levels, now), 60)
+    return result
+
+
+async def _aupdate(identity, change):
+    cache = caches[settings.LLM_RATE_LIMIT_CACHE_ALIAS]
+    limits = _limits()
+    async with _abucket_lock(cache, identity):
+        now = _clock()
+        levels = _levels(await cache.aget(_bucket_key(identity)), limits, now)
+        result = change(levels, limits)
+        await cache.aset(_bucket_key(identity), (levels, now), 60)
+    return result
+
+
+def _charge(amounts):
+    def change(levels, limits):
+        wait = _wait(levels, limits, amounts)
+        if wait <= 0:
+            for name in levels:
+                levels[name] -= amounts[name]
+        return max(wait, 0)
+
+    return change
+
+
+def _refund(tokens):
+    def change(levels, limits):
+        levels['tokens'] = min(limits['tokens'], levels['tokens'] + tokens)
+
+    return change
+
+
+def take(identity, tokens, requests=1):
+    """Charge the buckets if they cover the amounts and return 0, else return the seconds to wait."""
+    return _update(identity, _charge({'requests': requests, 'tokens': tokens}))
+
+
+async def atake(identity, tokens, requests=1):
+    return await _aupdate(identity, _charge({'requests': requests, 'tokens': tokens}))
+
+
+def give_back(identity, tokens):
+    """Return unspent tokens to the bucket; negative amounts charge an overrun."""
+    _update(identity, _refund(tokens))
+
+
+async def agive_back(identity, tokens):
+    await _aupdate(identity, _refund(tokens))
+
+
+def retry_after(identity):
+    """Seconds until the identity can make a call at all, without charging it; 0 when it can now."""
+    if not settings.LLM_RATE_LIMIT_ENABLED:
+        return 0
+    cache = caches[settings.LLM_RATE_LIMIT_CACHE_ALIAS]
+    limits = _limits()
+    levels = _levels(cache.get(_bucket_key(identity)), limits, _clock())
+    return max(_wait(levels, limits, {'requests': 1, 'tokens': 1}), 0)
+
+
+# Scopes
+
+class Scope:
+    """Usage of the calls made for one user and course, added up across threads."""
+
+    def __init__(self, identity, user_id=None, course_id=None):
+        self.identity = identity
+        self.user_id = user_id
+        self.course_id = course_id
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+def _open(user_id, course_id, key):
+    opened = Scope(key or identity(user_id), user_id, course_id)
+    _current.set(opened)
+    return opened
+
+
+@contextmanager
+def scope(user_id=None, course_id=None, key=None):
+    """Meter the calls made inside against user_id and course_id; key overrides the bucket identity."""
+    previous = _current.get()
+    opened = _open(user_id, course_id, key)
+    try:
+        yield opened
+    finally:
+        # set() rather than reset(): a streaming response may close the scope in another copy of the context
+        _current.set(previous)
+        flush(opened)
+
+
+@asynccontextmanager
+async def ascope(user_id=None, course_id=None, key=None):
+    previous = _current.get()
+    opened = _open(user_id, course_id, key)
+    try:
+        yield opened
+    finally:
+        _current.set(previous)
+        await sync_to_async(flush)(opened)
+
+
+def propagate(fn):
+    """
+    fn bound to a copy of the caller's context, so that a pool thread running
+    it meters its calls against the caller's scope. Copy once per submit: a
+    context cannot be entered by two threads at once.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def flush(current):
+    """Add a scope's totals to its LLMUsage row for today."""
+    if not current.requests:
+        return
+    lookup = {'user_id': current.user_id, 'course_id': current.course_id, 'day': timezone.localdate()}
+    counts = {
+        'requests': current.requests,
+        'prompt_tokens': current.prompt_tokens,
+        'completion_tokens': current.completion_tokens,
+    }
+    # Only the day's first row is updated: two racing first writes may leave two rows, which the report sums
+    # anyway. One statement finds and updates it; the insert only runs for the first calls of a day.
+    first = LLMUsage.objects.filter(**lookup).order_by('pk').values('pk')[:1]
+    updated = LLMUsage.objects.filter(pk=Subquery(first)).update(
+        updated_at=timezone.now(), **{field: F(field) + count for field, count in counts.items()}
+    )
+    if not updated:
+        LLMUsage.objects.create(**lookup, **counts)
+
+
+# Metering
+
+class Meter:
+    """What one call spent: the usage its response reported, or an estimate from the text received."""
+
+    def __init__(self, prompt_estimate=0):
+        self.prompt_estimate = prompt_estimate
+        self.usage = None
+        self.reply_chars = 0
+
+    def record(self, response):
+        """Take the usage from a decoded response, or from a usage chunk of a stream."""
+        if response.get('usage'):
+            self.usage = response['usage']
+            return
+        for choice in response.get('choices', []):
+            self.add_text((choice.get('message') or {}).get('content') or choice.get('text') or '')
+
+    def add_text(self, text):
+        self.reply_chars += len(text)
+
+    def spent(self):
+        """(prompt tokens, completion tokens), or None when the call produced nothing."""
+        if self.usage:
+            return self.usage.get('prompt_tokens', 0), self.usage.get('completion_tokens', 0)
+        if self.reply_chars:
+            return self.prompt_estimate, math.ceil(self.reply_chars / CHARS_PER_TOKEN)
+        return None
+
+
+@contextmanager
+def metered(payload):
+    """
+    Wrap one outbound call: charge the current scope's buckets before it is
+    sent, raising RateLimited when they cannot cover it, and account for the
+    Meter the caller fills in once the call ends, however it ends.
+    """
+    current = _current.get()
+    if current is None:
+        yield Meter()
+        return
+    meter = Meter(prompt_tokens(payload))
+    reserved = meter.prompt_estimate + reply_tokens(payload)
+    limited = settings.LLM_RATE_LIMIT_ENABLED
+    if limited:
+        wait = take(current.identity, reserved)
+        if wait:
+            raise RateLimited(wait)
+    try:
+        yield meter
+    finally:
+        unspent = _settle(current, meter, reserved)
+        if limited:
+            give_back(current.identity, unspent)
+
+
+@asynccontextmanager
+async def ametered(payload):
+    """metered() for calls awaited on the event loop."""
+    current = _current.get()
+    if current is None:
+        yield Meter()
+        return
+    meter = Meter(prompt_tokens(payload))
+    reserved = meter.prompt_estimate + reply_tokens(payload)
+    limited = settings.LLM_RATE_LIMIT_ENABLED
+    if limited:
+        wait = await atake(current.identity, reserved)
+        if wait:
+            raise RateLimited(wait)
+    try:
+        yield meter
+    finally:
+        unspent = _settle(current, meter, reserved)
+        if limited:
+            await agive_back(current.identity, unspent)
+
+
+def _settle(current, meter, reserved):
+    """Add what the call spent to the scope and return what it left of the reservation."""
+    spent = meter.spent()
+    if spent is not None:
+        current.add(*spent)
+    return reserved - sum(spent or (0, 0))
+
+
+# Reporting
+
+REPORT_GROUPS = {
+    'user': ('user_id', 'user__email'),
+    'course': ('course_id', 'course__title'),
+}
+
+
+def cost(prompt_tokens, completion_tokens):
+    """USD at the configured per-1000-token prices."""
+    return (
+        prompt_tokens * settings.LLM_PROMPT_COST_PER_1K + completion_tokens * settings.LLM_COMPLETION_COST_PER_1K
+    ) / 1000
+
+
+def _figures(requests, prompt_tokens, completion_tokens):
+    return {
+        'requests': requests or 0,
+        'prompt_tokens': prompt_tokens or 0,
+        'completion_tokens': completion_tokens or 0,
+        'total_tokens': (prompt_tokens or 0) + (completion_tokens or 0),
+        'cost': cost(prompt_tokens or 0, completion_tokens or 0),
+    }
+
+
+def report(since, until, group_by='user'):
+    """
+    Usage between two days inclusive, one row per user or course, heaviest
+    first, and the totals across all of them. Calls made outside a course and
+    usage of deleted users or courses are grouped under an id of None.
+    """
+    key, name = REPORT_GROUPS[group_by]
+    sums = {
+        'calls': Sum('requests'),
+        'prompt': Sum('prompt_tokens'),
+        'completion': Sum('completion_tokens'),
+    }
+    entries = LLMUsage.objects.filter(day__range=(since, until))
+    rows = (
+        entries.values(key, name)
+        .annotate(**sums, total=Sum(F('prompt_tokens') + F('completion_tokens')))
+        .order_by('-total', key)
+    )
+    totals = entries.aggregate(**sums)
+    return {
+        'rows': [
+            {'id': row[key], 'name': row[name], **_figures(row['calls'], row['prompt'], row['completion'])}
+            for row in rows
+        ],
+        'totals': _figures(totals['calls'], totals['prompt'], totals['completion']),
+    }
@@ -1,10 +1,9 @@
-import openai
+from . import llm
 
 def generate_lesson_content(prompt):
-    openai.api_key = 'your-openai-api-key'
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=prompt,
+    response = llm.text_completion(
+        prompt,
+        model="text-davinci-003",
         max_tokens=150
     )
-    return response.choices[0].text.strip()
+    return response['choices'][0]['text'].strip()
@@ -1,29 +1,85 @@
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Course, Lesson, Question, TrueFalseQuestion, MultipleChoiceQuestion, Answer
-from .serializers import CourseSerializer, LessonSerializer, QuestionSerializer, TrueFalseQuestionSerializer, MultipleChoiceQuestionSerializer, AnswerSerializer, GenerateQuestionsSerializer, GenerateReadingContentSerializer
+from . import generation, grading, jobs, progress, search, tree_cache, usage
+from .models import Course, Lesson, Question, Answer, GenerationJob
+from .pagination import CourseCursorPagination, GenerationJobCursorPagination, ProgressCursorPagination, SearchPagination
+from .serializers import CourseSerializer, CourseSummarySerializer, LessonSerializer, QuestionSerializer, TrueFalseQuestionSerializer, MultipleChoiceQuestionSerializer, AnswerSerializer, GenerateQuestionsSerializer, GenerateQuestionBankSerializer, GenerateReadingContentSerializer, GenerateCourseContentSerializer, GenerationJobSerializer, SubmitAnswersSerializer, SubmissionSerializer, CourseAnalyticsSerializer, CourseProgressSerializer, SearchQuerySerializer, SearchResultSerializer, UsageReportQuerySerializer, UsageReportSerializer
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from django.core.exceptions import ObjectDoesNotExist
-import openai
-from django.conf import settings
 from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.views import APIView
 
-from accounts.permissions import IsTeacher
+from accounts.permissions import IsAdmin, IsTeacher, is_admin, payload_role
+from ongo.views import TimedSerializationMixin
 from rest_framework.permissions import IsAuthenticated
 
 
-openai.api_key = settings.OPENAI_API_KEY
-
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(TimedSerializationMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CourseCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.with_lesson_count()
+        elif self.action == 'retrieve':
+            queryset = queryset.with_lessons()
+        return queryset
+
+    def get_serializer_class(self):
+        # The full lesson/question tree is only served from the detail route
+        if self.action == 'list':
+            return CourseSummarySerializer
+        return super().get_serializer_class()
+
+    def retrieve(self, request, *args, **kwargs):
+        return tree_cache.payload_response(request, tree_cache.COURSE, kwargs['pk'], payload_role(request.user))
 
     def perform_create(self, serializer):
         serializer.save()
 
+    def _own_course(self, request, pk):
+        # Analytics are only visible to the course author, as in CoursesMyView
+        return Course.objects.filter(pk=pk, author_id=request.user.id).select_related('analytics').first()
+
+    @swagger_auto_schema(method='get', responses={200: CourseAnalyticsSerializer()})
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Completion and average score across every student of the course, read
+        from the materialized aggregates.
+        """
+        course = self._own_course(request, pk)
+        if course is None:
+            return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        analytics = getattr(course, 'analytics', None)
+        practice_lessons = course.lessons.filter(type='practice').count()
+        return Response(CourseAnalyticsSerializer(progress.summarize(analytics, practice_lessons)).data)
+
+    @swagger_auto_schema(method='get', responses={200: CourseProgressSerializer(many=True)})
+    @action(detail=True, methods=['get'], url_path='analytics/students')
+    def student_progress(self, request, pk=None):
+        """
+        Per-student progress in the course, most recently active first.
+        """
+        course = self._own_course(request, pk)
+        if course is None:
+            return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        paginator = ProgressCursorPagination()
+        page = paginator.paginate_queryset(course.progress.select_related('student'), request, view=self)
+        return paginator.get_paginated_response(CourseProgressSerializer(page, many=True).data)
+
     @swagger_auto_schema(
         method='post',
         request_body=LessonSerializer,
@@ -35,34 +91,52 @@ class CourseViewSet(viewsets.ModelViewSet):
         Add a new lesson to the course.
         """
         course = self.get_object()
-        serializer = LessonSerializer(data=request.data)
+        serializer = LessonSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             serializer.save(course=course)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(TimedSerializationMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [permissions.AllowAny]
 
-    @action(detail=True, methods=['post'])
-    def add_question(self, request, pk=None):
-        lesson = self.get_object()
-        if lesson.type != 'practice':
-            return Response({"error": "Questions can only be added to practice lessons"}, status=status.HTTP_400_BAD_REQUEST)
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.prefetch_related(
+                Prefetch('questions', queryset=Question.objects.select_subclasses().order_by('id'))
+            )
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        # Students and anonymous callers get the cached variant without correct answers
+        return tree_cache.payload_response(request, tree_cache.LESSON, kwargs['pk'], payload_role(request.user))
 
-        question_type = request.data.get('type')
-        question_data = request.data.copy()
+    max_batch_questions = 1000
+
+    def _question_serializer(self, question_data):
+        question_type = question_data.get('type')
+        question_data = question_data.copy()
 
         if question_type == 'multiple_choice':
-            serializer = MultipleChoiceQuestionSerializer(data=question_data)
+            return MultipleChoiceQuestionSerializer(data=question_data)
         elif question_type == 'true_false':
             if isinstance(question_data.get('correct_answer'), bool):
                 question_data['correct_answer'] = str(question_data['correct_answer']).lower()
-            serializer = TrueFalseQuestionSerializer(data=question_data)
-        else:
+            return TrueFalseQuestionSerializer(data=question_data)
+        return None
+
+    @action(detail=True, methods=['post'])
+    def add_question(self, request, pk=None):
+        lesson = self.get_object()
+        if lesson.type != 'practice':
+            return Response({"error": "Questions can only be added to practice lessons"}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self._question_serializer(request.data)
+        if serializer is None:
             return Response({"error": "Invalid question type"}, status=status.HTTP_400_BAD_REQUEST)
 
         if serializer.is_valid():
@@ -70,7 +144,69 @@ class LessonViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class QuestionViewSet(viewsets.ModelViewSet):
+    @swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+        responses={201: QuestionSerializer(many=True)}
+    )
+    @action(detail=True, methods=['post'])
+    def add_questions(self, request, pk=None):
+        """
+        Add a list of true/false and multiple-choice questions in a single transaction.
+        Nothing is written unless every question is valid.
+        """
+        lesson = self.get_object()
+        if lesson.type != 'practice':
+            return Response({"error": "Questions can only be added to practice lessons"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(request.data, list) or not request.data:
+            return Response({"error": "Expected a non-empty list of questions"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > self.max_batch_questions:
+            return Response({"error": f"At most {self.max_batch_questions} questions can be added at once"}, status=status.HTTP_400_BAD_REQUEST)
+
+        questions, errors = [], []
+        for question_data in request.data:
+            serializer = self._question_serializer(question_data) if isinstance(question_data, dict) else None
+            if serializer is None:
+                errors.append({"type": ["Invalid question type"]})
+            elif serializer.is_valid():
+                questions.append(serializer.Meta.model(lesson=lesson, **serializer.validated_data))
+                errors.append({})
+            else:
+                errors.append(serializer.errors)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        Question.objects.bulk_create_subclasses(questions)
+        return Response(QuestionSerializer(questions, many=True, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+    @swagger_auto_schema(
+        method='post',
+        request_body=SubmitAnswersSerializer,
+        responses={201: SubmissionSerializer()}
+    )
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def submit(self, request, pk=None):
+        """
+        Grade a student's answers for a whole practice lesson and store them.
+        Questions left unanswered count as incorrect.
+        """
+        lesson = self.get_object()
+        if lesson.type != 'practice':
+            return Response({"error": "Answers can only be submitted for practice lessons"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = SubmitAnswersSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        answer_key = grading.get_answer_key(lesson.pk)
+        results, unknown = grading.grade(answer_key, serializer.validated_data['answers'])
+        if unknown:
+            return Response({"error": "Questions do not belong to this lesson", "questions": unknown}, status=status.HTTP_400_BAD_REQUEST)
+
+        submission = grading.record_submission(lesson, request.user, answer_key, results)
+        submission.results = results
+        return Response(SubmissionSerializer(submission).data, status=status.HTTP_201_CREATED)
+
+class QuestionViewSet(TimedSerializationMixin, viewsets.ModelViewSet):
     queryset = Question.objects.all().select_subclasses()
     serializer_class = QuestionSerializer
     permission_classes = [permissions.AllowAny]
@@ -80,11 +216,30 @@ class AnswerViewSet(viewsets.ModelViewSet):
     serializer_class = AnswerSerializer
     permission_classes = [permissions.AllowAny]
 
+def _rate_limited(request):
+    """A 429 response when the caller's generation rate limit is used up, else None."""
+    wait = usage.retry_after(usage.identity(usage.caller_id(request.user)))
+    if not wait:
+        return None
+    error = usage.RateLimited(wait)
+    return Response(
+        {"error": str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(error.retry_after)}
+    )
+
+
+def _not_author(request, course):
+    if course.author_id != request.user.id:
+        return Response({"error": "Only the course author can generate its content"}, status=status.HTTP_403_FORBIDDEN)
+    return None
+
+
 class GenerateQuestionsView(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
     @swagger_auto_schema(
         method='post',
         request_body=GenerateQuestionsSerializer,
-        responses={201: GenerateQuestionsSerializer()}
+        responses={202: GenerationJobSerializer()}
     )
     @action(detail=False, methods=['post'])
     def generate(self, request):
@@ -92,134 +247,309 @@ class GenerateQuestionsView(viewsets.ViewSet):
         if serializer.is_valid():
             course_id = serializer.validated_data['course_id']
             lesson_id = serializer.validated_data['lesson_id']
-            student_interests = serializer.validated_data['student_interests']
-            lesson_topic = serializer.validated_data['lesson_topic']
-            num_questions = serializer.validated_data['num_questions']
-
-            try:
-                course = Course.objects.get(id=course_id)
-                lesson = Lesson.objects.get(id=lesson_id, course=course)
-            except Course.DoesNotExist:
-                return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
-            except Lesson.DoesNotExist:
-                return Response({"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND)
 
-            # Формируем запрос к OpenAI API
-            prompt = f"Create {num_questions} one-choice questions about {lesson_topic} for a {course.title} course. "
-            prompt += f"The questions should be related to the following student interests: {', '.join(student_interests)}. "
-            prompt += f"For each question, provide the question text, four options, and the correct answer index (0-3). Format the response as a JSON list of {num_questions} question objects."
-            prompt += "Provide the response in JSON format. like: [{'question': 'question text', 'options': ['option1', 'option2', 'option3', 'option4'], 'correct_answer_index': 0}, ...]"
-
-            try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=1000,  # Увеличиваем максимальное количество токенов
-                    n=1,
-                    stop=None,
-                    temperature=0.7,
-                )
-
-                # Parse the response from OpenAI
-                questions_data = eval(response.choices[0].message['content'].strip())
-
-                created_questions = []
-                for question_data in questions_data:
-                    question = MultipleChoiceQuestion.objects.create(
-                        lesson=lesson,
-                        text=question_data['question'],
-                        _options=question_data['options'],
-                        correct_answer=question_data['options'][question_data['correct_answer_index']]
-                    )
-                    created_questions.append(question)
-
-                return Response({
-                    "message": f"{num_questions} questions successfully generated",
-                    "questions": QuestionSerializer(created_questions, many=True).data
-                }, status=status.HTTP_201_CREATED)
-
-            except Exception as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # One query on the way in; telling a missing course from a missing lesson costs another only on failure
+            lesson = Lesson.objects.select_related('course').filter(id=lesson_id, course_id=course_id).first()
+            if lesson is None:
+                if not Course.objects.filter(id=course_id).exists():
+                    return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+                return Response({"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND)
+            course = lesson.course
+            forbidden = _not_author(request, course)
+            if forbidden:
+                return forbidden
+
+            params = {
+                'student_interests': serializer.validated_data['student_interests'],
+                'lesson_topic': serializer.validated_data['lesson_topic'],
+                'num_questions': serializer.validated_data['num_questions'],
+            }
+            limited = _rate_limited(request)
+            if limited:
+                return limited
+            job = jobs.enqueue('questions', lesson, params, request.user)
+            return Response(GenerationJobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @swagger_auto_schema(
+        method='post',
+        request_body=GenerateQuestionBankSerializer,
+        responses={202: GenerationJobSerializer()}
+    )
+    @action(detail=False, methods=['post'])
+    def bank(self, request):
+        """
+        Queue generation of large question banks for several practice lessons of a
+        course at once, packed into as few model calls as fit the token budget;
+        the job's result holds the per-lesson status.
+        """
+        serializer = GenerateQuestionBankSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            course = Course.objects.get(id=serializer.validated_data['course_id'])
+        except Course.DoesNotExist:
+            return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        forbidden = _not_author(request, course)
+        if forbidden:
+            return forbidden
+
+        items = serializer.validated_data['lessons']
+        lessons = course.lessons.in_bulk([item['lesson_id'] for item in items])
+        if len(lessons) != len(items):
+            return Response({"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND)
+        if any(lesson.type != 'practice' for lesson in lessons.values()):
+            return Response({"error": "Questions can only be added to practice lessons"}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = {
+            'student_interests': serializer.validated_data['student_interests'],
+            'lessons': [
+                {
+                    'lesson_id': item['lesson_id'],
+                    'lesson_topic': item.get('lesson_topic') or lessons[item['lesson_id']].title,
+                    'num_questions': item['num_questions'],
+                }
+                for item in items
+            ],
+        }
+        limited = _rate_limited(request)
+        if limited:
+            return limited
+        job = jobs.enqueue('bank', None, params, request.user, course=course)
+        return Response(GenerationJobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
+def _sse(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+async def _iterate_async(iterator):
+    """
+    Yield a sync iterator's items to an ASGI server as each is produced. Django
+    would drain a sync iterator into a list before sending anything under ASGI.
+    Every item is pulled on the same thread, which keeps one DB connection.
+    """
+    done = object()
+    while True:
+        item = await sync_to_async(next, thread_sensitive=True)(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def _reading_event_stream(request, lesson, lesson_topic, student_interests):
+    parts = []
+    try:
+        with usage.scope(usage.caller_id(request.user), lesson.course_id):
+            for delta in generation.stream_reading_markdown(lesson.course.title, lesson_topic, student_interests):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        lesson = generation.save_reading_content(lesson, ''.join(parts).strip())
+    except Exception as e:
+        yield _sse({"error": str(e)}, event="error")
+        return
+    yield _sse({
+        "message": "Reading content successfully generated",
+        "lesson": LessonSerializer(lesson, context={'request': request}).data
+    }, event="done")
+
+
 class GenerateReadingContentView(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def _get_reading_lesson(self, request, validated_data):
+        try:
+            course = Course.objects.get(id=validated_data['course_id'])
+            lesson = Lesson.objects.select_related('course').get(id=validated_data['lesson_id'], course=course)
+        except Course.DoesNotExist:
+            return None, Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Lesson.DoesNotExist:
+            return None, Response({"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        forbidden = _not_author(request, course)
+        if forbidden:
+            return None, forbidden
+        if lesson.type != 'reading':
+            return None, Response({"error": "This lesson is not a reading lesson"}, status=status.HTTP_400_BAD_REQUEST)
+        return lesson, None
+
     @swagger_auto_schema(
         method='post',
         request_body=GenerateReadingContentSerializer,
-        responses={201: LessonSerializer()}
+        responses={202: GenerationJobSerializer()}
     )
     @action(detail=False, methods=['post'])
     def generate(self, request):
         serializer = GenerateReadingContentSerializer(data=request.data)
         if serializer.is_valid():
-            course_id = serializer.validated_data['course_id']
-            lesson_id = serializer.validated_data['lesson_id']
-            student_interests = serializer.validated_data['student_interests']
-            lesson_topic = serializer.validated_data['lesson_topic']
-
-            try:
-                course = Course.objects.get(id=course_id)
-                lesson = Lesson.objects.get(id=lesson_id, course=course)
-            except Course.DoesNotExist:
-                return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
-            except Lesson.DoesNotExist:
-                return Response({"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND)
-
-            if lesson.type != 'reading':
-                return Response({"error": "This lesson is not a reading lesson"}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Формируем запрос к OpenAI API
-            prompt = f"Create a detailed explanation of the topic '{lesson_topic}' for a {course.title} course. "
-            prompt += f"The explanation should be tailored to a student with the following interests: {', '.join(student_interests)}. "
-            prompt += "The content should be informative, engaging, and easy to understand. "
-            prompt += "Structure the content with appropriate headings and subheadings. "
-            prompt += "Provide the response in Markdown format."
-
-            try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a knowledgeable and engaging teacher."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=2000,
-                    n=1,
-                    stop=None,
-                    temperature=0.7,
-                )
-
-                # Получаем сгенерированный контент
-                generated_content = response.choices[0].message['content'].strip()
-
-                # Обновляем урок с новым контентом
-                lesson.content = generated_content
-                lesson.save()
-
-                return Response({
-                    "message": "Reading content successfully generated",
-                    "lesson": LessonSerializer(lesson).data
-                }, status=status.HTTP_201_CREATED)
-
-            except Exception as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            lesson, error = self._get_reading_lesson(request, serializer.validated_data)
+            if error:
+                return error
+
+            params = {
+                'student_interests': serializer.validated_data['student_interests'],
+                'lesson_topic': serializer.validated_data['lesson_topic'],
+            }
+            limited = _rate_limited(request)
+            if limited:
+                return limited
+            job = jobs.enqueue('reading', lesson, params, request.user)
+            return Response(GenerationJobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @swagger_auto_schema(
+        method='post',
+        request_body=GenerateReadingContentSerializer,
+        responses={200: 'Server-Sent Events: "data" events carry Markdown deltas, a final "done" event carries the saved lesson'}
+    )
+    @action(detail=False, methods=['post'])
+    def stream(self, request):
+        """
+        Generate reading content and stream it to the client as it is produced.
+        """
+        serializer = GenerateReadingContentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        lesson, error = self._get_reading_lesson(request, serializer.validated_data)
+        if error:
+            return error
+        limited = _rate_limited(request)
+        if limited:
+            return limited
+
+        events = _reading_event_stream(
+            request,
+            lesson,
+            serializer.validated_data['lesson_topic'],
+            serializer.validated_data['student_interests'],
+        )
+        if isinstance(request._request, ASGIRequest):
+            events = _iterate_async(events)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class GenerateCourseContentView(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated, IsTeacher]
 
-class CoursesMyView(ListAPIView):
-    serializer_class = CourseSerializer
+    @swagger_auto_schema(
+        method='post',
+        request_body=GenerateCourseContentSerializer,
+        responses={202: GenerationJobSerializer()}
+    )
+    @action(detail=False, methods=['post'])
+    def generate(self, request):
+        """
+        Queue generation of reading content and practice questions for every
+        lesson of a course; the job's result holds the per-lesson status.
+        """
+        serializer = GenerateCourseContentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            course = Course.objects.get(id=serializer.validated_data['course_id'])
+        except Course.DoesNotExist:
+            return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        forbidden = _not_author(request, course)
+        if forbidden:
+            return forbidden
+
+        limited = _rate_limited(request)
+        if limited:
+            return limited
+        params = {
+            'student_interests': serializer.validated_data['student_interests'],
+            'num_questions': serializer.validated_data['num_questions'],
+        }
+        job = jobs.enqueue('course', None, params, request.user, course=course)
+        return Response(GenerationJobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
+
+class GenerationJobViewSet(TimedSerializationMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Status of queued question, question-bank, reading-content and course generation jobs.
+    """
+    queryset = GenerationJob.objects.all()
+    serializer_class = GenerationJobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = GenerationJobCursorPagination
+
+    def get_queryset(self):
+        # Callers see their own jobs; admins see everyone's
+        queryset = super().get_queryset()
+        if is_admin(self.request.user):
+            return queryset
+        return queryset.filter(created_by_id=self.request.user.id)
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many'):
+            # Expand the questions and lessons of a whole page at once
+            kwargs['context'] = {**self.get_serializer_context(), **GenerationJobSerializer.result_objects(args[0])}
+        return super().get_serializer(*args, **kwargs)
+
+
+class CoursesMyView(TimedSerializationMixin, ListAPIView):
+    serializer_class = CourseSummarySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CourseCursorPagination
 
     def get_queryset(self):
-        return Course.objects.filter(author=self.request.user)
+        return Course.objects.filter(author_id=self.request.user.id).with_lesson_count()
 
 class CoursesByIDView(RetrieveAPIView):
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Course.objects.filter()
+        return Course.objects.with_lessons()
+
+    def retrieve(self, request, *args, **kwargs):
+        return tree_cache.payload_response(request, tree_cache.COURSE, kwargs['pk'], payload_role(request.user))
+
+
+class SearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(query_serializer=SearchQuerySerializer, responses={200: SearchResultSerializer(many=True)})
+    def get(self, request):
+        """
+        Ranked full-text search over course, lesson and question text, optionally
+        narrowed to one kind or one course. Like the course tree, every course is
+        searchable by any signed-in user; answers are never indexed.
+        """
+        params = SearchQuerySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = search.SearchResults(
+            params.validated_data['q'],
+            kind=params.validated_data.get('kind'),
+            course_id=params.validated_data.get('course'),
+        )
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(SearchResultSerializer(page, many=True).data)
+
+
+class UsageReportView(APIView):
+    permission_classes = [IsAdmin]
+
+    @swagger_auto_schema(query_serializer=UsageReportQuerySerializer, responses={200: UsageReportSerializer()})
+    def get(self, request):
+        """
+        LLM calls, tokens and their cost per user or per course over a range of days.
+        """
+        params = UsageReportQuerySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        until = params.validated_data.get('until') or timezone.localdate()
+        since = params.validated_data.get('since') or until - timedelta(days=29)
+        group_by = params.validated_data['group_by']
+        report = {'since': since, 'until': until, 'group_by': group_by, **usage.report(since, until, group_by)}
+        return Response(UsageReportSerializer(report).data)
@@ -0,0 +1,177 @@
+"""
+In-process request metrics.
+
+The instrumentation middleware (middleware.py) opens a RequestTimings for
+each request; code on the request path adds to it with timed(). When the
+request ends every figure is observed into a rolling window per endpoint,
+and the same figures go out in the Server-Timing header. Windows keep the
+last METRICS_WINDOW samples, so percentiles describe recent traffic; sums
+and counts are cumulative, as Prometheus summaries expect.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# name -> help text, in exposition order
+METRICS = {
+    'ongo_request_duration_seconds': 'Request latency by endpoint.',
+    'ongo_request_db_queries': 'Database queries per request by endpoint.',
+    'ongo_request_db_seconds': 'Time spent in database queries per request by endpoint.',
+    'ongo_request_serialize_seconds': 'Time spent building and rendering response payloads per request by endpoint.',
+    'ongo_request_llm_seconds': 'Time spent waiting on OpenAI per request by endpoint.',
+    'ongo_llm_call_seconds': 'Latency of every outbound OpenAI call, including background jobs, by API path.',
+}
+
+
+class Window:
+    """The most recent samples of one series, plus cumulative sum and count."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.sum += value
+        self.count += 1
+
+
+def quantiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {q: 0.0 for q in QUANTILES}
+    return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def observe(self, name, label, value):
+        self.observe_many(label, ((name, value),))
+
+    def observe_many(self, label, values):
+        """Observe several (name, value) pairs sharing one label under a single lock."""
+        with self._lock:
+            for name, value in values:
+                window = self._windows.get((name, label))
+                if window is None:
+                    window = self._windows[(name, label)] = Window(settings.METRICS_WINDOW)
+                window.observe(value)
+
+    def snapshot(self):
+        """{(name, label): (quantiles, sum, count)}, computed outside the lock."""
+        with self._lock:
+            windows = [(key, list(w.samples), w.sum, w.count) for key, w in self._windows.items()]
+        return {key: (quantiles(samples), total, count) for key, samples, total, count in windows}
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+
+registry = Registry()
+
+
+class RequestTimings:
+    """
+    One request's figures. Pool threads working for the request (see
+    usage.propagate) add to them too, so every update takes the lock.
+    """
+    __slots__ = ('db_queries', 'db', 'serialize', 'llm', '_lock')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.llm = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, part, seconds):
+        with self._lock:
+            setattr(self, part, getattr(self, part) + seconds)
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db += seconds
+            self.db_queries += 1
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(part):
+    """Add the block's duration to the current request's 'serialize' or 'llm' time, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(part, time.perf_counter() - start)
+
+
+def observe_llm_call(path, seconds):
+    registry.observe('ongo_llm_call_seconds', ('path', path), seconds)
+
+
+def record_request(endpoint, duration, timings):
+    registry.observe_many(('endpoint', endpoint), (
+        ('ongo_request_duration_seconds', duration),
+        ('ongo_request_db_queries', timings.db_queries),
+        ('ongo_request_db_seconds', timings.db),
+        ('ongo_request_serialize_seconds', timings.serialize),
+        ('ongo_request_llm_seconds', timings.llm),
+    ))
+
+
+def server_timing(duration, timings):
+    parts = [
+        f'db;dur={timings.db * 1000:.2f};desc="{timings.db_queries} queries"',
+        f'serialize;dur={timings.serialize * 1000:.2f}',
+    ]
+    if timings.llm:
+        parts.append(f'llm;dur={timings.llm * 1000:.2f}')
+    parts.append(f'total;dur={duration * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    """The registry in the Prometheus text exposition format (0.0.4), as summaries."""
+    snapshot = registry.snapshot()
+    lines = []
+    for name, help_text in METRICS.items():
+        series = sorted((label, values) for (metric, label), values in snapshot.items() if metric == name)
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} summary')
+        for (label_name, label_value), (by_quantile, total, count) in series:
+            label = f'{label_name}="{_escape(label_value)}"'
+            for q, value in by_quantile.items():
+                lines.append(f'{name}{{{label},quantile="{q}"}} {value:.6g}')
+            lines.append(f'{name}_sum{{{label}}} {total:.6g}')
+            lines.append(f'{name}_count{{{label}}} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,74 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import metrics
+
+
+def _endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match is not None else 'unmatched'
+    return f"{request.method} {name}"
+
+
+class InstrumentationMiddleware:
+    """
+    Times every request, counts and times its queries on the default
+    database, and reports the figures in a Server-Timing header and in the
+    per-endpoint metrics served by MetricsView.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS_ENABLED
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        timings, token = metrics.start_request()
+
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.add_query(time.perf_counter() - start)
+
+        # What connection.execute_wrapper() does, without its context manager overhead
+        wrappers = connections[DEFAULT_DB_ALIAS].execute_wrappers
+        wrappers.append(count_query)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrappers.pop()
+            metrics.end_request(token)
+        return self._finish(request, response, time.perf_counter() - start, timings)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        # Async views reach the database from sync_to_async threads, so only latency and LLM time are seen here
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, time.perf_counter() - start, timings)
+
+    def _finish(self, request, response, duration, timings):
+        # Streaming responses do their work after this point; their timings cover setup only
+        metrics.record_request(_endpoint(request), duration, timings)
+        response['Server-Timing'] = metrics.server_timing(duration, timings)
+        return response
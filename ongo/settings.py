@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ongo.middleware.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -108,12 +110,51 @@ WSGI_APPLICATION = "ongo.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE selects the backend: "sqlite" (default) or "postgresql".
+# DB_NAME names the PostgreSQL database; SQLITE_PATH is the SQLite file.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # psycopg and psycopg-pool (for DB_POOL) are pinned in requirements.txt
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv('DB_NAME', 'ongo'),
+            "USER": os.getenv('DB_USER', ''),
+            "PASSWORD": os.getenv('DB_PASSWORD', ''),
+            "HOST": os.getenv('DB_HOST', 'localhost'),
+            "PORT": os.getenv('DB_PORT', '5432'),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
     }
-}
+    if os.getenv('DB_POOL', 'True') == 'True':
+        # Django's native psycopg pool; it replaces persistent connections (CONN_MAX_AGE must stay 0)
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            "max_size": int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            "timeout": float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv('SQLITE_PATH', BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {},
+        }
+    }
+    if os.getenv('SQLITE_TUNED', 'True') == 'True':
+        DATABASES["default"]["OPTIONS"] = {
+            # Seconds a writer waits for the lock before raising "database is locked"
+            "timeout": float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+            # Take the write lock at BEGIN so writers queue instead of failing on lock upgrade
+            "transaction_mode": "IMMEDIATE",
+            # WAL lets readers run alongside the single writer; NORMAL sync is safe with WAL
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+        }
 
 
 # Password validation
@@ -134,6 +175,18 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The pooled hasher writes and reads the same pbkdf2_sha256 hashes as Django's default. It must be
+# the only pbkdf2_sha256 entry: identify_hasher() picks the last one listed for an algorithm.
+PASSWORD_HASHERS = [
+    "accounts.hashers.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+# Concurrent password hashes per process; 0 means one per CPU
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -176,18 +229,128 @@ import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', 5))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 0.5))
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 20))
+# Keep-alive pool size and cap on concurrent outbound calls, per worker process
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 8))
+
+# Background generation jobs
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 4))
+GENERATION_JOBS_EAGER = os.getenv('GENERATION_JOBS_EAGER', 'False') == 'True'
+# Concurrent OpenAI calls when generating a whole course in one request
+GENERATION_FANOUT_WORKERS = int(os.getenv('GENERATION_FANOUT_WORKERS', 8))
+
+# Packed question generation (course/planner.py): tokens per call, prompt and reply, and questions per lesson per request
+GENERATION_PROMPT_TOKEN_BUDGET = int(os.getenv('GENERATION_PROMPT_TOKEN_BUDGET', 4000))
+GENERATION_MAX_QUESTIONS = int(os.getenv('GENERATION_MAX_QUESTIONS', 200))
+
+# Per-user limits on outbound LLM calls (course/usage.py), as token buckets refilled per minute; 0 turns a bucket off.
+# Buckets live in the cache alias below, which production requires to be a shared backend: with locmem
+# every process keeps its own buckets, so N processes allow N times the limit (check --deploy warns)
+LLM_RATE_LIMIT_ENABLED = os.getenv('LLM_RATE_LIMIT_ENABLED', 'True') == 'True'
+LLM_USER_REQUESTS_PER_MINUTE = int(os.getenv('LLM_USER_REQUESTS_PER_MINUTE', 30))
+LLM_USER_TOKENS_PER_MINUTE = int(os.getenv('LLM_USER_TOKENS_PER_MINUTE', 60000))
+LLM_RATE_LIMIT_CACHE_ALIAS = os.getenv('LLM_RATE_LIMIT_CACHE_ALIAS', 'default')
+# USD per 1000 tokens, for the cost column of the usage report
+LLM_PROMPT_COST_PER_1K = float(os.getenv('LLM_PROMPT_COST_PER_1K', 0.0005))
+LLM_COMPLETION_COST_PER_1K = float(os.getenv('LLM_COMPLETION_COST_PER_1K', 0.0015))
+# Reply budget of a reading lesson
+GENERATION_READING_MAX_TOKENS = int(os.getenv('GENERATION_READING_MAX_TOKENS', 2000))
+
+# Estimated Jaccard similarity of question text at which a generated question is dropped as a near-duplicate
+QUESTION_DEDUP_THRESHOLD = float(os.getenv('QUESTION_DEDUP_THRESHOLD', 0.8))
+
+# Cache of LLM output keyed by normalized prompt inputs; locmem evicts least recently used entries
+GENERATION_CACHE_ALIAS = 'generation'
+
+# Serialized course trees, with the answer keys and dedup signatures derived from
+# them, invalidated on write. A write only invalidates the cache it can reach, so
+# the TTL is the staleness bound of any process that does not share the writer's
+# cache. The alias is separate so that cache churn elsewhere cannot evict version
+# tokens. Each course costs about 4 entries and each lesson about 6. Locmem keeps
+# MAX_ENTRIES pickled payloads per process, a few KB to a few hundred KB each for
+# large trees, so the default holds roughly 50-200 MB at worst.
+COURSE_TREE_CACHE_ALIAS = 'course_tree'
+COURSE_TREE_CACHE_BACKEND = os.getenv(
+    'COURSE_TREE_CACHE_BACKEND', os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+)
+COURSE_TREE_CACHE_TTL = int(os.getenv('COURSE_TREE_CACHE_TTL', 60 * 60))
+
+# The default, course tree and revocation caches hold rate-limit buckets, course
+# trees and revocation markers, all of which must be seen by every process. The
+# latter two follow CACHE_BACKEND/CACHE_LOCATION unless overridden. locmem is per process
+# and only fits a single-process server or development; production with more
+# than one worker requires a shared backend, e.g.
+#   CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   CACHE_LOCATION=redis://127.0.0.1:6379/0
+# or django.core.cache.backends.memcached.PyMemcacheCache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    COURSE_TREE_CACHE_ALIAS: {
+        'BACKEND': COURSE_TREE_CACHE_BACKEND,
+        'LOCATION': os.getenv('COURSE_TREE_CACHE_LOCATION', os.getenv('CACHE_LOCATION') or 'course-tree'),
+        # Redis and memcached evict on their own and reject MAX_ENTRIES
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('COURSE_TREE_CACHE_MAX_ENTRIES', 5000)),
+        } if COURSE_TREE_CACHE_BACKEND.endswith('LocMemCache') else {},
+    },
+    GENERATION_CACHE_ALIAS: {
+        'BACKEND': os.getenv('GENERATION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('GENERATION_CACHE_LOCATION', 'generation'),
+        'TIMEOUT': int(os.getenv('GENERATION_CACHE_TTL', 7 * 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
 
 AUTH_USER_MODEL = 'accounts.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ClaimsJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'ongo.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
+# Request instrumentation (ongo/middleware.py); percentiles cover the last METRICS_WINDOW requests per endpoint
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', 1024))
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'accounts.serializers.ClaimsTokenObtainPairSerializer',
+}
+
+# Revocation markers must be shared by every process (use a shared backend in production);
+# the local TTL, in seconds, lets each process reuse a lookup briefly at the cost of revocation lag.
+# An evicted marker silently re-validates the tokens it revoked, so the markers get an alias that
+# nothing else writes to. Under locmem it never culls: markers expire after the longest token
+# lifetime, so the store is bounded by the users revoked in that window. A Redis backend must not
+# evict keys either (maxmemory-policy noeviction, or a database of its own).
+JWT_REVOCATION_CACHE_ALIAS = 'jwt_revocation'
+JWT_REVOCATION_CACHE_BACKEND = os.getenv(
+    'JWT_REVOCATION_CACHE_BACKEND', os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+)
+CACHES[JWT_REVOCATION_CACHE_ALIAS] = {
+    'BACKEND': JWT_REVOCATION_CACHE_BACKEND,
+    'LOCATION': os.getenv('JWT_REVOCATION_CACHE_LOCATION', os.getenv('CACHE_LOCATION') or 'jwt-revocation'),
+    'OPTIONS': {
+        'MAX_ENTRIES': sys.maxsize,
+    } if JWT_REVOCATION_CACHE_BACKEND.endswith('LocMemCache') else {},
 }
+JWT_REVOCATION_LOCAL_TTL = float(os.getenv('JWT_REVOCATION_LOCAL_TTL', 0))
@@ -0,0 +1,39 @@
+from django.http import HttpResponse
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.permissions import IsAdmin
+from . import metrics
+
+
+class TimedSerializationMixin:
+    """
+    list() and retrieve() of DRF's generic views, with building the serializer
+    and evaluating its data counted as the request's serialize time. Rows are
+    fetched beforehand, so their queries count as db time only.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with metrics.timed('serialize'):
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        rows = list(queryset)
+        with metrics.timed('serialize'):
+            data = self.get_serializer(rows, many=True).data
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with metrics.timed('serialize'):
+            data = self.get_serializer(instance).data
+        return Response(data)
+
+
+class MetricsView(APIView):
+    """Per-endpoint latency, query and LLM timings in the Prometheus text format."""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return HttpResponse(metrics.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')